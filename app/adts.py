@@ -0,0 +1,203 @@
+from __future__ import annotations
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import List, NamedTuple, Tuple
+
+# Indexed by the header's sampling frequency index
+SAMPLE_RATES = (96000, 88200, 64000, 48000, 44100, 32000, 24000, 22050,
+                16000, 12000, 11025, 8000, 7350)
+
+HEADER_LEN = 7
+SAMPLES_PER_BLOCK = 1024
+
+class AdtsHeader(NamedTuple):
+    frame_length : int
+    sample_rate : int
+    duration : float
+
+def parse_header(b : bytes) -> AdtsHeader:
+    """
+    Parses the fixed part of an ADTS frame header. Returns None if the bytes
+    don't look like one.
+    """
+    if len(b) < HEADER_LEN:
+        return None
+
+    # 12-bit syncword, then the layer, which is always 0 for ADTS
+    if b[0] != 0xFF or b[1] & 0xF6 != 0xF0:
+        return None
+
+    sfi = (b[2] >> 2) & 0x0F
+    if sfi >= len(SAMPLE_RATES):
+        return None
+
+    header_len = HEADER_LEN if b[1] & 0x01 else HEADER_LEN + 2
+    frame_length = ((b[3] & 0x03) << 11) | (b[4] << 3) | (b[5] >> 5)
+    if frame_length <= header_len:
+        return None
+
+    blocks = (b[6] & 0x03) + 1
+    sample_rate = SAMPLE_RATES[sfi]
+
+    return AdtsHeader(frame_length, sample_rate,
+                        blocks * SAMPLES_PER_BLOCK / sample_rate)
+
+class AdtsFrameIndex:
+    """
+    Keeps track of where the ADTS frames in a ByteBuffer start, by parsing each
+    frame header once as the data is appended. Offsets are absolute, as in
+    ByteBuffer.write_offset.
+    """
+    _byte_buffer = None
+    _offsets : array = None
+    _durations : array = None
+    _start : int = 0
+    _next_offset : int = 0
+    _synced : bool = False
+    _sample_rate : int = None
+    _lost_sync_count : int = 0
+
+    def __init__(self, byte_buffer) -> None:
+        self._byte_buffer = byte_buffer
+        self._offsets = array('q')
+        self._durations = array('d')
+        self._start = 0
+        self._next_offset = byte_buffer.write_offset
+        self._synced = False
+
+    def __len__(self) -> int:
+        return len(self._offsets) - self._start
+
+    @property
+    def synced(self) -> bool:
+        return self._synced
+
+    @property
+    def sample_rate(self) -> int:
+        return self._sample_rate
+
+    # How many times the parser has had to search for a frame header again
+    # after a header didn't show up where it was expected
+    @property
+    def lost_sync_count(self) -> int:
+        return self._lost_sync_count
+
+    def update(self) -> None:
+        """
+        Indexes any complete frames that have been appended since the last
+        update. Must be called with the buffer's lock held.
+        """
+        bb = self._byte_buffer
+        end = bb.write_offset
+
+        stored = bb.stored_offset
+        if self._next_offset < stored:
+            # The data we were waiting on was overwritten before we got to it
+            self._next_offset = stored
+            self._synced = False
+        self._evict(stored)
+
+        while True:
+            if not self._synced and not self._resync(end):
+                return
+
+            if self._next_offset + HEADER_LEN > end:
+                return
+
+            header = parse_header(bb.readAtOffset(self._next_offset, HEADER_LEN))
+            if header is None:
+                self._synced = False
+                self._lost_sync_count += 1
+                continue
+
+            # Only index whole frames
+            if self._next_offset + header.frame_length > end:
+                return
+
+            self._offsets.append(self._next_offset)
+            self._durations.append(header.duration)
+            self._sample_rate = header.sample_rate
+            self._next_offset += header.frame_length
+
+    def _resync(self, end : int) -> bool:
+        # Look for a frame header that's followed by another frame's
+        # syncword, since the syncword alone shows up in plenty of audio data
+        if self._next_offset + HEADER_LEN > end:
+            return False
+
+        data = self._byte_buffer.readAtOffset(self._next_offset, 
+                    end - self._next_offset)
+
+        i = data.find(b'\xff')
+        while i >= 0:
+            header = parse_header(data[i:i + HEADER_LEN])
+            if header is not None:
+                follow = i + header.frame_length
+                if follow + 2 > len(data):
+                    # Wait for the next syncword to show up
+                    self._next_offset += i
+                    return False
+                elif data[follow] == 0xFF and data[follow + 1] & 0xF6 == 0xF0:
+                    self._next_offset += i
+                    self._synced = True
+                    return True
+
+            i = data.find(b'\xff', i + 1)
+
+        # Hang on to the last few bytes, which might be the start of a header
+        # that hasn't fully arrived yet
+        self._next_offset = max(self._next_offset, end - HEADER_LEN + 1)
+        return False
+
+    def _evict(self, offset : int) -> None:
+        i = bisect_left(self._offsets, offset, lo=self._start)
+        if i > self._start:
+            self._start = i
+
+        if self._start > 64 and self._start > len(self):
+            del self._offsets[:self._start]
+            del self._durations[:self._start]
+            self._start = 0
+
+    def frameOffsetAtOrBefore(self, offset : int) -> int:
+        i = bisect_right(self._offsets, offset, lo=self._start) - 1
+        if i < self._start:
+            return None
+        return self._offsets[i]
+
+    def frameOffsetAtOrAfter(self, offset : int) -> int:
+        i = bisect_left(self._offsets, offset, lo=self._start)
+        if i == len(self._offsets):
+            return None
+        return self._offsets[i]
+
+    def nearestFrameOffset(self, offset : int) -> int:
+        """
+        Returns the start of the indexed frame closest to the given offset, or
+        None if no frames are indexed.
+        """
+        before = self.frameOffsetAtOrBefore(offset)
+        after = self.frameOffsetAtOrAfter(offset)
+
+        if before is None:
+            return after
+        elif after is None:
+            return before
+        elif offset - before <= after - offset:
+            return before
+        else:
+            return after
+
+    def framesFrom(self, offset : int) -> List[Tuple[int, float]]:
+        """
+        Returns the start offset and duration of every indexed frame that
+        starts at or after the given offset, oldest first.
+        """
+        i = bisect_left(self._offsets, offset, lo=self._start)
+        return list(zip(self._offsets[i:], self._durations[i:]))
+
+    def frameDurationAt(self, frame_offset : int) -> float:
+        i = bisect_left(self._offsets, frame_offset, lo=self._start)
+        if i == len(self._offsets) or self._offsets[i] != frame_offset:
+            raise ValueError('No frame starts at the given offset')
+        return self._durations[i]
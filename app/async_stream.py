@@ -0,0 +1,856 @@
+from __future__ import annotations
+from collections import deque
+from concurrent.futures import Future
+from datetime import datetime, timedelta
+from itertools import count
+from selenium.common.exceptions import TimeoutException
+from threading import Lock, Thread
+from typing import Awaitable, Callable, Deque, Dict, List, Set
+from urllib.parse import urljoin, urlsplit
+import asyncio, logging, ssl, time
+
+from app.byte_buffer import ByteBuffer
+from app.circuit_breaker import CircuitBreaker, get_circuit_breaker
+from app.get_stream_url import get_stream_url
+from app.stream_health import StreamHealth, is_starved, measure_health, \
+    pick_failover_stream
+
+log = logging.getLogger('RadioRec')
+
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+MAX_REDIRECTS = 5
+HEADER_MAX_LEN = 65536
+
+# How many failover latencies the stream managers remember
+FAILOVER_LATENCY_HISTORY = 100
+
+# How long a stream brought up to replace an aged one has to start getting
+# data, and how long to wait before trying again if it doesn't
+REFRESH_WARMUP_SEC = 30
+REFRESH_RETRY_SEC = 60
+
+class AsyncEngine(Thread):
+    """
+    Runs one asyncio event loop on a daemon thread. Any number of
+    AsyncRadioStreams and AsyncRadioStreamManagers can share it, so a whole
+    process only needs the one thread for its streams.
+    """
+    _loop : asyncio.AbstractEventLoop = None
+    _start_lock : Lock = None
+
+    def __init__(self) -> None:
+        self._loop = asyncio.new_event_loop()
+        self._start_lock = Lock()
+
+        super().__init__(daemon=True, name='AsyncEngine')
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        return self._loop
+
+    def run(self) -> None:
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    def _ensureStarted(self) -> None:
+        with self._start_lock:
+            if not self.is_alive():
+                self.start()
+
+    def submit(self, coro : Awaitable) -> Future:
+        """
+        Schedules coro on the engine's loop from any thread, starting the
+        engine if need be.
+        """
+        self._ensureStarted()
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    def call(self, fn : Callable, *args) -> None:
+        self._ensureStarted()
+        self._loop.call_soon_threadsafe(fn, *args)
+
+    def stop(self) -> None:
+        if not self.is_alive():
+            return
+        self._loop.call_soon_threadsafe(asyncio.ensure_future, 
+            self._shutdown())
+
+    async def _shutdown(self) -> None:
+        # Let everything still going on the loop wind down properly first,
+        # rather than leaving it to be torn down with no loop to run on
+        current = asyncio.current_task()
+        tasks = [task for task in asyncio.all_tasks() if task is not current]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._loop.stop()
+
+_default_engine : AsyncEngine = None
+_default_engine_lock = Lock()
+
+def get_default_engine() -> AsyncEngine:
+    global _default_engine
+    with _default_engine_lock:
+        if _default_engine is None:
+            _default_engine = AsyncEngine()
+        return _default_engine
+
+def find_stream_url(page_url : str, attempts : int = 3) -> str:
+    # Blocking, so it's meant to be run in an executor
+    for i in range(0, attempts):
+        try:
+            streamURL = get_stream_url(page_url=page_url)
+            if streamURL is not None:
+                return streamURL
+        except TimeoutException:
+            log.debug(f"Failed to get stream URL: Attempt #{i + 1}")
+
+    log.warning(f"Ran out of attempts to get stream url")
+    raise RuntimeError("Failed to get a stream URL")
+
+class _ChunkedDecoder:
+    # Undoes HTTP chunked transfer encoding, a piece at a time
+    _size_line : bytearray = None
+    _chunk_remaining : int = 0
+    _skip_crlf : int = 0
+    _done : bool = False
+
+    def __init__(self) -> None:
+        self._size_line = bytearray()
+
+    @property
+    def done(self) -> bool:
+        return self._done
+
+    def feed(self, data : memoryview) -> List[memoryview]:
+        payload = []
+        i = 0
+        while i < len(data) and not self._done:
+            if self._skip_crlf > 0:
+                skip = min(self._skip_crlf, len(data) - i)
+                self._skip_crlf -= skip
+                i += skip
+            elif self._chunk_remaining > 0:
+                take = min(self._chunk_remaining, len(data) - i)
+                payload.append(data[i:i + take])
+                self._chunk_remaining -= take
+                i += take
+                if self._chunk_remaining == 0:
+                    self._skip_crlf = 2
+            else:
+                self._size_line += data[i:i + 1]
+                i += 1
+                if self._size_line.endswith(b'\r\n'):
+                    size = int(self._size_line.split(b';')[0].strip(), 16)
+                    self._size_line.clear()
+                    if size == 0:
+                        self._done = True
+                    self._chunk_remaining = size
+        return payload
+
+class _RadioStreamProtocol(asyncio.BufferedProtocol):
+    """
+    Reads an HTTP response, handing the body to an AsyncRadioStream. Once
+    the headers and the preroll are out of the way, the body is received
+    straight into the stream's ring buffer.
+    """
+    _stream : AsyncRadioStream = None
+    _transport : asyncio.Transport = None
+    _scratch : bytearray = None
+    _header : bytearray = None
+    _headers_done : bool = False
+    _chunked : _ChunkedDecoder = None
+    _preroll_remaining : int = 0
+    _in_ring : bool = False
+    _status : int = None
+    _location : str = None
+    _closed : asyncio.Future = None
+
+    def __init__(self, stream : AsyncRadioStream) -> None:
+        self._stream = stream
+        self._scratch = bytearray(8192)
+        self._header = bytearray()
+        self._preroll_remaining = stream.preroll_len
+        self._closed = asyncio.get_running_loop().create_future()
+
+    @property
+    def status(self) -> int:
+        return self._status
+
+    @property
+    def location(self) -> str:
+        return self._location
+
+    @property
+    def closed(self) -> asyncio.Future:
+        return self._closed
+
+    def connection_made(self, transport : asyncio.Transport) -> None:
+        self._transport = transport
+
+    def get_buffer(self, sizehint : int) -> memoryview:
+        if self._headers_done and self._preroll_remaining == 0 and \
+                self._chunked is None:
+            self._in_ring = True
+            return self._stream.byte_buffer.writeView(len(self._scratch))
+
+        self._in_ring = False
+        return memoryview(self._scratch)
+
+    def buffer_updated(self, nbytes : int) -> None:
+        if self._in_ring:
+            self._stream.byte_buffer.publish(nbytes)
+            self._stream._dataReceived()
+        else:
+            self._receive(memoryview(self._scratch)[:nbytes])
+
+    def _receive(self, data : memoryview) -> None:
+        if not self._headers_done:
+            self._header += data
+            end = self._header.find(b'\r\n\r\n')
+            if end < 0:
+                if len(self._header) > HEADER_MAX_LEN:
+                    log.warning("Radio stream response headers are too long")
+                    self._transport.close()
+                return
+
+            self._parseHeader(bytes(self._header[:end]))
+            data = memoryview(bytes(self._header[end + 4:]))
+            self._header = None
+            if self._transport.is_closing():
+                return
+
+        if self._chunked is not None:
+            for piece in self._chunked.feed(data):
+                self._receiveBody(piece)
+            if self._chunked.done:
+                self._transport.close()
+        else:
+            self._receiveBody(data)
+
+    def _parseHeader(self, header : bytes) -> None:
+        lines = header.decode('iso-8859-1').split('\r\n')
+
+        # SHOUTcast servers answer with "ICY 200 OK"
+        parts = lines[0].split(' ', 2)
+        self._status = int(parts[1]) if len(parts) > 1 and \
+                            parts[1].isdigit() else None
+        self._headers_done = True
+
+        headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        if self._status in REDIRECT_STATUSES and 'location' in headers:
+            self._location = headers['location']
+            self._transport.close()
+        elif self._status != 200:
+            log.warning(f"Radio stream {self._stream.name} got HTTP status " +
+                f"{lines[0]}")
+            self._transport.close()
+        elif headers.get('transfer-encoding', '').lower() == 'chunked':
+            self._chunked = _ChunkedDecoder()
+
+        if self._status == 200 and self._preroll_remaining == 0:
+            self._stream._handleReady()
+
+    def _receiveBody(self, data : memoryview) -> None:
+        if self._preroll_remaining > 0:
+            # Dump preroll data
+            skip = min(self._preroll_remaining, len(data))
+            self._preroll_remaining -= skip
+            data = data[skip:]
+            if self._preroll_remaining == 0:
+                self._stream._handleReady()
+
+        if len(data) > 0:
+            self._stream.byte_buffer.append(data)
+            self._stream._dataReceived()
+
+    def eof_received(self) -> bool:
+        return False
+
+    def connection_lost(self, exc : Exception) -> None:
+        if not self._closed.done():
+            self._closed.set_result(exc)
+
+class AsyncRadioStream:
+    """
+    A RadioStream that runs as a task on an AsyncEngine's loop instead of
+    on a thread of its own. It has the same byte_buffer/start_date/
+    is_alive()/stop() API, so the rest of the code doesn't need to care
+    which kind it has.
+    """
+    _ids = count(1)
+
+    _engine : AsyncEngine = None
+    _byte_buffer : ByteBuffer = None
+    _stream_url : str = None
+    _preroll_len : int = 63500
+    _start_date : datetime = None
+    _name : str = None
+    _future : Future = None
+    _transport : asyncio.Transport = None
+    _should_run : bool = True
+    _on_data : Callable[[AsyncRadioStream], None] = None
+    _on_exit : Callable[[AsyncRadioStream], None] = None
+    _on_ready : Callable[[AsyncRadioStream], None] = None
+    _ready : bool = False
+    _ended_at : float = None
+
+    def __init__(self, engine : AsyncEngine, stream_url : str,
+            buffer_size : int = 307200, preroll_len : int = 63500,
+            on_data : Callable[[AsyncRadioStream], None] = None,
+            on_exit : Callable[[AsyncRadioStream], None] = None,
+            on_ready : Callable[[AsyncRadioStream], None] = None) -> None:
+        self._engine = engine
+        self._byte_buffer = ByteBuffer(buffer_size, index_frames=True)
+        self._stream_url = stream_url
+        self._preroll_len = preroll_len
+        self._on_data = on_data
+        self._on_exit = on_exit
+        self._on_ready = on_ready
+        self._should_run = True
+        self._start_date = datetime.now()
+        self._name = f"AsyncRadioStream-{next(self._ids)}"
+
+    @property
+    def byte_buffer(self) -> ByteBuffer:
+        return self._byte_buffer
+
+    @property
+    def stream_url(self) -> str:
+        return self._stream_url
+
+    @property
+    def start_date(self) -> datetime:
+        return self._start_date
+
+    @property
+    def preroll_len(self) -> int:
+        return self._preroll_len
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    # When the stream ended, by time.monotonic(), or None if it hasn't
+    @property
+    def ended_at(self) -> float:
+        return self._ended_at
+
+    # Whether the stream has made it past the preroll
+    @property
+    def ready(self) -> bool:
+        return self._ready
+
+    @property
+    def health(self) -> StreamHealth:
+        return measure_health(self._byte_buffer)
+
+    def start(self) -> None:
+        self._future = self._engine.submit(self.run())
+
+    def is_alive(self) -> bool:
+        return self._future is not None and not self._future.done()
+
+    def stop(self) -> None:
+        self._should_run = False
+        self._engine.call(self._close)
+
+    def _close(self) -> None:
+        if self._transport is not None:
+            self._transport.close()
+
+    def _handleReady(self) -> None:
+        if self._ready:
+            return
+        self._ready = True
+        if self._on_ready is not None:
+            self._on_ready(self)
+
+    def _dataReceived(self) -> None:
+        if self._on_data is not None:
+            self._on_data(self)
+
+    async def run(self) -> None:
+        log.debug(f"Radio stream {self.name} started.")
+        try:
+            url = self._stream_url
+            for i in range(0, MAX_REDIRECTS + 1):
+                protocol = await self._connect(url)
+                await protocol.closed
+
+                if protocol.location is None or not self._should_run:
+                    break
+                url = urljoin(url, protocol.location)
+        except asyncio.CancelledError:
+            raise
+        except:
+            log.exception(f"Radio stream {self.name} failed.")
+        finally:
+            self._close()
+            self._ended_at = time.monotonic()
+            log.debug(f"Radio stream {self.name} ended.")
+            if self._on_exit is not None:
+                self._on_exit(self)
+
+    async def _connect(self, url : str) -> _RadioStreamProtocol:
+        parts = urlsplit(url)
+        secure = parts.scheme == 'https'
+        port = parts.port or (443 if secure else 80)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+
+        loop = asyncio.get_running_loop()
+        self._transport, protocol = await loop.create_connection(
+            lambda: _RadioStreamProtocol(self), parts.hostname, port,
+            ssl=ssl.create_default_context() if secure else None)
+
+        self._transport.write((f"GET {path} HTTP/1.1\r\n" +
+            f"Host: {parts.netloc}\r\n" +
+            "User-Agent: RadioRec\r\n" +
+            "Accept: */*\r\n" +
+            "Connection: close\r\n\r\n").encode('iso-8859-1'))
+
+        if not self._should_run:
+            self._transport.close()
+
+        return protocol
+
+class AsyncRadioStreamManager:
+    """
+    Does what RadioStreamManager does, for AsyncRadioStreams, as a task on
+    an AsyncEngine's loop. It wakes up as soon as one of its streams ends
+    rather than polling for it.
+
+    Stream data handlers are called on the engine's thread every time any
+    stream receives data.
+    """
+    _engine : AsyncEngine = None
+    _primary_radio_stream : AsyncRadioStream = None
+    _redundant_radio_streams : List[AsyncRadioStream] = None
+    _page_url : str = None
+    _desired_redundancy : int = 2
+    _desired_buffer_size : int = 307200
+    _desired_redundant_max_age_sec : int = 0
+    _stream_start_attempts : int = 3
+    _stream_failover_handlers : \
+        List[Callable[[AsyncRadioStream, AsyncRadioStream], None]] = None
+    _stream_data_handlers : List[Callable[[AsyncRadioStream], None]] = None
+    _wakeup : asyncio.Event = None
+    _future : Future = None
+    _should_run : bool = True
+    _failover_latencies : Deque[float] = None
+    _failover_count : int = 0
+    _refresh_date : datetime = None
+    _refresh_task : asyncio.Task = None
+    _start_tasks : Set[asyncio.Task] = None
+    _warming_streams : Dict[AsyncRadioStream, asyncio.Event] = None
+    _sync_len : int = 0
+    _min_bitrate_kbps : float = 0
+    _stall_grace_sec : float = 10
+    _stall_count : int = 0
+    _circuit_breaker : CircuitBreaker = None
+    _stopped : asyncio.Event = None
+
+    def __init__(self, engine : AsyncEngine, page_url : str,
+            redundancy : int = 2, buffer_size : int = 307200,
+            start_attempts : int = 3, redundant_max_age_sec : int = 0,
+            on_stream_failover : Callable[[AsyncRadioStream,
+                                    AsyncRadioStream], None] = None,
+            sync_len : int = 0, min_bitrate_kbps : float = 0,
+            stall_grace_sec : float = 10,
+            circuit_breaker : CircuitBreaker = None) -> None:
+        if redundancy < 1:
+            raise ValueError('Cannot have a redundancy less than 1')
+        if min_bitrate_kbps < 0:
+            raise ValueError('Minimum bitrate cannot be negative')
+
+        self._engine = engine
+        self._redundant_radio_streams = []
+        self._stream_failover_handlers = []
+        self._stream_data_handlers = []
+        self._should_run = True
+        self._failover_latencies = deque(maxlen=FAILOVER_LATENCY_HISTORY)
+        self._failover_count = 0
+        self._stall_count = 0
+        self._warming_streams = {}
+        self._start_tasks = set()
+
+        self._page_url = page_url
+        self._desired_redundancy = redundancy
+        self._desired_buffer_size = buffer_size
+        self._stream_start_attempts = start_attempts
+        self._desired_redundant_max_age_sec = redundant_max_age_sec
+        self._sync_len = sync_len
+        self._min_bitrate_kbps = min_bitrate_kbps
+        self._stall_grace_sec = stall_grace_sec
+        self._circuit_breaker = circuit_breaker if circuit_breaker is not None \
+                                    else get_circuit_breaker(page_url)
+
+        if on_stream_failover is not None:
+            self.add_stream_failover_handler(on_stream_failover)
+
+    @property
+    def primary_radio_stream(self) -> AsyncRadioStream:
+        return self._primary_radio_stream
+
+    @property
+    def radio_streams(self) -> List[AsyncRadioStream]:
+        streams = list(self._redundant_radio_streams)
+        if self._primary_radio_stream is not None:
+            streams.insert(0, self._primary_radio_stream)
+        return streams
+
+    # How many times the primary stream has been replaced
+    @property
+    def failover_count(self) -> int:
+        return self._failover_count
+
+    # Seconds from the primary stream ending to its replacement being
+    # synced, for the most recent failovers, oldest first
+    @property
+    def failover_latencies(self) -> List[float]:
+        return list(self._failover_latencies)
+
+    # How many streams have been dropped for not getting enough data
+    @property
+    def stall_count(self) -> int:
+        return self._stall_count
+
+    @property
+    def circuit_breaker(self) -> CircuitBreaker:
+        return self._circuit_breaker
+
+    def start(self) -> None:
+        self._future = self._engine.submit(self.run())
+
+    def is_alive(self) -> bool:
+        return self._future is not None and not self._future.done()
+
+    def stop(self) -> None:
+        self._engine.call(self._stop)
+
+    def _stop(self) -> None:
+        self._should_run = False
+        if self._wakeup is not None:
+            self._wakeup.set()
+        if self._stopped is not None:
+            self._stopped.set()
+
+        for stream in self.radio_streams:
+            stream.stop()
+
+    def _findStreamURL(self) -> str:
+        return find_stream_url(self._page_url, self._stream_start_attempts)
+
+    async def _start_new_stream(self) -> AsyncRadioStream:
+        loop = asyncio.get_running_loop()
+
+        result = None
+        while result is None and self._should_run:
+            # Back off after failures, rather than firing up one browser
+            # after another while the station is down
+            delay = self._circuit_breaker.reserve()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._stopped.wait(), 
+                        timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            try:
+                # Looking the URL up drives a browser, so keep it off the loop
+                streamURL = await loop.run_in_executor(None,
+                                self._findStreamURL)
+                result = AsyncRadioStream(self._engine, streamURL,
+                            buffer_size=self._desired_buffer_size,
+                            on_data=self._handleStreamData,
+                            on_exit=self._handleStreamExit,
+                            on_ready=self._handleStreamReady)
+                result.start()
+            except TimeoutException as e:
+                log.debug("RadioStream failed to start due to TimeoutException. Will try again.")
+                self._circuit_breaker.record_failure(repr(e))
+            except Exception as e:
+                log.exception("An unexpected exception occurred while trying to start a new RadioStream.")
+                self._circuit_breaker.record_failure(repr(e))
+        return result
+
+    def _handleStreamData(self, stream : AsyncRadioStream) -> None:
+        warmed = self._warming_streams.get(stream)
+        if warmed is not None:
+            warmed.set()
+
+        for handler in self._stream_data_handlers:
+            handler(stream)
+
+    def _handleStreamReady(self, stream : AsyncRadioStream) -> None:
+        self._circuit_breaker.record_success()
+
+    def _handleStreamExit(self, stream : AsyncRadioStream) -> None:
+        # A stream that never got going counts against the station as much
+        # as one that couldn't be started at all
+        if not stream.ready and self._should_run:
+            self._circuit_breaker.record_failure(
+                f"Radio stream {stream.name} ended before it got going")
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _refresh_interval(self) -> timedelta:
+        # Refreshing one stream at a time, this often, means every stream
+        # gets refreshed once per max age, and their ages end up spread 
+        # evenly across it rather than all running out together
+        return timedelta(seconds=self._desired_redundant_max_age_sec / 
+                                    self._desired_redundancy)
+
+    def _next_refresh_sec(self) -> float:
+        # How long until the next stream is due to be refreshed, or None if
+        # there's nothing due. No less than a second, so a refresh that 
+        # can't happen yet doesn't have us spinning.
+        if self._refresh_date is None or self._refresh_task is not None:
+            return None
+        return max((self._refresh_date - datetime.now()).total_seconds(), 1)
+
+    def _next_wakeup_sec(self) -> float:
+        # Check on the streams' throughput twice per grace period, on top of
+        # whatever refreshing needs
+        timeouts = [self._next_refresh_sec()]
+        if self._stall_grace_sec > 0:
+            timeouts.append(self._stall_grace_sec / 2)
+        timeouts = [t for t in timeouts if t is not None]
+        return min(timeouts) if timeouts else None
+
+    def _drop_starved_streams(self) -> bool:
+        # A stream whose connection is open but has next to nothing coming
+        # through it is no better than a dead one. Returns whether the
+        # primary was starved.
+        primaryStarved = False
+        for stream in self.radio_streams:
+            if not stream.is_alive() or not is_starved(stream.byte_buffer,
+                    stream.start_date.timestamp(),
+                    self._min_bitrate_kbps * 1000 / 8,
+                    self._stall_grace_sec):
+                continue
+
+            what = f"less than {self._min_bitrate_kbps:g} kbps" \
+                    if self._min_bitrate_kbps > 0 else "nothing"
+            log.warning(f"Radio stream {stream.name} has received " + 
+                f"{what} for {self._stall_grace_sec:g} seconds. " + 
+                "Dropping it.")
+            self._stall_count += 1
+            stream.stop()
+
+            if stream is self._primary_radio_stream:
+                primaryStarved = True
+            else:
+                self._redundant_radio_streams.remove(stream)
+        return primaryStarved
+
+    async def _wait_for_data(self, stream : AsyncRadioStream, 
+            timeout : float) -> bool:
+        if stream.byte_buffer.readable_length > 0:
+            return True
+
+        warmed = self._warming_streams[stream] = asyncio.Event()
+        try:
+            await asyncio.wait_for(warmed.wait(), timeout=timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            del self._warming_streams[stream]
+
+    async def _refresh_stream(self, old_stream : AsyncRadioStream) -> None:
+        # The old stream is only let go of once its replacement is up and 
+        # has data coming in
+        stream = None
+        try:
+            stream = await self._start_new_stream()
+
+            if stream is not None and not await self._wait_for_data(stream, 
+                    REFRESH_WARMUP_SEC):
+                log.debug(f"Radio stream {stream.name} didn't warm up in " + 
+                    "time to replace an old one.")
+                stream.stop()
+                stream = None
+        finally:
+            self._refresh_task = None
+
+            if stream is not None and not self._should_run:
+                stream.stop()
+            elif stream is not None:
+                self._redundant_radio_streams.append(stream)
+                if old_stream in self._redundant_radio_streams:
+                    log.debug(f"Radio stream {old_stream.name} aged " + 
+                        f"out. Replaced it with {stream.name}.")
+                    old_stream.stop()
+                    self._redundant_radio_streams.remove(old_stream)
+                self._refresh_date = datetime.now() + self._refresh_interval()
+            else:
+                # Give it another go in a bit
+                self._refresh_date = datetime.now() + min(
+                    self._refresh_interval(), 
+                    timedelta(seconds=REFRESH_RETRY_SEC))
+
+            if self._wakeup is not None:
+                self._wakeup.set()
+
+    def _record_failover(self, old_primary : AsyncRadioStream) -> None:
+        self._failover_count += 1
+        if old_primary.ended_at is None:
+            return
+
+        latency = time.monotonic() - old_primary.ended_at
+        self._failover_latencies.append(latency)
+        log.debug(f"Failed over {latency * 1000:.1f} ms after radio stream " + 
+            f"{old_primary.name} ended.")
+
+    def _start_stream_in_background(self) -> None:
+        # Starting a stream means a browser session, and maybe backing off
+        # first, so none of that holds up run() from failing over to a
+        # stream that's already up
+        task = asyncio.ensure_future(self._start_and_adopt_stream())
+        self._start_tasks.add(task)
+        task.add_done_callback(self._start_tasks.discard)
+
+    @property
+    def _starting_count(self) -> int:
+        # A task that's just finished wakes run() up before its done
+        # callback takes it out of the set
+        return sum(1 for task in self._start_tasks if not task.done())
+
+    async def _start_and_adopt_stream(self) -> None:
+        stream = None
+        try:
+            stream = await self._start_new_stream()
+        finally:
+            if stream is not None and not self._should_run:
+                stream.stop()
+            elif stream is not None:
+                self._redundant_radio_streams.append(stream)
+                log.debug(f"Radio stream {stream.name} is ready.")
+
+            if self._wakeup is not None:
+                self._wakeup.set()
+
+    async def _restore_redundancy(self) -> None:
+        # Prune dead streams
+        for stream in list(self._redundant_radio_streams):
+            if not stream.is_alive():
+                log.debug(f"Radio stream {stream.name} failed.")
+                self._redundant_radio_streams.remove(stream)
+
+        # A refresh can overlap with a stream failing, which leaves us with
+        # one more than we need
+        if self._refresh_task is None:
+            while len(self._redundant_radio_streams) > \
+                    self._desired_redundancy:
+                oldest = min(self._redundant_radio_streams, 
+                            key=lambda stream: stream.start_date)
+                oldest.stop()
+                self._redundant_radio_streams.remove(oldest)
+
+        # Start up new streams, counting the ones already on their way
+        new_streams_needed = self._desired_redundancy - \
+                                len(self._redundant_radio_streams) - \
+                                self._starting_count
+
+        if new_streams_needed > 0:
+            log.debug(f"Starting {new_streams_needed} new radio streams.")
+
+        for i in range(0, new_streams_needed):
+            self._start_stream_in_background()
+
+        # Refresh aged streams one at a time, bringing each one's
+        # replacement up before letting it go, and only while we're
+        # otherwise at full strength
+        if self._desired_redundant_max_age_sec <= 0 or \
+                self._refresh_task is not None or \
+                len(self._redundant_radio_streams) < self._desired_redundancy:
+            return
+
+        now = datetime.now()
+        if self._refresh_date is None:
+            self._refresh_date = now + self._refresh_interval()
+        elif now >= self._refresh_date:
+            oldest = min(self._redundant_radio_streams, 
+                        key=lambda stream: stream.start_date)
+            log.debug(f"Refreshing radio stream {oldest.name}.")
+            self._refresh_task = asyncio.ensure_future(
+                                    self._refresh_stream(oldest))
+
+    async def _replace_primary_stream(self) -> None:
+        failover_stream = pick_failover_stream(self._redundant_radio_streams,
+                            self._primary_radio_stream, self._sync_len)
+
+        if failover_stream is None:
+            # If all the redundant streams were dead, too, start
+            # replacements for all of them at once. Whichever is ready first
+            # wakes us up to try again.
+            if self._primary_radio_stream is not None and \
+                    self._starting_count == 0:
+                log.warning("All radio streams have failed.")
+            for i in range(self._starting_count, 
+                    self._desired_redundancy + 1):
+                self._start_stream_in_background()
+            return
+
+        self._redundant_radio_streams.remove(failover_stream)
+
+        oldPRS = self._primary_radio_stream
+        self._primary_radio_stream = failover_stream
+
+        # Don't call handlers unless we're actually failing over
+        if oldPRS is not None:
+            for handler in self._stream_failover_handlers:
+                handler(oldPRS, failover_stream)
+            self._record_failover(oldPRS)
+
+    async def run(self) -> None:
+        self._wakeup = asyncio.Event()
+        self._stopped = asyncio.Event()
+
+        while self._should_run:
+            self._wakeup.clear()
+            try:
+                primaryStarved = self._drop_starved_streams()
+                prs = self._primary_radio_stream
+                if prs is None or not prs.is_alive() or primaryStarved:
+                    log.debug(f"Primary stream failed. Replacing...")
+                    await self._replace_primary_stream()
+                await self._restore_redundancy()
+            except asyncio.CancelledError:
+                raise
+            except:
+                log.exception("An unexpected exception occurred in AsyncRadioStreamManager.run().")
+
+            # Streams ending wake us up straight away. The timeout is only
+            # there to age streams out and to check on their throughput.
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), 
+                    timeout=self._next_wakeup_sec())
+            except asyncio.TimeoutError:
+                pass
+        log.info("AsyncRadioStreamManager has stopped.")
+
+    # First param of callable is old stream, second is new
+    def add_stream_failover_handler(self, handler : Callable[[AsyncRadioStream, AsyncRadioStream], None]):
+        if callable(handler) and handler not in self._stream_failover_handlers:
+            self._stream_failover_handlers.append(handler)
+
+    def remove_stream_failover_handler(self, handler : Callable[[AsyncRadioStream, AsyncRadioStream], None]):
+        if handler in self._stream_failover_handlers:
+            self._stream_failover_handlers.remove(handler)
+
+    def add_stream_data_handler(self, handler : Callable[[AsyncRadioStream], None]):
+        if callable(handler) and handler not in self._stream_data_handlers:
+            self._stream_data_handlers.append(handler)
+
+    def remove_stream_data_handler(self, handler : Callable[[AsyncRadioStream], None]):
+        if handler in self._stream_data_handlers:
+            self._stream_data_handlers.remove(handler)
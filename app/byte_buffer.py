@@ -1,17 +1,30 @@
 from __future__ import annotations
+from datetime import datetime
 from pathlib import Path
-from threading import Event, RLock
-from typing import Tuple
-import logging, os
+from threading import Condition, Event, RLock
+from typing import Dict, List, Tuple, Union
+import logging, os, time
+
+from app.adts import AdtsFrameIndex
+from app.file_writer import FSYNC_NONE, FileWriter, WriteBehindFileWriter
+from app.time_index import TimeIndex
 
 log = logging.getLogger('RadioRec')
 
 class ByteBuffer:
     _byte_array : bytearray = None
     _byte_array_lock : RLock = None
+    _readable_condition : Condition = None
+    _wake_count : int = 0
     _length : int = 0
     _index : int = 0
     _readable_length : int = 0
+    _reserved_length : int = 0
+    _stored_length : int = 0
+    _write_offset : int = 0
+    _time_index : TimeIndex = None
+    _frame_index : AdtsFrameIndex = None
+    _cursors : Dict[str, ByteBufferCursor] = None
 
     @property
     def byte_array(self):
@@ -24,6 +37,52 @@ class ByteBuffer:
     @property
     def readable_length(self):
         return self._readable_length
+
+    @property
+    def stored_length(self):
+        return self._stored_length
+
+    # Absolute offset, in bytes since the buffer was created, that the next
+    # appended byte will get
+    @property
+    def write_offset(self) -> int:
+        return self._write_offset
+
+    # Absolute offset of the oldest byte still stored in the buffer
+    @property
+    def stored_offset(self) -> int:
+        with self._byte_array_lock:
+            return self._write_offset - self._stored_length
+
+    # Absolute offset of the next byte read() will return
+    @property
+    def read_offset(self) -> int:
+        with self._byte_array_lock:
+            return self._write_offset - self._readable_length
+
+    @property
+    def time_index(self) -> TimeIndex:
+        return self._time_index
+
+    @property
+    def frame_index(self) -> AdtsFrameIndex:
+        return self._frame_index
+
+    # Bytes per second the buffer has been receiving lately, or None if that
+    # isn't known yet
+    @property
+    def byte_rate(self) -> float:
+        return self._time_index.byteRate()
+
+    # When the most recent bytes arrived, as a time.time() timestamp, or None
+    # if nothing has arrived that's still stored
+    @property
+    def last_write_time(self) -> float:
+        return self._time_index.lastTimestamp()
+
+    @property
+    def byte_array_lock(self) -> RLock:
+        return self._byte_array_lock
     
     def _setReadableLength(self, length : int) -> None:
         if length < 0:
@@ -34,12 +93,22 @@ class ByteBuffer:
         with self._byte_array_lock:
             self._readable_length = length
 
-    def __init__(self, length : int=307200) -> None:
+    def __init__(self, length : int=307200, index_frames : bool = False) -> None:
         self._byte_array = bytearray(length)
         self._byte_array_lock = RLock()
+        self._readable_condition = Condition(self._byte_array_lock)
         self._length = len(self._byte_array)
+        self._time_index = TimeIndex()
+        self._cursors = {}
+
+        if index_frames:
+            self._frame_index = AdtsFrameIndex(self)
     
-    def append(self, b : bytes) -> None:
+    def append(self, b : bytes, timestamp : float = None) -> None:
+        """
+        Appends b to the buffer. If given, timestamp is recorded as the time
+        the bytes arrived instead of the current time.
+        """
         try:
             self._byte_array_lock.acquire()
 
@@ -71,11 +140,109 @@ class ByteBuffer:
             if self._index == self._length:
                 self._index = 0
 
+            self._advanceWritten(b_len, timestamp)
+            self._readable_condition.notify_all()
         except TypeError as e:
             raise ValueError("Value given for \"bytes\" is not a bytes-like object.") from e
         finally:
             self._byte_array_lock.release()
 
+    def writeView(self, length : int) -> memoryview:
+        """
+        Returns a writable memoryview over the next contiguous region of the
+        byte array, up to length bytes long, so that data can be read
+        straight into the buffer (e.g. with readinto()). Call publish() with
+        the number of bytes actually written to make them readable.
+
+        Any unread data in the returned region is dropped immediately, just
+        like it would be if the data had been appended. Only one writer
+        should use this at a time.
+        """
+        if length == 0:
+            raise ValueError('Length cannot be zero')
+        elif length < 0:
+            raise ValueError('Length cannot be negative')
+
+        with self._byte_array_lock:
+            length = min(length, self._length - self._index)
+
+            overwriteLen = self._readable_length + length - self._length
+            if overwriteLen > 0:
+                self._setReadableLength(self._readable_length - overwriteLen)
+
+            self._stored_length = min(self._stored_length, 
+                                    self._length - length)
+            for cursor in self._cursors.values():
+                cursor._limitReadableLength(self._length - length)
+
+            self._reserved_length = length
+
+            return memoryview(self._byte_array)[self._index:self._index + length]
+
+    def publish(self, length : int) -> None:
+        if length < 0:
+            raise ValueError('Length cannot be negative')
+
+        with self._byte_array_lock:
+            if length > self._reserved_length:
+                raise ValueError('Cannot publish more than the length of the write view')
+
+            self._reserved_length = 0
+
+            self._setReadableLength(self._readable_length + length)
+
+            self._index = self._index + length
+            if self._index == self._length:
+                self._index = 0
+
+            self._advanceWritten(length)
+            self._readable_condition.notify_all()
+
+    def _advanceWritten(self, length : int, timestamp : float = None) -> None:
+        with self._byte_array_lock:
+            if length > 0:
+                if timestamp is None:
+                    timestamp = time.time()
+                self._time_index.add(timestamp, self._write_offset)
+
+            self._write_offset += length
+            self._stored_length = min(self._stored_length + length, 
+                                    self._length)
+            self._time_index.evict(self._write_offset - self._stored_length)
+
+            if self._frame_index is not None:
+                self._frame_index.update()
+            for cursor in self._cursors.values():
+                cursor._advance(length)
+
+    def waitForReadable(self, length : int = 1, timeout : float = None) -> bool:
+        """
+        Blocks until at least length bytes are readable, or until timeout
+        seconds have passed. Returns whether the bytes are readable.
+        """
+        if length == 0:
+            raise ValueError('Length cannot be zero')
+        elif length < 0:
+            raise ValueError('Length cannot be negative')
+        elif length > self._length:
+            raise ValueError('Requested length is longer than the buffer length')
+
+        with self._readable_condition:
+            wakeCount = self._wake_count
+            return self._readable_condition.wait_for(
+                lambda: self._readable_length >= length or 
+                    self._wake_count != wakeCount, 
+                timeout=timeout) and self._readable_length >= length
+
+    def wakeWaiters(self) -> None:
+        """
+        Makes every waitForReadable() call that's waiting return now, 
+        whether or not its bytes are readable yet.
+        """
+        with self._readable_condition:
+            self._wake_count += 1
+            self._readable_condition.notify_all()
+
     def _getFirstReadIndex(self) -> int:
         with self._byte_array_lock:
             readi = self._index - self._readable_length
@@ -237,6 +404,61 @@ class ByteBuffer:
 
             return self.read(readLength, consume=consume)
 
+    def readViews(self, length : int = -1) -> Tuple[memoryview, ...]:
+        """
+        Returns the next length readable bytes as one or two memoryviews over
+        the underlying byte array, without copying or consuming them. Call
+        commit() once the data has been used.
+
+        The views are only guaranteed to hold the requested data until the
+        next append, so hold byte_array_lock while using them if anything
+        else might append to this buffer.
+        """
+        with self._byte_array_lock:
+            if length < 0:
+                length = self._readable_length
+            elif length > self._length:
+                raise ValueError('Requested length is longer than the buffer length')
+            elif length > self._readable_length:
+                raise ValueError('Requested length is longer than what exists in the buffer')
+
+            return self._getViews(self._getFirstReadIndex(), length)
+
+    def _getViews(self, start : int, length : int) -> Tuple[memoryview, ...]:
+        if length == 0:
+            return ()
+
+        stop = start + length
+        view = memoryview(self._byte_array)
+
+        if stop <= self._length:
+            return (view[start:stop],)
+        else:
+            return (view[start:], view[:stop - self._length])
+
+    def readViewsUpToRemainingLength(self, length : int) -> Tuple[memoryview, ...]:
+        if length < 0:
+            raise ValueError("Length cannot be negative")
+        elif length > self._length:
+            raise ValueError("Requested length is longer than the buffer length")
+
+        with self._byte_array_lock:
+            if length > self._readable_length:
+                return ()
+
+            return self.readViews(self._readable_length - length)
+
+    def commit(self, length : int) -> None:
+        self.seek(length)
+
+    def makeRoom(self, length : int) -> None:
+        """
+        Makes sure length more bytes can be appended without anything else
+        having to happen first. A plain ByteBuffer just overwrites its
+        oldest data, so there's nothing to do.
+        """
+        pass
+
     def seek(self, length : int) -> None:
         if length < 0:
             raise ValueError('Cannot seek backwards')
@@ -266,65 +488,52 @@ class ByteBuffer:
             else:
                 self._setReadableLength(self._length - index + self._index)
     
-    def _findSequence(self, seq : bytes, match_len_step : int = 1000):
+    def _findSequence(self, seq : bytes) -> int:
         seq_len = len(seq)
         if seq_len == 0:
             raise ValueError('Sequence cannot be empty')
         elif seq_len > self._length:
             raise ValueError('Sequence cannot be longer than buffer length')
 
-        try:
-            seq = bytearray(seq)
-
-            self._byte_array_lock.acquire()
-            
+        with self._byte_array_lock:
             if seq_len > self._readable_length:
                 raise ValueError('Sequence is longer than readable length')
 
-            firstReadi, lastReadi = self._getReadBounds()
+            firstReadi = self._getFirstReadIndex()
+            stopi = firstReadi + self._readable_length
 
-            if firstReadi < lastReadi:
-                possibleIndexes = range(firstReadi, lastReadi + 1)
+            if stopi <= self._length:
+                # The readable data is one contiguous segment
+                matchingIndex = self._byte_array.find(seq, firstReadi, stopi)
             else:
-                possibleIndexes = list(range(firstReadi, self._length))
-                possibleIndexes += list(range(0, lastReadi + 1))
-            
-            matchingIndex = -1
-            for i in possibleIndexes:
-                isMatch = True
-                bestMatchLen = 0
-                while isMatch and bestMatchLen < seq_len:
-                    matchLen = bestMatchLen + match_len_step
-                    if matchLen > seq_len:
-                        matchLen = seq_len
-
-                    if not self._isWithinReadBounds(i, matchLen):
-                        # If the remaining untested data in the buffer is shorter
-                        # than the given sequence, the given sequence cannot
-                        # exist
-                        isMatch = False
-                        break
-
-                    readBytes = self._read(i, matchLen, consume=False)
-                    isMatch = seq[:matchLen] == readBytes
-
-                    bestMatchLen = matchLen
-
-                    if not isMatch:
-                        break
-                
-                if isMatch:
-                    matchingIndex = i
-                    break
-            
+                # The readable data wraps, so search the segment at the end of
+                # the array, then the seam between the two segments, then the
+                # segment at the start of the array
+                stopi -= self._length
+
+                matchingIndex = self._byte_array.find(seq, firstReadi)
+
+                if matchingIndex < 0 and seq_len > 1:
+                    tailStart = max(firstReadi, self._length - seq_len + 1)
+                    headStop = min(stopi, seq_len - 1)
+                    seam = self._byte_array[tailStart:] + \
+                        self._byte_array[:headStop]
+
+                    seami = seam.find(seq)
+                    tailLen = self._length - tailStart
+                    if 0 <= seami < tailLen:
+                        matchingIndex = tailStart + seami
+                    elif seami >= tailLen:
+                        matchingIndex = seami - tailLen
+
+                if matchingIndex < 0:
+                    matchingIndex = self._byte_array.find(seq, 0, stopi)
+
             if matchingIndex < 0:
                 raise ValueError('Failed to find given byte sequence')
 
             return matchingIndex
 
-        finally:
-            self._byte_array_lock.release()
-
     def seekToSequence(self, seq : bytes):
         with self._byte_array_lock:
             self._seekToIndex(self._findSequence(seq))
@@ -334,18 +543,263 @@ class ByteBuffer:
             self.seekToSequence(seq)
             self.seek(len(seq))
 
+    def _getIndexFromOffset(self, offset : int, length : int = 1) -> int:
+        with self._byte_array_lock:
+            if offset < self._write_offset - self._stored_length:
+                raise ValueError('Requested offset has already been overwritten')
+            elif offset + length > self._write_offset:
+                raise ValueError('Requested offset has not been written yet')
+
+            index = self._index - (self._write_offset - offset)
+            if index < 0:
+                index += self._length
+            return index
+
+    def _getOffsetFromIndex(self, index : int) -> int:
+        # Only meaningful for indexes within the readable data
+        with self._byte_array_lock:
+            fromEnd = self._index - index
+            if fromEnd <= 0:
+                fromEnd += self._length
+            return self._write_offset - fromEnd
+
+    def readViewsAtOffset(self, offset : int, length : int) -> Tuple[memoryview, ...]:
+        if length < 0:
+            raise ValueError('Length cannot be negative')
+        elif length > self._length:
+            raise ValueError('Requested length is longer than the buffer length')
+
+        with self._byte_array_lock:
+            return self._getViews(self._getIndexFromOffset(offset, length), 
+                                    length)
+
+    def readAtOffset(self, offset : int, length : int) -> bytearray:
+        with self._byte_array_lock:
+            result = bytearray()
+            for view in self.readViewsAtOffset(offset, length):
+                result += view
+            return result
+
+    def seekToOffset(self, offset : int) -> None:
+        with self._byte_array_lock:
+            self._getIndexFromOffset(offset, 0)
+            self._setReadableLength(self._write_offset - offset)
+
+    def findSequenceOffset(self, seq : bytes) -> int:
+        with self._byte_array_lock:
+            return self._getOffsetFromIndex(self._findSequence(seq))
+
+    def offsetAt(self, when : datetime) -> int:
+        """
+        Returns the absolute offset of the first byte that arrived at or after
+        the given time. If nothing has arrived since then, this is the
+        write_offset.
+        """
+        with self._byte_array_lock:
+            offset = self._time_index.offsetAt(when.timestamp())
+            return self._write_offset if offset is None else offset
+
+    def timeAt(self, offset : int) -> datetime:
+        with self._byte_array_lock:
+            self._getIndexFromOffset(offset)
+
+            return datetime.fromtimestamp(self._time_index.timestampAt(offset))
+
+    def readSince(self, when : datetime) -> bytearray:
+        with self._byte_array_lock:
+            offset = self.offsetAt(when)
+            return self.readAtOffset(offset, self._write_offset - offset)
+
+    def addCursor(self, name : str, from_end : bool = False) -> ByteBufferCursor:
+        """
+        Adds an independent read position to this buffer. The cursor starts at
+        the oldest data still stored in the buffer, or at the end of it if
+        from_end is True.
+        """
+        with self._byte_array_lock:
+            if name in self._cursors:
+                raise ValueError(f"A cursor named {name} already exists")
+
+            cursor = ByteBufferCursor(self, name, 
+                        0 if from_end else self._stored_length)
+            self._cursors[name] = cursor
+            return cursor
+
+    def getCursor(self, name : str) -> ByteBufferCursor:
+        with self._byte_array_lock:
+            if name not in self._cursors:
+                raise KeyError(f"No cursor named {name} exists")
+
+            return self._cursors[name]
+
+    def removeCursor(self, name : str) -> None:
+        with self._byte_array_lock:
+            if name not in self._cursors:
+                raise KeyError(f"No cursor named {name} exists")
+
+            del self._cursors[name]
+
+class ByteBufferCursor:
+    _byte_buffer : ByteBuffer = None
+    _name : str = None
+    _readable_length : int = 0
+    _overrun_length : int = 0
+
+    def __init__(self, byte_buffer : ByteBuffer, name : str, 
+            readable_length : int = 0) -> None:
+        self._byte_buffer = byte_buffer
+        self._name = name
+        self._readable_length = readable_length
+        self._overrun_length = 0
+
+    @property
+    def byte_buffer(self) -> ByteBuffer:
+        return self._byte_buffer
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @property
+    def readable_length(self) -> int:
+        return self._readable_length
+
+    # Total bytes that were overwritten before this cursor got to read them
+    @property
+    def overrun_length(self) -> int:
+        return self._overrun_length
+
+    # Absolute offset of the next byte this cursor will read
+    @property
+    def offset(self) -> int:
+        with self._byte_buffer.byte_array_lock:
+            return self._byte_buffer.write_offset - self._readable_length
+
+    def _advance(self, length : int) -> None:
+        self._readable_length += length
+        self._limitReadableLength(self._byte_buffer.length)
+
+    def _limitReadableLength(self, length : int) -> None:
+        if self._readable_length > length:
+            self._overrun_length += self._readable_length - length
+            self._readable_length = length
+
+    def readViews(self, length : int = -1) -> Tuple[memoryview, ...]:
+        bb = self._byte_buffer
+
+        with bb.byte_array_lock:
+            if length < 0:
+                length = self._readable_length
+            elif length > bb.length:
+                raise ValueError('Requested length is longer than the buffer length')
+            elif length > self._readable_length:
+                raise ValueError('Requested length is longer than what exists in the buffer')
+
+            start = bb._index - self._readable_length
+            if start < 0:
+                start += bb.length
+
+            return bb._getViews(start, length)
+
+    def waitForReadable(self, length : int = 1, timeout : float = None) -> bool:
+        bb = self._byte_buffer
+
+        if length == 0:
+            raise ValueError('Length cannot be zero')
+        elif length < 0:
+            raise ValueError('Length cannot be negative')
+        elif length > bb.length:
+            raise ValueError('Requested length is longer than the buffer length')
+
+        with bb._readable_condition:
+            return bb._readable_condition.wait_for(
+                lambda: self._readable_length >= length, timeout=timeout)
+
+    def read(self, length : int = -1, consume : bool = True) -> bytearray:
+        with self._byte_buffer.byte_array_lock:
+            views = self.readViews(length)
+
+            result = bytearray()
+            for view in views:
+                result += view
+
+            if consume:
+                self.commit(len(result))
+
+            return result
+
+    def commit(self, length : int) -> None:
+        self.seek(length)
+
+    def seek(self, length : int) -> None:
+        if length < 0:
+            raise ValueError('Cannot seek backwards')
+
+        with self._byte_buffer.byte_array_lock:
+            if length > self._readable_length:
+                raise ValueError("Cannot seek past the data stored in the buffer")
+
+            self._readable_length -= length
+
+    def seekToOffset(self, offset : int) -> None:
+        bb = self._byte_buffer
+
+        with bb.byte_array_lock:
+            bb._getIndexFromOffset(offset, 0)
+            self._readable_length = bb.write_offset - offset
+
+    def seekToEnd(self) -> None:
+        with self._byte_buffer.byte_array_lock:
+            self._readable_length = 0
+
+class _PendingRotation:
+    # Wall-clock time to cut at, if the offset hasn't been worked out yet
+    when : datetime = None
+    offset : int = None
+    filepath : str = None
+
+    def __init__(self, filepath : str, when : datetime = None, 
+            offset : int = None) -> None:
+        self.filepath = filepath
+        self.when = when
+        self.offset = offset
+
+def _splitViews(buffers : List[bytes], length : int) \
+        -> Tuple[List[memoryview], List[memoryview]]:
+    # Splits buffers into the first length bytes and the rest, without copying
+    head = []
+    tail = []
+    for b in buffers:
+        view = memoryview(b)
+        if length >= len(view):
+            head.append(view)
+        elif length > 0:
+            head.append(view[:length])
+            tail.append(view[length:])
+        else:
+            tail.append(view)
+        length -= len(view)
+    return head, tail
+
 class PersistentByteBuffer(ByteBuffer):
     _filepath : str = None
     _should_write : bool = True
-    _file_lock : RLock = None
+    _file_writer : FileWriter = None
+    _preallocate_sec : float = 0
+    _rotations : List[_PendingRotation] = None
 
     def __init__(self, filepath : str, length: int = 50000,
-            overwrite : bool = False, should_write : bool = True) -> None:
-        
-        self._file_lock = RLock()
+            overwrite : bool = False, should_write : bool = True,
+            index_frames : bool = False, file_buffer_size : int = 0,
+            fsync_policy : str = FSYNC_NONE, 
+            fsync_interval_sec : float = 0, 
+            write_behind_high_water_mark : int = 0,
+            preallocate_sec : float = 0) -> None:
 
         self._filepath = os.path.realpath(filepath)
         self._should_write = should_write
+        self._preallocate_sec = preallocate_sec
+        self._rotations = []
 
         if os.path.isfile(self._filepath):
             if overwrite:
@@ -357,7 +811,17 @@ class PersistentByteBuffer(ByteBuffer):
         Path(self._filepath).touch()
         os.remove(self._filepath)
 
-        super().__init__(length=length)
+        self._file_writer = FileWriter(self._filepath, 
+                                buffer_size=file_buffer_size,
+                                fsync_policy=fsync_policy,
+                                fsync_interval_sec=fsync_interval_sec)
+
+        # Write from a separate thread, so the disk can't hold up appends
+        if write_behind_high_water_mark > 0:
+            self._file_writer = WriteBehindFileWriter(self._file_writer, 
+                                    high_water_mark=write_behind_high_water_mark)
+
+        super().__init__(length=length, index_frames=index_frames)
     
     @property
     def filepath(self) -> str:
@@ -365,8 +829,87 @@ class PersistentByteBuffer(ByteBuffer):
     
     @filepath.setter
     def filepath(self, filepath : str) -> None:
-        with self._file_lock:
+        # Holding the writer's lock keeps appends from landing in the old
+        # file after the switch, or in the new one before it
+        with self._file_writer.lock:
+            self._file_writer.rotate(filepath, 
+                preallocate_len=self._getPreallocateLen())
             self._filepath = filepath
+
+    def rotateAt(self, when : datetime, filepath : str) -> None:
+        """
+        Switches to writing filepath starting with the byte that arrived at
+        the given time. If frames are indexed, the cut is moved to the frame
+        boundary closest to that byte, so neither file ends mid-frame.
+        """
+        with self._byte_array_lock:
+            self._rotations.append(_PendingRotation(filepath, when=when))
+            self._resolveRotations()
+
+    def rotateAtOffset(self, offset : int, filepath : str) -> None:
+        """
+        Switches to writing filepath starting with the byte at the given
+        absolute offset. Bytes before it still go to the current file.
+        """
+        with self._byte_array_lock:
+            self._rotations.append(_PendingRotation(filepath, offset=offset))
+
+    @property
+    def pending_rotations(self) -> int:
+        return len(self._rotations)
+
+    def _resolveRotations(self, flush_end : int = None) -> None:
+        # Works out the offsets of pending time-based rotations, once the
+        # bytes that arrived at that time are in the buffer. Rotations are
+        # resolved in order, so a later one never cuts before an earlier one.
+        with self._byte_array_lock:
+            for rotation in self._rotations:
+                if rotation.offset is not None:
+                    continue
+
+                offset = self._time_index.offsetAt(rotation.when.timestamp())
+                if offset is None:
+                    # Nothing has arrived since then yet
+                    return
+
+                # Don't wait for the next frame to complete if the bytes
+                # around the cut are about to be written out
+                force = flush_end is not None and flush_end > offset
+
+                cut = offset
+                frameIndex = self._frame_index
+                if frameIndex is not None and frameIndex.synced:
+                    if frameIndex.frameOffsetAtOrAfter(offset) is None \
+                            and not force:
+                        return
+
+                    frameOffset = frameIndex.nearestFrameOffset(offset)
+                    if frameOffset is not None:
+                        cut = frameOffset
+
+                rotation.offset = cut
+
+    def _rotate(self, rotation : _PendingRotation) -> None:
+        log.info(f"Persistent Byte Buffer: Rotating to {rotation.filepath} " + 
+            f"at offset {rotation.offset}")
+        try:
+            self.filepath = rotation.filepath
+        except:
+            log.exception(f"Error rotating to file {rotation.filepath}")
+
+    def _advanceWritten(self, length : int, timestamp : float = None) -> None:
+        with self._byte_array_lock:
+            super()._advanceWritten(length, timestamp)
+
+            if self._rotations:
+                self._resolveRotations()
+
+    def _getPreallocateLen(self) -> int:
+        # Enough room for preallocate_sec seconds at the current byte rate
+        byteRate = self.byte_rate
+        if self._preallocate_sec <= 0 or byteRate is None:
+            return 0
+        return int(byteRate * self._preallocate_sec)
     
     @property
     def should_write(self) -> bool:
@@ -376,19 +919,24 @@ class PersistentByteBuffer(ByteBuffer):
     def should_write(self, value : bool) -> None:
         log.debug(f"Persistent Byte Buffer: Should write changed to {value}")
         self._should_write = value
+
+        if not value:
+            self._file_writer.close()
+
+    @property
+    def file_writer(self) -> Union[FileWriter, WriteBehindFileWriter]:
+        return self._file_writer
         
-    def _writeToFile(self, b : bytes) -> None:
+    def _writeToFile(self, *buffers : bytes) -> None:
         if not self._should_write:
             return
 
-        with self._file_lock:
-            try:
-                with open(self._filepath, 'ab') as f:
-                    f.write(b)
-            except:
-                log.exception(f"Error writing bytes to file {self._filepath}")
+        try:
+            self._file_writer.writev(buffers)
+        except:
+            log.exception(f"Error writing bytes to file {self._filepath}")
     
-    def append(self, b : bytes) -> None:
+    def append(self, b : bytes, timestamp : float = None) -> None:
         bLen = len(b)
 
         with self._byte_array_lock:
@@ -398,13 +946,79 @@ class PersistentByteBuffer(ByteBuffer):
                 writeLen = newLen - self.length
             
                 if writeLen > self._readable_length:
-                    self._writeToFile(self.read())
-                    self._writeToFile(b[:self.length * -1])
+                    # Everything in the buffer plus the start of b, which
+                    # would be overwritten right away anyway
+                    self._writeViews(self.readViews(), 
+                        memoryview(b)[:self.length * -1])
                 else:
-                    self._writeToFile(self.read(writeLen))
+                    self._writeViews(self.readViews(writeLen))
             
-            super().append(b)
+            super().append(b, timestamp)
+
+    def makeRoom(self, length : int) -> None:
+        """
+        Writes out as much of the oldest data as appending length more bytes
+        would, ahead of time, so the append itself doesn't touch the disk.
+        """
+        with self._byte_array_lock:
+            writeLen = min(self._readable_length, 
+                        self._readable_length + length - self.length)
+            if writeLen > 0:
+                self._writeViews(self.readViews(writeLen))
+
+    def writeView(self, length : int) -> memoryview:
+        with self._byte_array_lock:
+            writeLen = self._readable_length + \
+                        min(length, self.length - self._index) - self.length
+
+            # Get the data that's about to be overwritten onto disk first
+            if writeLen > 0:
+                self._writeViews(self.readViews(writeLen))
+
+            return super().writeView(length)
+
+    def _writeViews(self, views : Tuple[memoryview, ...], *extra : bytes) -> None:
+        # Write the views straight out of the byte array in one go, unless
+        # a rotation falls in the middle of them
+        with self._byte_array_lock:
+            viewsLen = sum(len(view) for view in views)
+            start = self.read_offset
+            end = start + viewsLen + sum(len(b) for b in extra)
+            buffers = [*views, *extra]
+
+            if self._rotations:
+                self._resolveRotations(flush_end=end)
+
+            while self._rotations and self._rotations[0].offset is not None \
+                    and self._rotations[0].offset < end:
+                rotation = self._rotations.pop(0)
+
+                head, buffers = _splitViews(buffers, rotation.offset - start)
+                if head:
+                    self._writeToFile(*head)
+                    start += sum(len(view) for view in head)
+                self._rotate(rotation)
+
+            if buffers:
+                self._writeToFile(*buffers)
+            self.commit(viewsLen)
 
     def writeAll(self) -> None:
-        self._writeToFile(self.read())
+        with self._byte_array_lock:
+            self._writeViews(self.readViews())
+
+            try:
+                self._file_writer.flush()
+            except:
+                log.exception(f"Error flushing file {self._filepath}")
+
+    def close(self) -> None:
+        try:
+            if isinstance(self._file_writer, WriteBehindFileWriter):
+                # Closes the file, then lets the writer's thread go
+                self._file_writer.stop()
+            else:
+                self._file_writer.close()
+        except:
+            log.exception(f"Error closing file {self._filepath}")
     
\ No newline at end of file
@@ -0,0 +1,137 @@
+from threading import Lock
+from typing import Any, Dict
+import logging, random, time
+
+log = logging.getLogger('RadioRec')
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+class CircuitBreaker:
+    """
+    Keeps track of failed attempts at something, e.g. starting streams from
+    one station's page, and says how long to hold off before the next one.
+
+    Each failure in a row doubles the wait, with jitter so that attempts
+    that failed together don't all come back together. After
+    failure_threshold failures in a row the breaker opens, and only one
+    attempt is let through every open_sec until one succeeds.
+    """
+    _name : str = None
+    _lock : Lock = None
+    _failure_threshold : int = 5
+    _base_delay_sec : float = 1
+    _max_delay_sec : float = 300
+    _open_sec : float = 300
+    _state : str = CLOSED
+    _failures : int = 0
+    _total_failures : int = 0
+    _next_attempt_at : float = 0
+    _trial_started_at : float = None
+    _last_error : str = None
+
+    def __init__(self, name : str = None, failure_threshold : int = 5,
+            base_delay_sec : float = 1, max_delay_sec : float = 300,
+            open_sec : float = 300) -> None:
+        if failure_threshold < 1:
+            raise ValueError('Failure threshold must be at least 1')
+        if base_delay_sec < 0 or max_delay_sec < base_delay_sec:
+            raise ValueError('Delays must be positive, with the max at ' +
+                'least the base')
+
+        self._name = name
+        self._lock = Lock()
+        self._failure_threshold = failure_threshold
+        self._base_delay_sec = base_delay_sec
+        self._max_delay_sec = max_delay_sec
+        self._open_sec = open_sec
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state
+
+    def reserve(self) -> float:
+        """
+        Returns 0 if an attempt may be made now, counting it as under way if
+        the breaker is half open. Otherwise returns how many seconds to wait
+        before asking again.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if self._state == OPEN and now >= self._next_attempt_at:
+                self._state = HALF_OPEN
+                self._trial_started_at = None
+
+            if self._state == HALF_OPEN:
+                # One attempt at a time, until one of them works. One that
+                # never reports back is given up on after open_sec.
+                if self._trial_started_at is not None and \
+                        now - self._trial_started_at < self._open_sec:
+                    return max(self._base_delay_sec,
+                            self._trial_started_at + self._open_sec - now)
+                self._trial_started_at = now
+                return 0
+
+            return max(0, self._next_attempt_at - now)
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self._state != CLOSED:
+                log.info(f"{self._name or 'Circuit breaker'} is working " +
+                    f"again after {self._failures} failures.")
+            self._state = CLOSED
+            self._failures = 0
+            self._next_attempt_at = 0
+            self._trial_started_at = None
+
+    def record_failure(self, error : str = None) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self._failures += 1
+            self._total_failures += 1
+            self._last_error = error
+
+            if self._state == HALF_OPEN or \
+                    self._failures >= self._failure_threshold:
+                if self._state != OPEN:
+                    log.warning(f"{self._name or 'Circuit breaker'} has " +
+                        f"failed {self._failures} times in a row. Only " +
+                        f"trying again every {self._open_sec:g} seconds.")
+                self._state = OPEN
+                self._trial_started_at = None
+                self._next_attempt_at = now + self._open_sec
+                return
+
+            # Half to all of the full backoff, so it still grows each time
+            delay = min(self._max_delay_sec,
+                        self._base_delay_sec * 2 ** (self._failures - 1))
+            self._next_attempt_at = now + delay * random.uniform(0.5, 1)
+
+    def status(self) -> Dict[str, Any]:
+        """
+        Returns how the breaker is doing, made of plain values so it can be
+        logged or sent to another process.
+        """
+        now = time.monotonic()
+        with self._lock:
+            return {
+                'state': self._state,
+                'failures': self._failures,
+                'total_failures': self._total_failures,
+                'retry_in_sec': max(0, self._next_attempt_at - now),
+                'last_error': self._last_error
+            }
+
+# One per page URL, shared by everything starting streams from it
+_circuit_breakers : Dict[str, CircuitBreaker] = {}
+_circuit_breakers_lock = Lock()
+
+def get_circuit_breaker(page_url : str) -> CircuitBreaker:
+    with _circuit_breakers_lock:
+        breaker = _circuit_breakers.get(page_url)
+        if breaker is None:
+            breaker = _circuit_breakers[page_url] = CircuitBreaker(
+                f"Starting streams from {page_url}")
+        return breaker
@@ -0,0 +1,376 @@
+from __future__ import annotations
+from collections import deque
+from threading import Condition, Event, RLock, Thread
+from typing import BinaryIO, Deque, List, Sequence, Tuple
+import logging, os, time
+
+log = logging.getLogger('RadioRec')
+
+FSYNC_NONE = 'none'
+FSYNC_ON_ROTATE = 'on-rotate'
+FSYNC_INTERVAL = 'interval'
+FSYNC_POLICIES = (FSYNC_NONE, FSYNC_ON_ROTATE, FSYNC_INTERVAL)
+
+class FileWriter:
+    """
+    Appends bytes to a file, keeping the file open between writes. The file
+    is only reopened when filepath changes.
+
+    fsync_policy decides when written data is forced onto the disk:
+    'none' leaves it up to the OS, 'on-rotate' syncs a file when it's closed
+    (e.g. when filepath changes), and 'interval' also syncs every
+    fsync_interval_sec seconds while writing.
+
+    A file can be given a preallocate_len through rotate(), in which case
+    that much disk space is reserved for it up front so that it can be laid
+    out in as few extents as possible. The file is truncated back down to
+    what was actually written when it's closed.
+    """
+    _filepath : str = None
+    _file : BinaryIO = None
+    _preallocate_len : int = 0
+    _allocated_len : int = 0
+    _written_len : int = 0
+    _buffer_size : int = 0
+    _fsync_policy : str = FSYNC_NONE
+    _fsync_interval_sec : float = 0
+    _last_fsync : float = 0
+    _lock : RLock = None
+
+    def __init__(self, filepath : str, buffer_size : int = 0, 
+            fsync_policy : str = FSYNC_NONE, 
+            fsync_interval_sec : float = 0) -> None:
+        if buffer_size < 0:
+            raise ValueError('Buffer size cannot be negative')
+        if fsync_policy not in FSYNC_POLICIES:
+            raise ValueError(f"Unknown fsync policy: {fsync_policy}")
+        if fsync_policy == FSYNC_INTERVAL and fsync_interval_sec <= 0:
+            raise ValueError('The interval fsync policy needs a positive interval')
+
+        self._filepath = filepath
+        self._buffer_size = buffer_size
+        self._fsync_policy = fsync_policy
+        self._fsync_interval_sec = fsync_interval_sec
+        self._lock = RLock()
+
+    @property
+    def filepath(self) -> str:
+        return self._filepath
+
+    @filepath.setter
+    def filepath(self, filepath : str) -> None:
+        self.rotate(filepath)
+
+    def rotate(self, filepath : str, preallocate_len : int = 0) -> None:
+        """
+        Closes the current file, so that following writes go to filepath.
+        """
+        if preallocate_len < 0:
+            raise ValueError('Preallocation length cannot be negative')
+
+        with self._lock:
+            if filepath != self._filepath:
+                self.close()
+                self._filepath = filepath
+                self._preallocate_len = preallocate_len
+
+    @property
+    def is_open(self) -> bool:
+        return self._file is not None
+
+    @property
+    def lock(self) -> RLock:
+        return self._lock
+
+    @property
+    def preallocated(self) -> bool:
+        return self._allocated_len > 0
+
+    def _open(self) -> BinaryIO:
+        if self._file is None:
+            if self._preallocate_len > 0 and hasattr(os, 'posix_fallocate'):
+                # Preallocating grows the file, so appending to it would put
+                # our data after the reserved space. Write at our own position
+                # instead.
+                fd = os.open(self._filepath, os.O_WRONLY | os.O_CREAT, 0o666)
+                self._file = open(fd, 'wb', buffering=self._buffer_size)
+                self._written_len = self._file.seek(0, os.SEEK_END)
+                self._allocated_len = 0
+                self._allocate(self._written_len + self._preallocate_len)
+            else:
+                self._file = open(self._filepath, 'ab', 
+                                buffering=self._buffer_size)
+            self._last_fsync = time.monotonic()
+        return self._file
+
+    def _allocate(self, length : int) -> None:
+        try:
+            os.posix_fallocate(self._file.fileno(), 0, length)
+            self._allocated_len = length
+        except OSError:
+            log.debug(f"Could not preallocate {self._filepath}", exc_info=True)
+            self._preallocate_len = 0
+
+    def write(self, b : bytes) -> None:
+        self.writev((b,))
+
+    def writev(self, buffers : Sequence[bytes]) -> None:
+        """
+        Writes the given buffers to the file one after another. When the file
+        is unbuffered, or they'd fill its buffer anyway, they all go out in a
+        single writev() call.
+        """
+        with self._lock:
+            f = self._open()
+
+            try:
+                views = [memoryview(b) for b in buffers if len(b) > 0]
+                total = sum(len(view) for view in views)
+
+                if self.preallocated and \
+                        self._written_len + total > self._allocated_len:
+                    # We guessed short, so reserve another chunk
+                    self._allocate(self._written_len + total + 
+                                    self._preallocate_len)
+
+                if hasattr(os, 'writev') and (self._buffer_size == 0 or 
+                        total >= self._buffer_size):
+                    # Whatever's already buffered has to go out first
+                    f.flush()
+                    self._writevAll(f.fileno(), views)
+                else:
+                    for view in views:
+                        # Unbuffered files can write less than they're given
+                        while len(view) > 0:
+                            written = f.write(view)
+                            view = view[written:]
+
+                self._written_len += total
+
+                if self._fsync_policy == FSYNC_INTERVAL and \
+                        time.monotonic() - self._last_fsync >= \
+                            self._fsync_interval_sec:
+                    self.flush(fsync=True)
+            except:
+                # Start fresh with the next write
+                self._discard()
+                raise
+
+    @staticmethod
+    def _writevAll(fd : int, views : List[memoryview]) -> None:
+        while len(views) > 0:
+            written = os.writev(fd, views)
+
+            # Skip past whatever made it out, in case it wasn't everything
+            while len(views) > 0 and written >= len(views[0]):
+                written -= len(views[0])
+                views.pop(0)
+            if written > 0:
+                views[0] = views[0][written:]
+
+    def flush(self, fsync : bool = False) -> None:
+        with self._lock:
+            if self._file is None:
+                return
+
+            self._file.flush()
+            if fsync:
+                os.fsync(self._file.fileno())
+                self._last_fsync = time.monotonic()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is None:
+                return
+
+            try:
+                if self.preallocated:
+                    self._file.flush()
+                    os.ftruncate(self._file.fileno(), self._written_len)
+                    self._allocated_len = 0
+
+                self.flush(fsync=self._fsync_policy != FSYNC_NONE)
+            finally:
+                self._discard()
+
+    def _discard(self) -> None:
+        f = self._file
+        self._file = None
+        try:
+            if self.preallocated:
+                # Give back the reserved space, along with anything from a
+                # write that failed partway through. Otherwise reopening
+                # would carry on after it, leaving a gap of zeros.
+                os.ftruncate(f.fileno(), self._written_len)
+        except:
+            log.exception(f"Error truncating file {self._filepath}")
+        finally:
+            self._allocated_len = 0
+
+        try:
+            f.close()
+        except:
+            log.exception(f"Error closing file {self._filepath}")
+
+class WriteBehindFileWriter(Thread):
+    """
+    Hands writes off to a FileWriter on a dedicated thread, so that a slow
+    disk doesn't hold up whoever is producing the data. Data waits in memory
+    until it's written; write() only blocks once more than
+    high_water_mark bytes are waiting.
+    """
+    _file_writer : FileWriter = None
+    _queue : Deque[Tuple] = None
+    _condition : Condition = None
+    _filepath : str = None
+    _high_water_mark : int = 0
+    _queued_bytes : int = 0
+    _peak_queued_bytes : int = 0
+    _written_bytes : int = 0
+    _blocked_count : int = 0
+    _blocked_sec : float = 0
+    _should_run : bool = True
+
+    def __init__(self, file_writer : FileWriter, 
+            high_water_mark : int = 16777216) -> None:
+        if high_water_mark <= 0:
+            raise ValueError('High-water mark must be positive')
+
+        self._file_writer = file_writer
+        self._filepath = file_writer.filepath
+        self._queue = deque()
+        self._condition = Condition()
+        self._high_water_mark = high_water_mark
+        self._should_run = True
+
+        super().__init__(daemon=True)
+        self.start()
+
+    @property
+    def filepath(self) -> str:
+        return self._filepath
+
+    @filepath.setter
+    def filepath(self, filepath : str) -> None:
+        self.rotate(filepath)
+
+    def rotate(self, filepath : str, preallocate_len : int = 0) -> None:
+        with self._condition:
+            self._filepath = filepath
+            self._queue.append(('rotate', filepath, preallocate_len))
+            self._condition.notify_all()
+
+    @property
+    def lock(self) -> Condition:
+        # Anything done while holding this is ordered against writes
+        return self._condition
+
+    @property
+    def high_water_mark(self) -> int:
+        return self._high_water_mark
+
+    @property
+    def queued_bytes(self) -> int:
+        return self._queued_bytes
+
+    @property
+    def peak_queued_bytes(self) -> int:
+        return self._peak_queued_bytes
+
+    @property
+    def written_bytes(self) -> int:
+        return self._written_bytes
+
+    # How many times, and for how long in total, write() had to wait for the
+    # disk because the high-water mark was reached
+    @property
+    def blocked_count(self) -> int:
+        return self._blocked_count
+
+    @property
+    def blocked_sec(self) -> float:
+        return self._blocked_sec
+
+    def write(self, b : bytes) -> None:
+        self.writev((b,))
+
+    def writev(self, buffers : Sequence[bytes]) -> None:
+        # The caller is free to reuse its buffers as soon as we return. They
+        # stay separate so they can go out in one writev() on the other side.
+        chunks = [bytes(b) for b in buffers if len(b) > 0]
+        length = sum(len(chunk) for chunk in chunks)
+
+        with self._condition:
+            if self._queued_bytes > 0 and \
+                    self._queued_bytes + length > self._high_water_mark:
+                self._blocked_count += 1
+                start = time.monotonic()
+                self._condition.wait_for(lambda: self._queued_bytes == 0 or 
+                    self._queued_bytes + length <= self._high_water_mark)
+                self._blocked_sec += time.monotonic() - start
+
+            self._queue.append(('write', chunks, length))
+            self._queued_bytes += length
+            self._peak_queued_bytes = max(self._peak_queued_bytes, 
+                                        self._queued_bytes)
+            self._condition.notify_all()
+
+    def _waitFor(self, item : str, *args) -> None:
+        if not self.is_alive():
+            # Nothing is left in the queue once the thread has stopped
+            if item == 'flush':
+                self._file_writer.flush(*args)
+            elif item == 'close':
+                self._file_writer.close()
+            return
+
+        done = Event()
+        with self._condition:
+            self._queue.append((item, done) + args)
+            self._condition.notify_all()
+        done.wait()
+
+    def flush(self, fsync : bool = False) -> None:
+        """
+        Blocks until everything written so far has been handed to the file.
+        """
+        self._waitFor('flush', fsync)
+
+    def close(self) -> None:
+        self._waitFor('close')
+
+    def stop(self) -> None:
+        self.close()
+        with self._condition:
+            self._should_run = False
+            self._condition.notify_all()
+
+    def run(self) -> None:
+        while True:
+            with self._condition:
+                self._condition.wait_for(
+                    lambda: len(self._queue) > 0 or not self._should_run)
+                if len(self._queue) == 0:
+                    return
+                item = self._queue.popleft()
+
+            try:
+                if item[0] == 'write':
+                    self._file_writer.writev(item[1])
+                elif item[0] == 'rotate':
+                    self._file_writer.rotate(item[1], item[2])
+                elif item[0] == 'flush':
+                    self._file_writer.flush(fsync=item[2])
+                elif item[0] == 'close':
+                    self._file_writer.close()
+            except:
+                log.exception("Error writing to file " + 
+                    f"{self._file_writer.filepath}")
+            finally:
+                if item[0] == 'write':
+                    with self._condition:
+                        self._queued_bytes -= item[2]
+                        self._written_bytes += item[2]
+                        self._condition.notify_all()
+                elif isinstance(item[1], Event):
+                    item[1].set()
@@ -9,9 +9,21 @@ from selenium.webdriver.firefox.options import Options
 from selenium.webdriver.firefox.firefox_profile import FirefoxProfile
 
 from logging import getLogger
+from threading import Semaphore
 
 log = getLogger('RadioRec')
 
+# Limits how many browsers can be open at once across all stations
+_browser_slots : Semaphore = None
+
+def set_max_browsers(count : int) -> None:
+    """
+    Limits how many get_stream_url() calls can have a browser open at once.
+    Calls past the limit wait their turn. None or 0 removes the limit.
+    """
+    global _browser_slots
+    _browser_slots = Semaphore(count) if count else None
+
 def get_stream_url(page_url : str, headless : bool = True) -> str:
     """
     Loads a player.listenlive.co webpage and extracts a raw streaming URL from it
@@ -21,7 +33,14 @@ def get_stream_url(page_url : str, headless : bool = True) -> str:
     stream just to see the URLs the page accesses. You'll likely want to run this
     asychronously.
     """
+    slots = _browser_slots
+    if slots is None:
+        return _get_stream_url(page_url, headless)
+
+    with slots:
+        return _get_stream_url(page_url, headless)
 
+def _get_stream_url(page_url : str, headless : bool = True) -> str:
     def stream_has_started(driver):
         ecAdBreakTextPresent = expected_conditions.text_to_be_present_in_element(adBreakTextSelector, 'In a commercial break...')
         ecNowPlayingCardVisible = expected_conditions.visibility_of_element_located(nowPlayingCardSelector)
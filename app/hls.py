@@ -0,0 +1,258 @@
+from __future__ import annotations
+from collections import deque
+from threading import Event, Thread
+from typing import Deque, List, NamedTuple, Union
+import logging, math, os
+
+from app.byte_buffer import ByteBuffer, ByteBufferCursor
+from app.file_writer import FileWriter
+
+log = logging.getLogger('RadioRec')
+
+class HlsSegment(NamedTuple):
+    sequence : int
+    filename : str
+    duration : float
+    discontinuity : bool
+
+class HlsSegmenter(Thread):
+    """
+    Cuts the audio going through a frame-indexed ByteBuffer into AAC segments
+    of about segment_duration_sec seconds each, and keeps an HLS playlist of
+    the last playlist_length of them up to date in output_dir.
+
+    Segments always start on an ADTS frame boundary. The data is written to
+    the segment files straight out of the buffer, through a cursor of its
+    own, so nothing else reading the buffer is affected.
+    """
+    _byte_buffer : ByteBuffer = None
+    _cursor : ByteBufferCursor = None
+    _output_dir : str = None
+    _playlist_name : str = None
+    _segment_duration_sec : float = 0
+    _playlist_length : int = 0
+    _file_writer : FileWriter = None
+    _segments : Deque[HlsSegment] = None
+    _sequence : int = 0
+    _segment_duration : float = 0
+    _segment_open : bool = False
+    _discontinuity : bool = False
+    _overrun_length : int = 0
+    _should_run : bool = True
+    _stopped : Event = None
+
+    def __init__(self, byte_buffer : ByteBuffer, output_dir : str,
+            segment_duration_sec : float = 6, playlist_length : int = 6,
+            playlist_name : str = 'stream.m3u8') -> None:
+        if byte_buffer.frame_index is None:
+            raise ValueError('The buffer must be indexing frames')
+        if segment_duration_sec <= 0:
+            raise ValueError('Segment duration must be positive')
+        if playlist_length <= 0:
+            raise ValueError('Playlist length must be positive')
+
+        os.makedirs(output_dir, exist_ok=True)
+
+        self._byte_buffer = byte_buffer
+        self._output_dir = output_dir
+        self._playlist_name = playlist_name
+        self._segment_duration_sec = segment_duration_sec
+        self._playlist_length = playlist_length
+        self._file_writer = FileWriter(self._getSegmentPath(0))
+        self._removeStaleSegment(0)
+        self._segments = deque()
+        self._should_run = True
+        self._stopped = Event()
+
+        self._cursor = byte_buffer.addCursor(f"hls:{output_dir}",
+                            from_end=True)
+
+        super().__init__(daemon=True)
+
+    @property
+    def playlist_path(self) -> str:
+        return os.path.join(self._output_dir, self._playlist_name)
+
+    # Segments currently listed in the playlist, oldest first
+    @property
+    def segments(self) -> List[HlsSegment]:
+        return list(self._segments)[-self._playlist_length:]
+
+    def _getSegmentName(self, sequence : int) -> str:
+        return f"segment_{sequence:06d}.aac"
+
+    def _getSegmentPath(self, sequence : int) -> str:
+        return os.path.join(self._output_dir, self._getSegmentName(sequence))
+
+    def run(self) -> None:
+        try:
+            while self._should_run:
+                cursor = self._cursor
+                waitLen = min(cursor.readable_length + 1,
+                                self._byte_buffer.length)
+                if cursor.waitForReadable(waitLen, timeout=1):
+                    self.update()
+        except:
+            log.exception(f"HLS segmenter for {self._output_dir} crashed")
+        finally:
+            self._finish()
+            self._stopped.set()
+
+    def update(self) -> None:
+        """
+        Writes out whatever whole frames have arrived since the last update,
+        starting new segments as needed.
+        """
+        # Work out what to write while holding the buffer's lock, but write
+        # it after letting go, so the disk never holds up whatever is
+        # filling the buffer
+        with self._byte_buffer.byte_array_lock:
+            pending = self._collect()
+
+        for item in pending:
+            if isinstance(item, HlsSegment):
+                self._finishSegment(item)
+            else:
+                self._file_writer.write(item)
+
+    def _collect(self) -> List[Union[bytes, HlsSegment]]:
+        # Returns the data for the current segment, with an HlsSegment
+        # wherever one ends. Call with the buffer's lock held.
+        bb = self._byte_buffer
+        cursor = self._cursor
+        pending = []
+
+        if cursor.overrun_length > self._overrun_length:
+            # We fell behind and lost data, so whatever comes next doesn't
+            # follow on from the segment we were writing
+            log.warning(f"HLS segmenter for {self._output_dir} fell " +
+                "behind; starting a new segment")
+            self._overrun_length = cursor.overrun_length
+            self._cutSegment(pending)
+            self._discontinuity = self._sequence > 0
+
+        frames = bb.frame_index.framesFrom(cursor.offset)
+        if len(frames) == 0 or \
+                (len(frames) == 1 and cursor.readable_length >= bb.length):
+            # None of it can be cut into segments, because it isn't ADTS or
+            # sync has been lost. Skip over it, so we wait for new data
+            # rather than spinning on what's already here.
+            if cursor.readable_length >= bb.length:
+                log.warning(f"HLS segmenter for {self._output_dir} found " +
+                    "no ADTS frames in a whole buffer; skipping it")
+            if self._segment_open:
+                self._cutSegment(pending)
+                self._discontinuity = True
+            cursor.seekToEnd()
+            self._overrun_length = cursor.overrun_length
+            return pending
+
+        if not self._segment_open:
+            # Only ever start a segment on a frame boundary
+            cursor.seekToOffset(frames[0][0])
+
+        # The last frame's end isn't known until the one after it is
+        # indexed, so leave it for the next update
+        for frameOffset, duration in frames[:-1]:
+            if self._segment_duration >= self._segment_duration_sec:
+                self._readUpTo(frameOffset, pending)
+                self._cutSegment(pending)
+
+            self._segment_open = True
+            self._segment_duration += duration
+
+        self._readUpTo(frames[-1][0], pending)
+        return pending
+
+    def _readUpTo(self, offset : int, pending : list) -> None:
+        cursor = self._cursor
+        length = offset - cursor.offset
+        if length <= 0:
+            return
+
+        pending.append(b''.join(cursor.readViews(length)))
+        cursor.commit(length)
+
+    def _cutSegment(self, pending : list) -> None:
+        if not self._segment_open:
+            return
+
+        pending.append(HlsSegment(self._sequence,
+            self._getSegmentName(self._sequence), self._segment_duration,
+            self._discontinuity))
+        self._discontinuity = False
+        self._sequence += 1
+        self._segment_duration = 0
+        self._segment_open = False
+
+    def _finishSegment(self, segment : HlsSegment) -> None:
+        self._file_writer.close()
+        self._segments.append(segment)
+
+        # Keep segments around for a while after they leave the playlist,
+        # for clients that fetched it just before they did
+        while len(self._segments) > self._playlist_length * 2:
+            old = self._segments.popleft()
+            try:
+                os.remove(os.path.join(self._output_dir, old.filename))
+            except FileNotFoundError:
+                pass
+
+        self._writePlaylist()
+
+        self._file_writer.filepath = self._getSegmentPath(segment.sequence + 1)
+        self._removeStaleSegment(segment.sequence + 1)
+
+    def _removeStaleSegment(self, sequence : int) -> None:
+        # Don't append to a segment left over from an earlier run
+        segmentPath = self._getSegmentPath(sequence)
+        if os.path.isfile(segmentPath):
+            os.remove(segmentPath)
+
+    def _writePlaylist(self, end : bool = False) -> None:
+        segments = self.segments
+        if len(segments) == 0:
+            return
+
+        targetDuration = math.ceil(max(self._segment_duration_sec,
+                            *(segment.duration for segment in segments)))
+
+        lines = [
+            '#EXTM3U',
+            '#EXT-X-VERSION:3',
+            f"#EXT-X-TARGETDURATION:{targetDuration}",
+            f"#EXT-X-MEDIA-SEQUENCE:{segments[0].sequence}"
+        ]
+        for segment in segments:
+            if segment.discontinuity:
+                lines.append('#EXT-X-DISCONTINUITY')
+            lines.append(f"#EXTINF:{segment.duration:.3f},")
+            lines.append(segment.filename)
+        if end:
+            lines.append('#EXT-X-ENDLIST')
+
+        # Replace the playlist in one go, so clients never see half of it
+        tmpPath = self.playlist_path + '.tmp'
+        with open(tmpPath, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(tmpPath, self.playlist_path)
+
+    def _finish(self) -> None:
+        try:
+            self.update()
+            pending = []
+            self._cutSegment(pending)
+            for segment in pending:
+                self._finishSegment(segment)
+            self._writePlaylist(end=True)
+        except:
+            log.exception("Error finishing HLS playlist in " +
+                f"{self._output_dir}")
+        finally:
+            self._file_writer.close()
+            self._byte_buffer.removeCursor(self._cursor.name)
+
+    def stop(self, timeout : float = None) -> None:
+        self._should_run = False
+        if self.is_alive():
+            self._stopped.wait(timeout)
@@ -1,14 +1,27 @@
-import logging
+from __future__ import annotations
+import logging, socket, ssl, time
+from collections import deque
+from io import BufferedReader
 from os import devnull
-from requests import request
+from requests import Response, request
 from selenium.common.exceptions import TimeoutException
 from urllib3.response import HTTPResponse
-from threading import Event, RLock, Thread
-from typing import Callable, List
+from threading import BoundedSemaphore, Condition, Event, Lock, RLock, \
+    Thread, current_thread
+from typing import Callable, Deque, Iterator, List, Tuple, Union
 from datetime import datetime, timedelta
 
+from app.async_stream import FAILOVER_LATENCY_HISTORY, REFRESH_RETRY_SEC, \
+    REFRESH_WARMUP_SEC, AsyncEngine, AsyncRadioStream, \
+    AsyncRadioStreamManager
 from app.get_stream_url import get_stream_url
 from app.byte_buffer import ByteBuffer, PersistentByteBuffer
+from app.circuit_breaker import CircuitBreaker, get_circuit_breaker
+from app.file_writer import FSYNC_NONE
+from app.hls import HlsSegmenter
+from app.stream_health import StreamHealth, estimate_bytes_lost, \
+    is_starved, measure_health, pick_failover_stream
+from app.stream_reactor import StreamReactor, get_default_reactor
 
 log = logging.getLogger('RadioRec')
 
@@ -18,6 +31,12 @@ class RadioStream(Thread):
     _preroll_len : int = 63500
     _http_stream : HTTPResponse = None
     _start_date: datetime = None
+    _ended_at : float = None
+    _on_exit : Callable[[RadioStream], None] = None
+    _on_ready : Callable[[RadioStream], None] = None
+    _ready : bool = False
+    _exit_lock : Lock = None
+    _should_run : bool = True
     
     @property
     def byte_buffer(self):
@@ -31,11 +50,31 @@ class RadioStream(Thread):
     def start_date(self):
         return self._start_date
 
+    # When the stream ended, by time.monotonic(), or None if it hasn't
+    @property
+    def ended_at(self) -> float:
+        return self._ended_at
+
+    # Whether the stream has made it past the preroll
+    @property
+    def ready(self) -> bool:
+        return self._ready
+
+    @property
+    def health(self) -> StreamHealth:
+        return measure_health(self._byte_buffer)
+
     def __init__(self, page_url : str = None, buffer_size : int = 307200, 
             attempts : int = 3, preroll_len : int = 63500,
-            stream_url : str = None) -> None:
-        self._byte_buffer = ByteBuffer(buffer_size)
+            stream_url : str = None, 
+            on_exit : Callable[[RadioStream], None] = None,
+            on_ready : Callable[[RadioStream], None] = None) -> None:
+        self._byte_buffer = ByteBuffer(buffer_size, index_frames=True)
         self._preroll_len = preroll_len
+        self._on_exit = on_exit
+        self._on_ready = on_ready
+        self._exit_lock = Lock()
+        self._should_run = True
 
         if stream_url is None:
             if page_url is None:
@@ -64,25 +103,215 @@ class RadioStream(Thread):
 
     def run(self) -> None:
         log.debug(f"Radio stream {self.name} started.")
-        with request('GET', self._stream_url, stream=True) as r:
-            self._http_stream : HTTPResponse = r.raw
+        try:
+            with request('GET', self._stream_url, stream=True) as r:
+                self._http_stream : HTTPResponse = r.raw
+
+                # Dump preroll data
+                with open(devnull, 'wb') as f:
+                    f.write(self._http_stream.read(self._preroll_len))
+                if r.ok:
+                    self._handleReady()
 
-            # Dump preroll data
-            with open(devnull, 'wb') as f:
-                f.write(self._http_stream.read(self._preroll_len))
+                readinto = self._getReadinto(self._http_stream)
+
+                # stop() may have been called before there was anything 
+                # for it to close
+                while self._should_run and not self._http_stream.isclosed() \
+                        and self._http_stream.readable():
+                    view = self._byte_buffer.writeView(8192)
+                    self._byte_buffer.publish(readinto(view) or 0)
+        finally:
+            self._handleExit()
+
+    def _handleReady(self) -> None:
+        self._ready = True
+        if self._on_ready is not None:
+            try:
+                self._on_ready(self)
+            except:
+                log.exception("An unexpected exception occurred in a " +
+                    "RadioStream ready handler.")
+
+    def _handleExit(self) -> None:
+        # Only the first call counts, however the stream came to end
+        with self._exit_lock:
+            if self._ended_at is not None:
+                return
+            self._ended_at = time.monotonic()
 
-            while not self._http_stream.isclosed() and self._http_stream.readable():
-                self._byte_buffer.append(self._http_stream.read(8192))
         log.debug(f"Radio stream {self.name} ended.")
+        if self._on_exit is not None:
+            try:
+                self._on_exit(self)
+            except:
+                log.exception("An unexpected exception occurred in a " +
+                    "RadioStream exit handler.")
+
+    @staticmethod
+    def _getReadinto(http_stream : HTTPResponse) -> Callable[[memoryview], int]:
+        # urllib3's readinto() just read()s into a temporary bytes object and
+        # copies it over. When there's no content encoding to undo, go
+        # straight to the http.client response underneath so the socket data
+        # lands directly in the ring buffer.
+        fp = getattr(http_stream, '_fp', None)
+        if fp is not None and hasattr(fp, 'readinto') and \
+                not http_stream.headers.get('content-encoding'):
+            return fp.readinto
+        return http_stream.readinto
     
+    @staticmethod
+    def _getSocket(http_stream : HTTPResponse) -> socket.socket:
+        # The socket underneath the response, if it's still open
+        reader = getattr(getattr(http_stream, '_fp', None), 'fp', None)
+        sock = getattr(getattr(reader, 'raw', None), '_sock', None)
+        return sock if isinstance(sock, socket.socket) else None
+
     def stop(self) -> None:
+        self._should_run = False
         if self._http_stream is not None and not self._http_stream.closed:
+            # A read stuck on a stalled connection holds onto the response,
+            # so close() would wait on it forever. Shutting the socket down
+            # gets the read to return first.
+            sock = self._getSocket(self._http_stream)
+            if sock is not None:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
             self._http_stream.close()
 
     def __del__(self):
         if self._http_stream is not None and not self._http_stream.isclosed():
             self._http_stream.close()
 
+class ReactorRadioStream(RadioStream):
+    """
+    A RadioStream whose socket is drained by a shared StreamReactor instead
+    of by a thread of its own. The request and the preroll are still done
+    by start(), on the caller's thread.
+
+    Responses that can't be read straight off the socket (i.e. chunked or
+    compressed ones) fall back to running on a thread like a RadioStream.
+    """
+    _reactor : StreamReactor = None
+    _response : Response = None
+    _sock : socket.socket = None
+    _alive : bool = False
+    _close_lock : RLock = None
+
+    def __init__(self, page_url : str = None, buffer_size : int = 307200, 
+            attempts : int = 3, preroll_len : int = 63500,
+            stream_url : str = None, reactor : StreamReactor = None,
+            on_exit : Callable[[RadioStream], None] = None,
+            on_ready : Callable[[RadioStream], None] = None) -> None:
+        self._reactor = reactor if reactor is not None \
+                            else get_default_reactor()
+        self._close_lock = RLock()
+
+        super().__init__(page_url=page_url, buffer_size=buffer_size, 
+            attempts=attempts, preroll_len=preroll_len, stream_url=stream_url,
+            on_exit=on_exit, on_ready=on_ready)
+
+    def start(self) -> None:
+        self._response = request('GET', self._stream_url, stream=True)
+        self._http_stream = self._response.raw
+
+        fp = self._getSocketReader(self._http_stream)
+        if fp is None:
+            log.debug(f"Radio stream {self.name} can't be read off the " + 
+                "socket directly; running it on a thread instead.")
+            self._response.close()
+            self._http_stream = None
+            super().start()
+            return
+
+        # Dump preroll data
+        self._http_stream.read(self._preroll_len)
+
+        self._sock = fp.raw._sock
+        self._sock.setblocking(False)
+
+        # Hand over whatever the response had already read past the preroll
+        try:
+            leftover = fp.peek()
+        except (BlockingIOError, ssl.SSLWantReadError):
+            leftover = b''
+        if leftover:
+            self._byte_buffer.append(fp.read(len(leftover)))
+
+        self._alive = True
+        self._reactor.register(self._sock, self._drain)
+        log.debug(f"Radio stream {self.name} started.")
+        if self._response.ok:
+            self._handleReady()
+
+    @staticmethod
+    def _getSocketReader(http_stream : HTTPResponse) -> BufferedReader:
+        # The buffered reader http.client reads the response through, if
+        # the body is just the raw bytes on the socket
+        fp = getattr(http_stream, '_fp', None)
+        if fp is None or getattr(fp, 'chunked', False) or \
+                http_stream.headers.get('content-encoding'):
+            return None
+
+        reader = getattr(fp, 'fp', None)
+        if not isinstance(reader, BufferedReader) or \
+                not isinstance(getattr(reader.raw, '_sock', None), 
+                    socket.socket):
+            return None
+        return reader
+
+    def _drain(self) -> None:
+        # Called on the reactor's thread. Reads until the socket runs dry,
+        # up to a limit so one busy stream can't starve the rest.
+        if not self._alive:
+            return
+
+        for i in range(0, 16):
+            view = self._byte_buffer.writeView(8192)
+            try:
+                readLen = self._sock.recv_into(view)
+            except (BlockingIOError, ssl.SSLWantReadError):
+                self._byte_buffer.publish(0)
+                return
+            except OSError:
+                self._byte_buffer.publish(0)
+                self._close()
+                return
+
+            self._byte_buffer.publish(readLen)
+            if readLen == 0:
+                self._close()
+                return
+
+        # Out of turns. Decrypted bytes left in an SSL socket don't make it
+        # readable again, so come back for them rather than waiting on more
+        # to arrive over the network.
+        if isinstance(self._sock, ssl.SSLSocket) and self._sock.pending() > 0:
+            self._reactor.call(self._drain)
+
+    def _close(self) -> None:
+        with self._close_lock:
+            if not self._alive:
+                return
+            self._alive = False
+
+        self._reactor.unregister(self._sock)
+        self._response.close()
+        self._handleExit()
+
+    def is_alive(self) -> bool:
+        if self._sock is None:
+            return super().is_alive()
+        return self._alive
+
+    def stop(self) -> None:
+        if self._sock is None:
+            super().stop()
+        else:
+            self._close()
+
 class RadioStreamManager(Thread):
     _primary_radio_stream : RadioStream = None
     _redundant_radio_streams : List[RadioStream] = None
@@ -94,23 +323,68 @@ class RadioStreamManager(Thread):
     _stream_start_attempts : int = 3
     _stream_failover_handlers : \
         List[Callable[[RadioStream, RadioStream], None]] = None
+    _reactor : StreamReactor = None
+    _start_slots : BoundedSemaphore = None
+    _starting_count : int = 0
+    _stream_ready : Condition = None
+    _should_run : bool = True
+    _wakeup : Event = None
+    _failover_latencies : Deque[float] = None
+    _failover_count : int = 0
+    _refresh_date : datetime = None
+    _refreshing : bool = False
+    _sync_len : int = 0
+    _min_bitrate_kbps : float = 0
+    _stall_grace_sec : float = 10
+    _stall_count : int = 0
+    _circuit_breaker : CircuitBreaker = None
+    _stopped : Event = None
 
     def __init__(self, page_url : str, redundancy : int = 2, 
             buffer_size : int = 307200, start_attempts : int = 3,
             redundant_max_age_sec : int = 0,
-            on_stream_failover : Callable[[RadioStream, RadioStream], None] = None) -> None:
+            on_stream_failover : Callable[[RadioStream, RadioStream], None] = None,
+            reactor : StreamReactor = None, 
+            max_concurrent_starts : int = None, sync_len : int = 0,
+            min_bitrate_kbps : float = 0, stall_grace_sec : float = 10,
+            circuit_breaker : CircuitBreaker = None) -> None:
         if redundancy < 1:
             raise ValueError('Cannot have a redundancy less than 1')
+        if min_bitrate_kbps < 0:
+            raise ValueError('Minimum bitrate cannot be negative')
 
         self._redundant_radio_streams = []
         self._radio_stream_lock = RLock()
+        self._stream_ready = Condition(self._radio_stream_lock)
         self._stream_failover_handlers = []
 
+        # Starting a stream means a browser session to find its URL, so
+        # start them side by side rather than one after another. A primary
+        # and every redundant stream is the most ever needed at once.
+        if max_concurrent_starts is None:
+            max_concurrent_starts = redundancy + 1
+        if max_concurrent_starts < 1:
+            raise ValueError('Must allow at least one stream to start at once')
+        self._start_slots = BoundedSemaphore(max_concurrent_starts)
+        self._starting_count = 0
+        self._should_run = True
+        self._wakeup = Event()
+        self._stopped = Event()
+        self._failover_latencies = deque(maxlen=FAILOVER_LATENCY_HISTORY)
+        self._failover_count = 0
+        self._stall_count = 0
+
         self._page_url = page_url
         self._desired_redundancy = redundancy
         self._desired_buffer_size = buffer_size
         self._stream_start_attempts = start_attempts
         self._desired_redundant_max_age_sec = redundant_max_age_sec
+        self._reactor = reactor
+        self._sync_len = sync_len
+        self._min_bitrate_kbps = min_bitrate_kbps
+        self._stall_grace_sec = stall_grace_sec
+        self._circuit_breaker = circuit_breaker if circuit_breaker is not None \
+                                    else get_circuit_breaker(page_url)
         
         if on_stream_failover is not None:
             self.add_stream_failover_handler(on_stream_failover)
@@ -119,71 +393,261 @@ class RadioStreamManager(Thread):
     
     def _start_new_stream(self) -> RadioStream:
         result = None
-        while result is None:
+        while result is None and self._should_run:
+            # Back off after failures, rather than firing up one browser
+            # after another while the station is down
+            delay = self._circuit_breaker.reserve()
+            if delay > 0:
+                self._stopped.wait(delay)
+                continue
+
             try:
-                result = RadioStream(self._page_url, 
-                            buffer_size=self._desired_buffer_size, 
-                            attempts=self._stream_start_attempts)
-                result.start()
-            except TimeoutException:
+                if self._reactor is None:
+                    stream = RadioStream(self._page_url, 
+                                buffer_size=self._desired_buffer_size, 
+                                attempts=self._stream_start_attempts,
+                                on_exit=self._handleStreamExit,
+                                on_ready=self._handleStreamReady)
+                else:
+                    stream = ReactorRadioStream(self._page_url, 
+                                buffer_size=self._desired_buffer_size, 
+                                attempts=self._stream_start_attempts,
+                                reactor=self._reactor,
+                                on_exit=self._handleStreamExit,
+                                on_ready=self._handleStreamReady)
+                stream.start()
+                result = stream
+            except TimeoutException as e:
                 log.debug("RadioStream failed to start due to TimeoutException. Will try again.")
-            except:
+                self._circuit_breaker.record_failure(repr(e))
+            except Exception as e:
                 log.exception("An unexpected exception occurred while trying to start a new RadioStream.")
+                self._circuit_breaker.record_failure(repr(e))
         return result
 
+    def _start_stream_in_background(self) -> None:
+        # Call with _radio_stream_lock held
+        self._starting_count += 1
+        Thread(target=self._start_and_adopt_stream, daemon=True,
+            name='RadioStreamStarter').start()
+
+    def _start_and_adopt_stream(self) -> None:
+        # Runs without the lock, so that other threads can still get at the
+        # streams while the browser does its thing
+        stream = None
+        try:
+            with self._start_slots:
+                stream = self._start_new_stream()
+        finally:
+            with self._radio_stream_lock:
+                self._starting_count -= 1
+                if stream is not None and not self._should_run:
+                    stream.stop()
+                elif stream is not None:
+                    self._redundant_radio_streams.append(stream)
+                    log.debug(f"Radio stream {stream.name} is ready.")
+                self._stream_ready.notify_all()
+
+            # The new stream has an age-out time to be kept track of
+            self._wakeup.set()
+
+    def _handleStreamReady(self, stream : RadioStream) -> None:
+        # Called on whichever thread got the stream past its preroll
+        self._circuit_breaker.record_success()
+
+    def _handleStreamExit(self, stream : RadioStream) -> None:
+        # Called on whichever thread the stream ended on. A stream that
+        # never got going counts against the station as much as one that
+        # couldn't be started at all.
+        if not stream.ready and self._should_run:
+            self._circuit_breaker.record_failure(
+                f"Radio stream {stream.name} ended before it got going")
+        self._wakeup.set()
+
+    def _refresh_interval(self) -> timedelta:
+        # Refreshing one stream at a time, this often, means every stream
+        # gets refreshed once per max age, and their ages end up spread 
+        # evenly across it rather than all running out together
+        return timedelta(seconds=self._desired_redundant_max_age_sec / 
+                                    self._desired_redundancy)
+
+    def _next_refresh_sec(self) -> float:
+        # How long until the next stream is due to be refreshed, or None if
+        # there's nothing due. No less than a second, so a refresh that 
+        # can't happen yet doesn't have us spinning.
+        with self._radio_stream_lock:
+            if self._refresh_date is None or self._refreshing:
+                return None
+            refreshDate = self._refresh_date
+
+        return max((refreshDate - datetime.now()).total_seconds(), 1)
+
+    def _next_wakeup_sec(self) -> float:
+        # Check on the streams' throughput twice per grace period, on top of
+        # whatever refreshing needs
+        timeouts = [self._next_refresh_sec()]
+        if self._stall_grace_sec > 0:
+            timeouts.append(self._stall_grace_sec / 2)
+        timeouts = [t for t in timeouts if t is not None]
+        return min(timeouts) if timeouts else None
+
+    def _drop_starved_streams(self) -> bool:
+        # A stream whose connection is open but has next to nothing coming
+        # through it is no better than a dead one. It may well be stuck in a
+        # read that'll never return, so it's let go of here rather than 
+        # waiting for it to end. Returns whether the primary was starved.
+        primaryStarved = False
+        starved = []
+        with self._radio_stream_lock:
+            for stream in self.radio_streams:
+                if not stream.is_alive() or not is_starved(stream.byte_buffer,
+                        stream.start_date.timestamp(),
+                        self._min_bitrate_kbps * 1000 / 8,
+                        self._stall_grace_sec):
+                    continue
+
+                what = f"less than {self._min_bitrate_kbps:g} kbps" \
+                        if self._min_bitrate_kbps > 0 else "nothing"
+                log.warning(f"Radio stream {stream.name} has received " + 
+                    f"{what} for {self._stall_grace_sec:g} seconds. " + 
+                    "Dropping it.")
+                self._stall_count += 1
+                starved.append(stream)
+
+                if stream is self._primary_radio_stream:
+                    primaryStarved = True
+                else:
+                    self._redundant_radio_streams.remove(stream)
+
+        # Stopping a stream can take a moment, so not while holding the lock
+        for stream in starved:
+            stream.stop()
+        return primaryStarved
+
+    def _refresh_stream(self, old_stream : RadioStream) -> None:
+        # Runs on a thread of its own. The old stream is only let go of 
+        # once its replacement is up and has data coming in.
+        stream = None
+        try:
+            with self._start_slots:
+                stream = self._start_new_stream()
+
+            if stream is not None and not stream.byte_buffer.waitForReadable(
+                    timeout=REFRESH_WARMUP_SEC):
+                log.debug(f"Radio stream {stream.name} didn't warm up in " + 
+                    "time to replace an old one.")
+                stream.stop()
+                stream = None
+        finally:
+            with self._radio_stream_lock:
+                self._refreshing = False
+
+                if stream is not None and not self._should_run:
+                    stream.stop()
+                elif stream is not None:
+                    self._redundant_radio_streams.append(stream)
+                    if old_stream in self._redundant_radio_streams:
+                        log.debug(f"Radio stream {old_stream.name} aged " + 
+                            f"out. Replaced it with {stream.name}.")
+                        old_stream.stop()
+                        self._redundant_radio_streams.remove(old_stream)
+                    self._refresh_date = datetime.now() + \
+                                            self._refresh_interval()
+                else:
+                    # Give it another go in a bit
+                    self._refresh_date = datetime.now() + min(
+                        self._refresh_interval(), 
+                        timedelta(seconds=REFRESH_RETRY_SEC))
+                self._stream_ready.notify_all()
+
+            self._wakeup.set()
+
+    def _record_failover(self, old_primary : RadioStream) -> None:
+        self._failover_count += 1
+        if old_primary.ended_at is None:
+            return
+
+        latency = time.monotonic() - old_primary.ended_at
+        self._failover_latencies.append(latency)
+        log.debug(f"Failed over {latency * 1000:.1f} ms after radio stream " + 
+            f"{old_primary.name} ended.")
+
     def _restore_redundancy(self):
-        max_age = timedelta(seconds=self._desired_redundant_max_age_sec)
         now = datetime.now()
 
         with self._radio_stream_lock:
             # Prune dead streams
-            for stream in self._redundant_radio_streams:
+            for stream in list(self._redundant_radio_streams):
                 if not stream.is_alive():
                     log.debug(f"Radio stream {stream.name} failed.")
                     self._redundant_radio_streams.remove(stream)
-            
-            # Prune aged-out streams
-            for stream in self._redundant_radio_streams:
-                if (    len(self._redundant_radio_streams) > 1
-                            or self._desired_redundancy < 2
-                        ) \
-                        and now - stream.start_date > max_age:
-                    log.debug(f"Radio stream {stream.name} aged out.")
-                    stream.stop()
-                    self._redundant_radio_streams.remove(stream)
+
+            # A refresh can overlap with a stream failing, which leaves us
+            # with one more than we need
+            if not self._refreshing:
+                while len(self._redundant_radio_streams) > \
+                        self._desired_redundancy:
+                    oldest = min(self._redundant_radio_streams, 
+                                key=lambda stream: stream.start_date)
+                    oldest.stop()
+                    self._redundant_radio_streams.remove(oldest)
  
-            # Start up new streams
+            # Start up new streams, counting the ones already on their way
             new_streams_needed = self._desired_redundancy - \
-                                    len(self._redundant_radio_streams)
+                                    len(self._redundant_radio_streams) - \
+                                    self._starting_count
 
             if new_streams_needed > 0:
                 log.debug(f"Starting {new_streams_needed} new radio streams.")
 
             for i in range(0, new_streams_needed):
-                self._redundant_radio_streams.append(self._start_new_stream())
+                self._start_stream_in_background()
+
+            # Refresh aged streams one at a time, bringing each one's
+            # replacement up before letting it go, and only while we're
+            # otherwise at full strength
+            if self._desired_redundant_max_age_sec <= 0 or \
+                    self._refreshing or \
+                    len(self._redundant_radio_streams) < \
+                        self._desired_redundancy:
+                return
+
+            if self._refresh_date is None:
+                self._refresh_date = now + self._refresh_interval()
+            elif now >= self._refresh_date:
+                oldest = min(self._redundant_radio_streams, 
+                            key=lambda stream: stream.start_date)
+                log.debug(f"Refreshing radio stream {oldest.name}.")
+                self._refreshing = True
+                Thread(target=self._refresh_stream, args=(oldest,), 
+                    daemon=True, name='RadioStreamRefresher').start()
 
     def _replace_primary_stream(self):
         with self._radio_stream_lock:
             failover_stream : RadioStream = None
-            for stream in self._redundant_radio_streams:
-                if stream.is_alive() and \
-                        (
-                            failover_stream is None or
-                            failover_stream.byte_buffer.readable_length <
-                                stream.byte_buffer.readable_length
-                        ):
-                    failover_stream = stream
-                    
-            
-            if failover_stream is None:
-                # If all the redundant streams were dead, too, just
-                # make a new stream
-                log.warning("All radio streams have failed.")
-                failover_stream = self._start_new_stream()
-            else:
-                self._redundant_radio_streams.remove(failover_stream)
+            warned = False
+            while failover_stream is None:
+                if not self._should_run:
+                    return
+                failover_stream = pick_failover_stream(
+                                    self._redundant_radio_streams,
+                                    self._primary_radio_stream,
+                                    self._sync_len)
+
+                if failover_stream is None:
+                    # If all the redundant streams were dead, too, start
+                    # replacements for all of them at once and take
+                    # whichever is ready first. Waiting lets go of the lock.
+                    if self._primary_radio_stream is not None and not warned:
+                        log.warning("All radio streams have failed.")
+                        warned = True
+                    for i in range(self._starting_count, 
+                            self._desired_redundancy + 1):
+                        self._start_stream_in_background()
+                    self._stream_ready.wait(1)
+
+            self._redundant_radio_streams.remove(failover_stream)
 
-            
             oldPRS = self._primary_radio_stream
             self._primary_radio_stream = failover_stream
             
@@ -191,21 +655,26 @@ class RadioStreamManager(Thread):
             if oldPRS is not None:
                 for handler in self._stream_failover_handlers:
                     handler(oldPRS, failover_stream)
+                self._record_failover(oldPRS)
             
 
     def run(self):
-        event = Event()
-        while True:
+        while self._should_run:
+            self._wakeup.clear()
             try:
+                primaryStarved = self._drop_starved_streams()
                 prs = self._primary_radio_stream
-                if prs is None or not prs.is_alive():
+                if prs is None or not prs.is_alive() or primaryStarved:
                     log.debug(f"Primary stream failed. Replacing...")
                     self._replace_primary_stream()
                 self._restore_redundancy()
             except:
                 log.exception("An unexpected exception occurred in RadioStreamManager.run().")
+
+            # Streams ending wake us up straight away. The timeout is only
+            # there to age streams out and to check on their throughput.
             try:
-                event.wait(.250)
+                self._wakeup.wait(self._next_wakeup_sec())
             except:
                 log.exception("An unexpected exception occurred in RadioStreamManager.run().")
         log.info("RadioStreamManager has stopped.")
@@ -214,6 +683,44 @@ class RadioStreamManager(Thread):
     def primary_radio_stream(self) -> RadioStream:
         with self._radio_stream_lock:
             return self._primary_radio_stream
+
+    @property
+    def radio_streams(self) -> List[RadioStream]:
+        with self._radio_stream_lock:
+            streams = list(self._redundant_radio_streams)
+            if self._primary_radio_stream is not None:
+                streams.insert(0, self._primary_radio_stream)
+            return streams
+
+    # How many times the primary stream has been replaced
+    @property
+    def failover_count(self) -> int:
+        return self._failover_count
+
+    # Seconds from the primary stream ending to its replacement being
+    # synced, for the most recent failovers, oldest first
+    @property
+    def failover_latencies(self) -> List[float]:
+        return list(self._failover_latencies)
+
+    # How many streams have been dropped for not getting enough data
+    @property
+    def stall_count(self) -> int:
+        return self._stall_count
+
+    @property
+    def circuit_breaker(self) -> CircuitBreaker:
+        return self._circuit_breaker
+
+    def stop(self) -> None:
+        with self._radio_stream_lock:
+            self._should_run = False
+            self._stream_ready.notify_all()
+        self._wakeup.set()
+        self._stopped.set()
+
+        for stream in self.radio_streams:
+            stream.stop()
   
     # First param of callable is old stream, second is new
     def add_stream_failover_handler(self, handler : Callable[[RadioStream, RadioStream], None]):
@@ -224,20 +731,56 @@ class RadioStreamManager(Thread):
         if handler in self._stream_failover_handlers:
             self._stream_failover_handlers.remove(handler)
 
+def _split_at_samples(views : List[memoryview], offset : int, 
+        samples : List[Tuple[int, float]]) \
+        -> Iterator[Tuple[memoryview, float]]:
+    # Cuts views, which start at offset, wherever the next time index sample
+    # starts, giving each piece the timestamp of the sample it falls in
+    i = 0
+    for view in views:
+        while len(view) > 0:
+            while i + 1 < len(samples) and samples[i + 1][0] <= offset:
+                i += 1
+
+            length = len(view)
+            if i + 1 < len(samples):
+                length = min(length, samples[i + 1][0] - offset)
+            yield view[:length], samples[i][1]
+
+            view = view[length:]
+            offset += length
+
 class RedundantRadioStream(Thread):
+    """
+    Keeps byte_buffer fed from whichever of a RadioStreamManager's streams
+    is the primary. By default that takes a thread for this, one for the
+    manager and one per stream. Given a StreamReactor, the streams are read
+    by the reactor's thread instead. Given an AsyncEngine, the streams and
+    the manager run on the engine's loop, and this thread only does the
+    writing, failovers included, so a slow disk never holds up the loop.
+    """
     _byte_buffer : ByteBuffer = None
     _write_lock : RLock = None
-    _radio_stream_manager : RadioStreamManager = None
+    _failovers : Deque[Tuple[AsyncRadioStream, AsyncRadioStream]] = None
+    _failovers_lock : Lock = None
+    _radio_stream_manager : Union[RadioStreamManager, 
+                                AsyncRadioStreamManager] = None
+    _engine : AsyncEngine = None
     _sync_len : int = 10000
     _should_run : bool = True
+    _bytes_lost : int = 0
 
     def __init__(self, page_url : str, redundancy : int = 2, 
             redundant_buffer_size : int = 307200,
             byte_buffer : ByteBuffer = None,
             cache_buffer_size : int = 307200, start_attempts : int = 3, 
-            redundant_max_age_sec : int = 0, sync_len : int = 10000) -> None:
+            redundant_max_age_sec : int = 0, sync_len : int = 10000,
+            engine : AsyncEngine = None, 
+            reactor : StreamReactor = None, min_bitrate_kbps : float = 0,
+            stall_grace_sec : float = 10) -> None:
         if byte_buffer is None:
-            self._byte_buffer = ByteBuffer(redundant_buffer_size)
+            self._byte_buffer = ByteBuffer(redundant_buffer_size, 
+                                    index_frames=True)
         else:
             self._byte_buffer = byte_buffer
 
@@ -249,52 +792,148 @@ class RedundantRadioStream(Thread):
         self._write_lock = RLock()
         self._sync_len = sync_len
         self._should_run = True
+        self._bytes_lost = 0
+        self._engine = engine
+        self._failovers = deque()
+        self._failovers_lock = Lock()
 
-        self._radio_stream_manager = RadioStreamManager(page_url, 
+        if engine is not None and reactor is not None:
+            raise ValueError("Cannot use both an engine and a reactor")
+
+        if engine is None:
+            self._radio_stream_manager = RadioStreamManager(page_url, 
                                         redundancy=redundancy, 
                                         buffer_size=cache_buffer_size, 
                                         start_attempts=start_attempts,
-                                        redundant_max_age_sec=redundant_max_age_sec)
-        self._radio_stream_manager.add_stream_failover_handler(
-            self.handleFailover)
+                                        redundant_max_age_sec=redundant_max_age_sec,
+                                        reactor=reactor, sync_len=sync_len,
+                                        min_bitrate_kbps=min_bitrate_kbps,
+                                        stall_grace_sec=stall_grace_sec)
+        else:
+            self._radio_stream_manager = AsyncRadioStreamManager(engine, 
+                                        page_url, redundancy=redundancy, 
+                                        buffer_size=cache_buffer_size, 
+                                        start_attempts=start_attempts,
+                                        redundant_max_age_sec=redundant_max_age_sec,
+                                        sync_len=sync_len,
+                                        min_bitrate_kbps=min_bitrate_kbps,
+                                        stall_grace_sec=stall_grace_sec)
+
+        if engine is None:
+            self._radio_stream_manager.add_stream_failover_handler(
+                self.handleFailover)
+        else:
+            self._radio_stream_manager.add_stream_failover_handler(
+                self._queueFailover)
 
         super().__init__(daemon=True)
 
     @property
     def byte_buffer(self):
         return self._byte_buffer
-    
+
+    @property
+    def engine(self) -> AsyncEngine:
+        return self._engine
+
+    def _queueFailover(self, old_primary : AsyncRadioStream, 
+            new_primary : AsyncRadioStream) -> None:
+        # Called on the engine's loop, which mustn't wait on our disk. So
+        # run() does the failing over, before it reads anything more.
+        with self._failovers_lock:
+            self._failovers.append((old_primary, new_primary))
+        old_primary.byte_buffer.wakeWaiters()
+
+    def _followFailovers(self, prs : AsyncRadioStream) -> AsyncRadioStream:
+        # Only moves on from the primary we've been reading once we've
+        # synced with the next one, rather than going by the manager's idea
+        # of the primary, which changes before the failover is handled
+        while True:
+            with self._failovers_lock:
+                if len(self._failovers) == 0:
+                    break
+                old_primary, new_primary = self._failovers.popleft()
+            self.handleFailover(old_primary, new_primary)
+            prs = new_primary
+
+        if prs is None:
+            prs = self._radio_stream_manager.primary_radio_stream
+        return prs
+
     def run(self):
         if not self._radio_stream_manager.is_alive():
             self._radio_stream_manager.start()
 
-        # TODO: Read a bit, write it to the main buffer
         event = Event()
+        prs = None
 
         while self._should_run:
-            rsm = self._radio_stream_manager
-            if rsm.primary_radio_stream is None:
+            if self._engine is None:
+                prs = self._radio_stream_manager.primary_radio_stream
+            else:
+                prs = self._followFailovers(prs)
+            if prs is None:
                 event.wait(.250)
                 continue
 
-            with self._write_lock:
-                self.byte_buffer.append(
-                    rsm.primary_radio_stream.byte_buffer
-                        .readUpToRemainingLength(
-                            self._sync_len
-                        )
-                )
-            event.wait(.250)
+            # Wake up as soon as the primary has something past the sync
+            # bytes to hand over. The timeout is just so we notice a
+            # failover or a stop() while the primary is quiet.
+            source = prs.byte_buffer
+            try:
+                if source.waitForReadable(
+                        min(self._sync_len + 1, source.length), timeout=1) \
+                        and prs is \
+                            self._radio_stream_manager.primary_radio_stream:
+                    if self._transferUpToSyncLength(source) == 0:
+                        event.wait(.250)
+            except:
+                log.exception("An unexpected exception occurred in RedundantRadioStream.run().")
+                event.wait(.250)
+
+    def _transferUpToSyncLength(self, source : ByteBuffer) -> int:
+        # Copy straight from the source's ring into ours, leaving the last
+        # sync_len bytes behind so a failover can still sync on them
+        transferred = 0
+        with self._write_lock:
+            while True:
+                with source.byte_array_lock:
+                    length = min(source.readable_length - self._sync_len, 
+                                self.byte_buffer.length)
+                if length <= 0:
+                    return transferred
+
+                # Anything of ours that has to go to disk first goes now,
+                # while the source is free to keep receiving. Holding its
+                # lock across disk writes would stall the source, and under
+                # a shared reactor or event loop, every other stream too.
+                self.byte_buffer.makeRoom(length)
+
+                with source.byte_array_lock:
+                    # The source may have taken back some of what was there
+                    # for a read of its own while its lock was free
+                    length = min(length, 
+                                source.readable_length - self._sync_len)
+                    if length <= 0:
+                        continue
+
+                    # Keep the times the bytes came off the network, not 
+                    # the time they got here, sample by sample so that ours
+                    # can still find the frame at a given time
+                    offset = source.read_offset
+                    samples = source.time_index.samplesBetween(offset, 
+                                offset + length)
+                    for piece, timestamp in _split_at_samples(
+                            source.readViews(length), offset, samples):
+                        self.byte_buffer.append(piece, timestamp)
+                    source.commit(length)
+                    transferred += length
 
     def handleFailover(self, old_primary : RadioStream, new_primary : RadioStream) -> None:
         try:
             self._write_lock.acquire()
 
-            self.byte_buffer.append(
-                old_primary.byte_buffer.readUpToRemainingLength(
-                    self._sync_len
-                )
-            )
+            self._transferUpToSyncLength(old_primary.byte_buffer)
 
             syncBytes = self.byte_buffer.readFromEnd(self._sync_len, consume=False)
 
@@ -307,30 +946,90 @@ class RedundantRadioStream(Thread):
                 log.warning(f"Failed to sync new primary stream", exc_info=True)
                 log.warning("Data will just be appended normally. This may " + 
                     "result in a \"jump\" in the recording.")
+
+                lost = estimate_bytes_lost(old_primary.byte_buffer, 
+                            new_primary.byte_buffer)
+                self._bytes_lost += lost
+                if lost > 0:
+                    log.warning(f"Roughly {lost} bytes of audio were lost.")
             
         finally:
             self._write_lock.release()
 
+        # run() is probably still waiting on the old primary, which will 
+        # never have anything more to give
+        old_primary.byte_buffer.wakeWaiters()
+
+    # How many times the primary stream has been replaced
+    @property
+    def failover_count(self) -> int:
+        return self._radio_stream_manager.failover_count
+
+    # Seconds from the primary stream ending to its replacement being
+    # synced, for the most recent failovers, oldest first
+    @property
+    def failover_latencies(self) -> List[float]:
+        return self._radio_stream_manager.failover_latencies
+
+    # How many streams have been dropped for not getting enough data
+    @property
+    def stall_count(self) -> int:
+        return self._radio_stream_manager.stall_count
+
+    # Roughly how much audio has gone missing from failovers that couldn't
+    # sync, judging by the gap between the old and new primaries
+    @property
+    def bytes_lost(self) -> int:
+        return self._bytes_lost
+
+    # Holds off on starting new streams while the station is failing
+    @property
+    def circuit_breaker(self) -> CircuitBreaker:
+        return self._radio_stream_manager.circuit_breaker
+
     def stop(self) -> None:
         self._should_run = False
+        self._radio_stream_manager.stop()
+
+        # run() is probably waiting on the primary, which won't have 
+        # anything more for it
+        prs = self._radio_stream_manager.primary_radio_stream
+        if prs is not None:
+            prs.byte_buffer.wakeWaiters()
 
 class PersistentRedundantRadioStream(RedundantRadioStream):
+    _hls_segmenters : List[HlsSegmenter] = None
+
     def __init__(self, filepath : str, page_url : str, redundancy: int = 2, 
             persistent_buffer_size: int = 50000, 
             cache_buffer_size : int = 307200, overwrite : bool = False, 
             should_write : bool = True, start_attempts: int = 3, 
             redundant_max_age_sec : int = 0,
-            sync_len: int = 10000) -> None:
+            sync_len: int = 10000, file_buffer_size : int = 0,
+            fsync_policy : str = FSYNC_NONE, 
+            fsync_interval_sec : float = 0,
+            write_behind_high_water_mark : int = 0,
+            preallocate_sec : float = 0, engine : AsyncEngine = None,
+            reactor : StreamReactor = None, min_bitrate_kbps : float = 0,
+            stall_grace_sec : float = 10) -> None:
         
         byteBuffer = PersistentByteBuffer(filepath, 
                         length=persistent_buffer_size, 
-                        overwrite=overwrite, should_write=should_write)
+                        overwrite=overwrite, should_write=should_write,
+                        index_frames=True, file_buffer_size=file_buffer_size,
+                        fsync_policy=fsync_policy,
+                        fsync_interval_sec=fsync_interval_sec,
+                        write_behind_high_water_mark=write_behind_high_water_mark,
+                        preallocate_sec=preallocate_sec)
         self._filepath = filepath
+        self._hls_segmenters = []
 
         super().__init__(page_url=page_url, redundancy=redundancy, 
             byte_buffer=byteBuffer, cache_buffer_size=cache_buffer_size, 
             start_attempts=start_attempts, sync_len=sync_len,
-            redundant_max_age_sec=redundant_max_age_sec)
+            redundant_max_age_sec=redundant_max_age_sec, engine=engine,
+            reactor=reactor, min_bitrate_kbps=min_bitrate_kbps,
+            stall_grace_sec=stall_grace_sec)
     
     @property
     def filepath(self) -> str:
@@ -348,6 +1047,39 @@ class PersistentRedundantRadioStream(RedundantRadioStream):
     def should_write(self, value : bool) -> None:
         self._byte_buffer.should_write = value
 
+    def rotateAt(self, when : datetime, filepath : str) -> None:
+        """
+        Starts writing to filepath at the ADTS frame boundary closest to the
+        audio that arrived at the given time. Returns right away; the switch
+        happens once that audio makes its way through the buffer.
+        """
+        self._byte_buffer.rotateAt(when, filepath)
+
+    def addHlsSegmenter(self, output_dir : str, 
+            segment_duration_sec : float = 6, 
+            playlist_length : int = 6) -> HlsSegmenter:
+        """
+        Starts writing the stream out as HLS segments and a playlist in
+        output_dir as well, alongside the regular file.
+        """
+        segmenter = HlsSegmenter(self._byte_buffer, output_dir, 
+                        segment_duration_sec=segment_duration_sec,
+                        playlist_length=playlist_length)
+        segmenter.start()
+        self._hls_segmenters.append(segmenter)
+        return segmenter
 
     def writeAll(self) -> None:
-        self._byte_buffer.writeAll()
\ No newline at end of file
+        self._byte_buffer.writeAll()
+
+    def stop(self) -> None:
+        super().stop()
+
+        for segmenter in self._hls_segmenters:
+            segmenter.stop(timeout=5)
+
+        # Let run() finish what it's in the middle of before closing the
+        # file out from under it
+        if self.is_alive() and current_thread() is not self:
+            self.join(timeout=5)
+        self._byte_buffer.close()
\ No newline at end of file
@@ -0,0 +1,323 @@
+from __future__ import annotations
+from datetime import datetime, timedelta
+from threading import Event, Thread
+from typing import Any, Dict, List, NamedTuple
+import json, logging, os
+
+from app.async_stream import get_default_engine
+from app.radio_stream import PersistentRedundantRadioStream
+from app.stream_reactor import get_default_reactor
+
+DATETIME_PARSE_FORMAT : str = r'%Y-%m-%d %H:%M:%S'
+DATETIME_FILE_FORMAT : str = r'%Y-%m-%d_%H%M'
+DATETIME_CONSOLE_FORMAT : str = r'%A, %B %d at %I:%M:%S %p'
+
+ONE_HOUR : timedelta = timedelta(hours=1)
+
+log = logging.getLogger('RadioRec')
+
+def wait_until(date : datetime, stop_event : Event = None) -> None:
+    """
+    Blocks until the given date, or until stop_event is set.
+    """
+    e = stop_event if stop_event is not None else Event()
+
+    now = datetime.now()
+    if date < now:
+        return
+
+    longTimedelta = timedelta(seconds=15)
+    # Check the current date less often when we're
+    # very far out from the target date
+    while date - datetime.now() > longTimedelta and not e.is_set():
+        e.wait(10)
+
+    shortTimedelta = timedelta(seconds=1)
+    while date - datetime.now() > shortTimedelta and not e.is_set():
+        e.wait(0.1)
+
+    while date > datetime.now() and not e.is_set():
+        e.wait(0.01)
+
+def _file_path(output_dir : str, date : datetime) -> str:
+    return os.path.join(output_dir, f"{date.strftime(DATETIME_FILE_FORMAT)}.aac")
+
+def record_until(prrs : PersistentRedundantRadioStream,
+        output_dir : str, endDate : datetime, rotate : bool = False,
+        stop_event : Event = None) -> None:
+    if not prrs.should_write:
+        prrs.filepath = _file_path(output_dir, datetime.now())
+        prrs.should_write = True
+
+    # Cut over to the next file at the frame boundary closest to endDate,
+    # rather than whenever we get around to it after waking up
+    if rotate:
+        prrs.rotateAt(endDate, _file_path(output_dir, endDate))
+
+    log.debug(f"Will record until {endDate.strftime(DATETIME_CONSOLE_FORMAT)}")
+    wait_until(endDate, stop_event)
+
+def record_hour(prrs : PersistentRedundantRadioStream,
+        output_dir : str, stop_event : Event = None) -> None:
+    endDate = datetime.now() + timedelta(hours=1)
+    endDate = endDate.replace(minute=0, second=0, microsecond=0)
+
+    # Another interval always follows an hour, so hand over to its file
+    record_until(prrs, output_dir, endDate, rotate=True,
+        stop_event=stop_event)
+
+def record_schedule(prrs : PersistentRedundantRadioStream, output_dir : str,
+        end_date : datetime = None, stop_event : Event = None) -> None:
+    """
+    Records to hourly files in output_dir until end_date, or forever if
+    there isn't one, or until stop_event is set.
+    """
+    def stopped() -> bool:
+        return stop_event is not None and stop_event.is_set()
+
+    if end_date:
+        endHour = end_date.replace(minute=0, second=0, microsecond=0)
+
+    while not stopped() and \
+            (not end_date or endHour - datetime.now() > ONE_HOUR):
+        log.debug("Starting new hour interval")
+        record_hour(prrs, output_dir, stop_event)
+
+    if end_date and datetime.now() < end_date and not stopped():
+        log.debug("Recording straight until the end date.")
+        record_until(prrs, output_dir, end_date, stop_event=stop_event)
+
+ENGINES = ('thread', 'selectors', 'asyncio')
+
+def engine_options(engine : str) -> Dict[str, Any]:
+    """
+    Returns the PersistentRedundantRadioStream arguments that select the
+    named stream engine, using this process's shared engine or reactor.
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown engine: {engine}")
+
+    return {
+        'engine': get_default_engine() if engine == 'asyncio' else None,
+        'reactor': get_default_reactor() if engine == 'selectors' else None
+    }
+
+class StationConfig(NamedTuple):
+    station_id : str
+    page_url : str
+    output_dir : str
+    redundancy : int = 2
+    start_date : datetime = None
+    end_date : datetime = None
+    refresh_streams_after : int = 7200
+    hls_dir : str = None
+
+def _parseDate(station_id : str, value : str) -> datetime:
+    if value is None:
+        return None
+
+    try:
+        return datetime.strptime(value, DATETIME_PARSE_FORMAT)
+    except ValueError as e:
+        raise ValueError(f"Station {station_id}: dates must be given in " +
+            "this format: YYYY-MM-DD HH:MM:SS") from e
+
+def parse_station_configs(config : Dict[str, Any],
+        output_dir : str = './output') -> List[StationConfig]:
+    """
+    Builds StationConfigs from a config like:
+
+    {
+        "defaults": {"redundancy": 2},
+        "stations": [
+            {"id": "wxyz", "page_url": "https://...",
+             "start_date": "2021-11-01 06:00:00",
+             "end_date": "2021-11-01 10:00:00"}
+        ]
+    }
+
+    Anything in defaults applies to every station that doesn't set it
+    itself. A station's output_dir defaults to a directory named after it
+    in output_dir.
+    """
+    defaults = config.get('defaults', {})
+    stations = config.get('stations')
+    if not stations:
+        raise ValueError('The config must list at least one station')
+
+    result = []
+    for station in stations:
+        station = {**defaults, **station}
+
+        stationID = station.get('id')
+        if not stationID:
+            raise ValueError('Every station needs an id')
+        if any(existing.station_id == stationID for existing in result):
+            raise ValueError(f"Station {stationID} is listed more than once")
+        if not station.get('page_url'):
+            raise ValueError(f"Station {stationID} needs a page_url")
+
+        unknown = set(station) - {'id', 'page_url', 'output_dir',
+                        'redundancy', 'start_date', 'end_date',
+                        'refresh_streams_after', 'hls_dir'}
+        if unknown:
+            raise ValueError(f"Station {stationID} has unknown settings: " +
+                ', '.join(sorted(unknown)))
+
+        stationConfig = StationConfig(
+            station_id=stationID,
+            page_url=station['page_url'],
+            output_dir=station.get('output_dir',
+                            os.path.join(output_dir, stationID)),
+            redundancy=int(station.get('redundancy', 2)),
+            start_date=_parseDate(stationID, station.get('start_date')),
+            end_date=_parseDate(stationID, station.get('end_date')),
+            refresh_streams_after=int(station.get('refresh_streams_after',
+                                        7200)),
+            hls_dir=station.get('hls_dir'))
+
+        if stationConfig.redundancy < 1:
+            raise ValueError(f"Station {stationID} needs a redundancy " +
+                "of at least 1")
+        if stationConfig.start_date and stationConfig.end_date and \
+                stationConfig.end_date <= stationConfig.start_date:
+            raise ValueError(f"Station {stationID} ends before it starts")
+
+        result.append(stationConfig)
+
+    return result
+
+def load_station_configs(filepath : str,
+        output_dir : str = './output') -> List[StationConfig]:
+    with open(filepath) as f:
+        return parse_station_configs(json.load(f), output_dir=output_dir)
+
+class StationRecorder(Thread):
+    """
+    Records one station on its own thread, following its schedule. Everything
+    that can go wrong with a station is caught here, so that one station
+    failing doesn't take any of the others down with it.
+
+    prrs_options are passed on to the station's
+    PersistentRedundantRadioStream.
+    """
+    _config : StationConfig = None
+    _prrs_options : Dict[str, Any] = None
+    _prrs : PersistentRedundantRadioStream = None
+    _stop_event : Event = None
+    _error : BaseException = None
+
+    def __init__(self, config : StationConfig,
+            prrs_options : Dict[str, Any] = None) -> None:
+        self._config = config
+        self._prrs_options = prrs_options or {}
+        self._stop_event = Event()
+
+        super().__init__(daemon=True, name=f"Station-{config.station_id}")
+
+    @property
+    def config(self) -> StationConfig:
+        return self._config
+
+    @property
+    def prrs(self) -> PersistentRedundantRadioStream:
+        return self._prrs
+
+    # The exception that ended the recording, if one did
+    @property
+    def error(self) -> BaseException:
+        return self._error
+
+    def stop(self) -> None:
+        self._stop_event.set()
+
+    def status(self) -> Dict[str, Any]:
+        """
+        Returns a snapshot of how the station is doing, made of plain values
+        so it can be logged or sent to another process.
+        """
+        prrs = self._prrs
+        result = {
+            'alive': self.is_alive(),
+            'error': None if self._error is None else repr(self._error),
+            'recording': False,
+            'filepath': None,
+            'recorded_bytes': 0,
+            'byte_rate': None,
+            'failovers': 0,
+            'last_failover_latency_sec': None,
+            'stalls': 0,
+            'bytes_lost': 0,
+            'circuit_breaker': None
+        }
+
+        if prrs is not None:
+            result['recording'] = prrs.should_write
+            result['filepath'] = prrs.filepath
+            result['recorded_bytes'] = prrs.byte_buffer.write_offset
+            result['byte_rate'] = prrs.byte_buffer.byte_rate
+
+            latencies = prrs.failover_latencies
+            result['failovers'] = prrs.failover_count
+            if latencies:
+                result['last_failover_latency_sec'] = latencies[-1]
+            result['stalls'] = prrs.stall_count
+            result['bytes_lost'] = prrs.bytes_lost
+            result['circuit_breaker'] = prrs.circuit_breaker.status()
+
+        return result
+
+    def run(self) -> None:
+        config = self._config
+        try:
+            self._record()
+        except BaseException as e:
+            self._error = e
+            log.exception(f"Station {config.station_id} failed.")
+        finally:
+            self._finish()
+            log.info(f"Station {config.station_id}: Recording finished")
+
+    def _record(self) -> None:
+        config = self._config
+
+        if config.end_date and config.end_date < datetime.now():
+            log.warning(f"Station {config.station_id}: End date has " +
+                "already passed.")
+            return
+
+        os.makedirs(config.output_dir, exist_ok=True)
+
+        self._prrs = PersistentRedundantRadioStream(
+                        os.path.join(config.output_dir, 'output.aac'),
+                        config.page_url, redundancy=config.redundancy,
+                        should_write=False,
+                        redundant_max_age_sec=config.refresh_streams_after,
+                        **self._prrs_options)
+        self._prrs.start()
+
+        if config.start_date:
+            log.info(f"Station {config.station_id}: Waiting for start " +
+                f"date: {config.start_date.strftime(DATETIME_CONSOLE_FORMAT)}")
+            wait_until(config.start_date, self._stop_event)
+            self._prrs.byte_buffer.seekToEnd()
+
+        if config.hls_dir:
+            self._prrs.addHlsSegmenter(config.hls_dir)
+
+        log.info(f"Station {config.station_id}: Recording started")
+        record_schedule(self._prrs, config.output_dir,
+            end_date=config.end_date, stop_event=self._stop_event)
+
+    def _finish(self) -> None:
+        if self._prrs is None:
+            return
+
+        try:
+            self._prrs.writeAll()
+            self._prrs.should_write = False
+        except:
+            log.exception(f"Station {self._config.station_id}: Failed " +
+                "to write out the end of the recording.")
+        finally:
+            self._prrs.stop()
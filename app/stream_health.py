@@ -0,0 +1,151 @@
+from __future__ import annotations
+from typing import Any, List, NamedTuple, Tuple
+import time
+
+from app.byte_buffer import ByteBuffer
+
+# A stream that hasn't received anything for this long is taken to have
+# stalled, even if its connection is still open
+STALLED_AFTER_SEC = 2
+
+class StreamHealth(NamedTuple):
+    # Bytes per second the stream has been receiving, or None if not known yet
+    byte_rate : float
+    # Seconds since the stream last received anything, or None if it never
+    # has
+    idle_sec : float
+    # Whether the primary's sync bytes are in the stream's buffer, or None if
+    # there weren't any to look for
+    has_sync : bool
+    # Seconds after the primary that the stream received the sync bytes, or
+    # None if that isn't known. Negative if it got them first.
+    lag_sec : float
+    readable_length : int
+
+    @property
+    def stalled(self) -> bool:
+        return self.idle_sec is None or self.idle_sec > STALLED_AFTER_SEC
+
+def sync_reference(primary_buffer : ByteBuffer,
+        sync_len : int) -> Tuple[bytes, float]:
+    """
+    Returns the bytes that a failover away from the given buffer will sync
+    on, i.e. the last sync_len bytes of it, along with when the last of them
+    arrived. Returns (None, None) if there aren't that many yet.
+    """
+    with primary_buffer.byte_array_lock:
+        if sync_len <= 0 or primary_buffer.readable_length < sync_len:
+            return None, None
+
+        syncBytes = bytes(primary_buffer.readFromEnd(sync_len, consume=False))
+        return syncBytes, primary_buffer.time_index.timestampAt(
+                                primary_buffer.write_offset - 1)
+
+def measure_health(byte_buffer : ByteBuffer, sync_bytes : bytes = None,
+        sync_timestamp : float = None) -> StreamHealth:
+    """
+    Takes stock of a stream's buffer. If sync_bytes are given, also checks
+    whether the stream has them, and how far behind sync_timestamp (when
+    the primary got them) it got them.
+    """
+    with byte_buffer.byte_array_lock:
+        lastWrite = byte_buffer.last_write_time
+        hasSync = None
+        lagSec = None
+
+        if sync_bytes is not None:
+            try:
+                syncEnd = byte_buffer.findSequenceOffset(sync_bytes) + \
+                            len(sync_bytes)
+                hasSync = True
+            except ValueError:
+                hasSync = False
+
+            if hasSync and sync_timestamp is not None:
+                syncTimestamp = byte_buffer.time_index.timestampAt(syncEnd - 1)
+                if syncTimestamp is not None:
+                    lagSec = syncTimestamp - sync_timestamp
+
+        return StreamHealth(
+            byte_rate=byte_buffer.byte_rate,
+            idle_sec=None if lastWrite is None else time.time() - lastWrite,
+            has_sync=hasSync,
+            lag_sec=lagSec,
+            readable_length=byte_buffer.readable_length)
+
+def received_since(byte_buffer : ByteBuffer, since : float) -> int:
+    """
+    Returns how many bytes the buffer has received since the given
+    time.time() timestamp, going back no further than the bytes it still
+    has stored.
+    """
+    with byte_buffer.byte_array_lock:
+        offset = byte_buffer.time_index.offsetAt(since)
+        return 0 if offset is None else byte_buffer.write_offset - offset
+
+def is_starved(byte_buffer : ByteBuffer, started : float,
+        min_byte_rate : float, grace_sec : float) -> bool:
+    """
+    Returns whether a stream that started at the given time.time() timestamp
+    has received less than min_byte_rate bytes per second (or nothing at all)
+    over the last grace_sec seconds. Streams younger than that get the
+    benefit of the doubt.
+    """
+    now = time.time()
+    if grace_sec <= 0 or now - started < grace_sec:
+        return False
+
+    return received_since(byte_buffer, now - grace_sec) < \
+            max(1, min_byte_rate * grace_sec)
+
+def estimate_bytes_lost(old_buffer : ByteBuffer,
+        new_buffer : ByteBuffer) -> int:
+    """
+    Estimates how much audio is missing between the last bytes the old
+    primary got and the first unread bytes of the new one, judging by when
+    they arrived, for a failover that couldn't sync. Returns 0 if the two
+    overlap, or if there's not enough to go on.
+    """
+    lastOld = old_buffer.last_write_time
+    with new_buffer.byte_array_lock:
+        firstNew = new_buffer.time_index.timestampAt(new_buffer.read_offset)
+    byteRate = old_buffer.byte_rate or new_buffer.byte_rate
+
+    if lastOld is None or firstNew is None or byteRate is None:
+        return 0
+    return max(0, int((firstNew - lastOld) * byteRate))
+
+def _failoverRank(health : StreamHealth) -> Tuple:
+    # Lower is better. A stream that isn't getting anything is no use, no
+    # matter what's in it. After that, one with the sync bytes can be
+    # spliced in without a jump, and the less it lags the primary, the
+    # sooner the recording picks back up.
+    return (health.stalled, health.has_sync is False,
+            health.lag_sec if health.lag_sec is not None else 0,
+            -health.readable_length)
+
+def pick_failover_stream(candidates : List[Any], old_primary : Any = None,
+        sync_len : int = 0) -> Any:
+    """
+    Returns whichever of the candidate streams can take over from
+    old_primary the soonest and the most cleanly, or None if none of them
+    are alive.
+    """
+    syncBytes, syncTimestamp = (None, None)
+    if old_primary is not None:
+        syncBytes, syncTimestamp = sync_reference(old_primary.byte_buffer,
+                                        sync_len)
+
+    best = None
+    bestRank = None
+    for stream in candidates:
+        if not stream.is_alive():
+            continue
+
+        rank = _failoverRank(measure_health(stream.byte_buffer,
+                    syncBytes, syncTimestamp))
+        if best is None or rank < bestRank:
+            best = stream
+            bestRank = rank
+
+    return best
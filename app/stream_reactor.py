@@ -0,0 +1,145 @@
+from __future__ import annotations
+from collections import deque
+from threading import Lock, Thread
+from typing import Callable, Deque, Tuple
+import logging, selectors, socket
+
+log = logging.getLogger('RadioRec')
+
+class StreamReactor(Thread):
+    """
+    Waits on any number of sockets from one thread, and calls each socket's
+    callback from that thread whenever the socket becomes readable. The
+    callbacks must not block.
+
+    Sockets can be registered and unregistered from any thread.
+    """
+    _selector : selectors.BaseSelector = None
+    _pending : Deque[Tuple] = None
+    _pending_lock : Lock = None
+    _start_lock : Lock = None
+    _wakeup_recv : socket.socket = None
+    _wakeup_send : socket.socket = None
+    _should_run : bool = True
+
+    def __init__(self) -> None:
+        self._selector = selectors.DefaultSelector()
+        self._pending = deque()
+        self._pending_lock = Lock()
+        self._start_lock = Lock()
+        self._should_run = True
+
+        # Lets other threads interrupt select() when they change what's
+        # registered
+        self._wakeup_recv, self._wakeup_send = socket.socketpair()
+        self._wakeup_recv.setblocking(False)
+        self._wakeup_send.setblocking(False)
+        self._selector.register(self._wakeup_recv, selectors.EVENT_READ, None)
+
+        super().__init__(daemon=True, name='StreamReactor')
+
+    # How many sockets are registered, not counting our own
+    @property
+    def socket_count(self) -> int:
+        return len(self._selector.get_map()) - 1
+
+    def register(self, sock : socket.socket,
+            on_readable : Callable[[], None]) -> None:
+        sock.setblocking(False)
+        self._queue('register', sock, on_readable)
+
+    def unregister(self, sock : socket.socket) -> None:
+        self._queue('unregister', sock)
+
+    def call(self, on_readable : Callable[[], None]) -> None:
+        """
+        Calls on_readable on the reactor's next pass, for data that's ready
+        without its socket showing up as readable, e.g. decrypted bytes
+        buffered in an SSL socket.
+        """
+        self._queue('call', on_readable)
+
+    def _queue(self, *item) -> None:
+        with self._start_lock:
+            if not self.is_alive():
+                self.start()
+
+        with self._pending_lock:
+            self._pending.append(item)
+        self._wake()
+
+    def _wake(self) -> None:
+        try:
+            self._wakeup_send.send(b'\0')
+        except BlockingIOError:
+            # There's already a wakeup waiting to be read
+            pass
+
+    def _applyPending(self) -> None:
+        # Only what's queued so far, so that a callback calling itself again
+        # still lets select() run in between
+        with self._pending_lock:
+            count = len(self._pending)
+
+        for i in range(0, count):
+            with self._pending_lock:
+                item = self._pending.popleft()
+
+            if item[0] == 'call':
+                self._callback(item[1])
+                continue
+
+            try:
+                if item[0] == 'register':
+                    self._selector.register(item[1], selectors.EVENT_READ,
+                        item[2])
+                else:
+                    self._selector.unregister(item[1])
+                    continue
+            except (KeyError, ValueError, OSError):
+                # Already registered, already gone, or already closed
+                log.debug(f"StreamReactor couldn't {item[0]} a socket",
+                    exc_info=True)
+                continue
+
+            # Data may have come in (or be sitting decrypted in an SSL
+            # socket) before the socket was registered
+            self._callback(item[2])
+
+    def _callback(self, on_readable : Callable[[], None]) -> None:
+        try:
+            on_readable()
+        except:
+            log.exception("An unexpected exception occurred in a " +
+                "StreamReactor callback.")
+
+    def stop(self) -> None:
+        self._should_run = False
+        self._wake()
+
+    def run(self) -> None:
+        while self._should_run:
+            self._applyPending()
+
+            for key, events in self._selector.select(timeout=1):
+                if key.data is None:
+                    try:
+                        while self._wakeup_recv.recv(4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                    continue
+
+                self._callback(key.data)
+
+        self._selector.close()
+
+_default_reactor : StreamReactor = None
+_default_reactor_lock = Lock()
+
+def get_default_reactor() -> StreamReactor:
+    global _default_reactor
+    with _default_reactor_lock:
+        if _default_reactor is None:
+            _default_reactor = StreamReactor()
+        return _default_reactor
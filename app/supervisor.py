@@ -0,0 +1,314 @@
+from __future__ import annotations
+from logging.handlers import QueueHandler, QueueListener
+from queue import Empty
+from typing import Any, Callable, Dict, List
+import json, logging, math, multiprocessing, os, signal, time
+
+from app.circuit_breaker import CLOSED
+from app.get_stream_url import set_max_browsers
+from app.station import StationConfig, StationRecorder, engine_options
+
+log = logging.getLogger('RadioRec')
+
+STATUS_INTERVAL_SEC = 5
+
+def shard_stations(configs : List[StationConfig],
+        workers : int) -> List[List[StationConfig]]:
+    """
+    Splits the stations into at most workers shards, as evenly as possible.
+    """
+    if workers < 1:
+        raise ValueError('Need at least one worker')
+
+    shards = [[] for i in range(0, min(workers, len(configs)))]
+    for i, config in enumerate(configs):
+        shards[i % len(shards)].append(config)
+    return shards
+
+def run_worker(worker_id : int, configs : List[StationConfig],
+        prrs_options : Dict[str, Any], engine : str, max_browsers : int,
+        status_queue : multiprocessing.Queue,
+        log_queue : multiprocessing.Queue, log_level : int,
+        stop_event : multiprocessing.Event) -> None:
+    """
+    Records a shard of stations in a worker process, reporting their status
+    on status_queue every STATUS_INTERVAL_SEC seconds until they're all done
+    or stop_event is set.
+    """
+    # The supervisor decides when to stop, not Ctrl+C
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    # Hand log records to the supervisor, so they all end up in one place
+    for handler in list(log.handlers):
+        log.removeHandler(handler)
+    log.addHandler(QueueHandler(log_queue))
+    log.setLevel(log_level)
+
+    set_max_browsers(max_browsers)
+
+    options = {**prrs_options, **engine_options(engine)}
+    recorders = [StationRecorder(config, options) for config in configs]
+    for recorder in recorders:
+        recorder.start()
+
+    def reportStatus() -> None:
+        status_queue.put({
+            'worker': worker_id,
+            'pid': os.getpid(),
+            'time': time.time(),
+            'stations': {recorder.config.station_id: recorder.status()
+                            for recorder in recorders}
+        })
+
+    while any(recorder.is_alive() for recorder in recorders) and \
+            not stop_event.is_set():
+        reportStatus()
+        stop_event.wait(STATUS_INTERVAL_SEC)
+
+    for recorder in recorders:
+        recorder.stop()
+    for recorder in recorders:
+        recorder.join()
+    reportStatus()
+
+class _Worker:
+    worker_id : int = 0
+    configs : List[StationConfig] = None
+    process : multiprocessing.Process = None
+    restarts : int = 0
+    restart_at : float = None
+    finished : bool = False
+
+    def __init__(self, worker_id : int, configs : List[StationConfig]) -> None:
+        self.worker_id = worker_id
+        self.configs = configs
+
+class StationSupervisor:
+    """
+    Records stations across several worker processes, so recording isn't
+    held to one core. Stations are split evenly between the workers. A
+    worker that dies before its stations are done is restarted, waiting a
+    little longer each time it has to be.
+
+    Workers report how their stations are doing, which status() combines
+    and which is also written to status_filepath, if given.
+    """
+    _workers : List[_Worker] = None
+    _prrs_options : Dict[str, Any] = None
+    _engine : str = None
+    _max_browsers : int = 0
+    _status_filepath : str = None
+    _restart_delay_sec : float = 1
+    _max_restart_delay_sec : float = 60
+    _worker_target : Callable = None
+    _context : multiprocessing.context.BaseContext = None
+    _status_queue : multiprocessing.Queue = None
+    _log_queue : multiprocessing.Queue = None
+    _log_listener : QueueListener = None
+    _stop_event : multiprocessing.Event = None
+    _station_status : Dict[str, Dict[str, Any]] = None
+    _worker_status : Dict[int, Dict[str, Any]] = None
+
+    def __init__(self, configs : List[StationConfig], workers : int = None,
+            prrs_options : Dict[str, Any] = None, engine : str = 'selectors',
+            max_browsers : int = 4, status_filepath : str = None,
+            restart_delay_sec : float = 1,
+            max_restart_delay_sec : float = 60,
+            worker_target : Callable = run_worker) -> None:
+        if workers is None:
+            workers = os.cpu_count() or 1
+
+        shards = shard_stations(configs, workers)
+        self._workers = [_Worker(i, shard) for i, shard in enumerate(shards)]
+
+        self._prrs_options = prrs_options or {}
+        self._engine = engine
+        # Share the browser limit out between the workers
+        self._max_browsers = math.ceil(max_browsers / len(shards)) \
+                                if max_browsers else 0
+        self._status_filepath = status_filepath
+        self._restart_delay_sec = restart_delay_sec
+        self._max_restart_delay_sec = max_restart_delay_sec
+        self._worker_target = worker_target
+
+        # Forking a process that already has threads running isn't safe
+        self._context = multiprocessing.get_context('spawn')
+        self._status_queue = self._context.Queue()
+        self._log_queue = self._context.Queue()
+        self._stop_event = self._context.Event()
+        self._station_status = {}
+        self._worker_status = {}
+
+    @property
+    def worker_count(self) -> int:
+        return len(self._workers)
+
+    def _startWorker(self, worker : _Worker) -> None:
+        worker.process = self._context.Process(target=self._worker_target,
+            args=(worker.worker_id, worker.configs, self._prrs_options,
+                self._engine, self._max_browsers, self._status_queue,
+                self._log_queue, log.getEffectiveLevel(), self._stop_event),
+            name=f"Worker-{worker.worker_id}", daemon=True)
+        worker.process.start()
+        worker.restart_at = None
+
+        log.info(f"Started worker {worker.worker_id} (pid " +
+            f"{worker.process.pid}) for " +
+            ', '.join(config.station_id for config in worker.configs))
+
+    def start(self) -> None:
+        self._log_listener = QueueListener(self._log_queue, *log.handlers,
+                                respect_handler_level=True)
+        self._log_listener.start()
+
+        for worker in self._workers:
+            self._startWorker(worker)
+
+    def _checkWorkers(self) -> None:
+        now = time.monotonic()
+
+        for worker in self._workers:
+            if worker.finished:
+                continue
+
+            if worker.restart_at is not None:
+                if now >= worker.restart_at:
+                    self._startWorker(worker)
+                continue
+
+            if worker.process.is_alive():
+                continue
+
+            exitCode = worker.process.exitcode
+            if exitCode == 0 or self._stop_event.is_set():
+                worker.finished = True
+                log.info(f"Worker {worker.worker_id} finished")
+                continue
+
+            delay = min(self._restart_delay_sec * 2 ** worker.restarts,
+                        self._max_restart_delay_sec)
+            worker.restarts += 1
+            worker.restart_at = now + delay
+            log.warning(f"Worker {worker.worker_id} crashed with exit code " +
+                f"{exitCode}. Restarting it in {delay:g} seconds.")
+
+    def _readStatus(self) -> bool:
+        updated = False
+        while True:
+            try:
+                report = self._status_queue.get_nowait()
+            except Empty:
+                return updated
+
+            self._worker_status[report['worker']] = report
+            self._station_status.update(report['stations'])
+            updated = True
+
+    def status(self) -> Dict[str, Any]:
+        """
+        Returns how every worker and station is doing, as of their latest
+        reports, along with totals across all of them.
+        """
+        stations = dict(self._station_status)
+        workers = []
+        for worker in self._workers:
+            report = self._worker_status.get(worker.worker_id, {})
+            workers.append({
+                'worker': worker.worker_id,
+                'pid': None if worker.process is None else worker.process.pid,
+                'alive': worker.process is not None and
+                            worker.process.is_alive(),
+                'finished': worker.finished,
+                'restarts': worker.restarts,
+                'last_report': report.get('time'),
+                'stations': [config.station_id for config in worker.configs]
+            })
+
+        return {
+            'workers': workers,
+            'stations': stations,
+            'totals': {
+                'stations': sum(len(worker.configs)
+                                for worker in self._workers),
+                'stations_recording': sum(1 for station in stations.values()
+                                        if station['alive'] and
+                                            station['recording']),
+                'stations_failed': sum(1 for station in stations.values()
+                                        if station['error'] is not None),
+                'worker_restarts': sum(worker.restarts
+                                        for worker in self._workers),
+                'recorded_bytes': sum(station['recorded_bytes']
+                                    for station in stations.values()),
+                'byte_rate': sum(station['byte_rate'] or 0
+                                for station in stations.values()),
+                'failovers': sum(station['failovers']
+                                for station in stations.values()),
+                'stalls': sum(station['stalls']
+                                for station in stations.values()),
+                'bytes_lost': sum(station['bytes_lost']
+                                for station in stations.values()),
+                'circuits_open': sum(1 for station in stations.values()
+                                    if station['circuit_breaker'] and
+                                        station['circuit_breaker']['state']
+                                            != CLOSED)
+            }
+        }
+
+    def _writeStatus(self) -> None:
+        if self._status_filepath is None:
+            return
+
+        # Replace the file in one go, so readers never see half of it
+        tmpPath = self._status_filepath + '.tmp'
+        try:
+            with open(tmpPath, 'w') as f:
+                json.dump(self.status(), f, indent=4)
+            os.replace(tmpPath, self._status_filepath)
+        except OSError:
+            log.exception("Failed to write the status file at " +
+                f"{self._status_filepath}")
+
+    def is_finished(self) -> bool:
+        return all(worker.finished for worker in self._workers)
+
+    def run(self, poll_interval_sec : float = 1) -> None:
+        """
+        Looks after the workers until all of them have finished, or until
+        stop() is called.
+        """
+        lastStatusWrite = 0
+        while not self.is_finished():
+            self._checkWorkers()
+            if self._readStatus() or \
+                    time.monotonic() - lastStatusWrite > STATUS_INTERVAL_SEC:
+                self._writeStatus()
+                lastStatusWrite = time.monotonic()
+            time.sleep(poll_interval_sec)
+
+        self._readStatus()
+        self._writeStatus()
+
+        if self._log_listener is not None:
+            self._log_listener.stop()
+            self._log_listener = None
+
+    def stop(self, timeout : float = 30) -> None:
+        """
+        Asks every worker to finish up, and waits up to timeout seconds for
+        them to before killing them.
+        """
+        self._stop_event.set()
+
+        deadline = time.monotonic() + timeout
+        for worker in self._workers:
+            worker.restart_at = None
+            if worker.process is None:
+                continue
+
+            worker.process.join(max(deadline - time.monotonic(), 0))
+            if worker.process.is_alive():
+                log.warning(f"Worker {worker.worker_id} didn't stop in " +
+                    "time. Killing it.")
+                worker.process.kill()
+                worker.process.join()
+            worker.finished = True
@@ -0,0 +1,117 @@
+from array import array
+from bisect import bisect_left, bisect_right
+from threading import RLock
+from typing import List, Tuple
+
+class TimeIndex:
+    """
+    A compact index of (arrival timestamp, absolute offset) samples for a
+    stream of bytes. Each sample says that the bytes from its offset up to the
+    next sample's offset arrived at its timestamp.
+    """
+    _timestamps : array = None
+    _offsets : array = None
+    _start : int = 0
+    _lock : RLock = None
+
+    def __init__(self) -> None:
+        self._timestamps = array('d')
+        self._offsets = array('q')
+        self._start = 0
+        self._lock = RLock()
+
+    def __len__(self) -> int:
+        return len(self._offsets) - self._start
+
+    def add(self, timestamp : float, offset : int) -> None:
+        with self._lock:
+            if len(self) > 0:
+                if offset < self._offsets[-1]:
+                    raise ValueError('Offsets must not go backwards')
+
+                # Keep timestamps sorted even if the clock steps backwards
+                if timestamp <= self._timestamps[-1]:
+                    return
+
+            self._timestamps.append(timestamp)
+            self._offsets.append(offset)
+
+    def evict(self, offset : int) -> None:
+        """
+        Drops the samples that only cover bytes before the given offset.
+        """
+        with self._lock:
+            # Keep the last sample at or before the offset, since it still
+            # covers the byte at the offset itself
+            i = bisect_right(self._offsets, offset, lo=self._start) - 1
+            if i > self._start:
+                self._start = i
+
+            # Compact once the dead space outweighs the live samples
+            if self._start > 64 and self._start > len(self):
+                del self._timestamps[:self._start]
+                del self._offsets[:self._start]
+                self._start = 0
+
+    def offsetAt(self, timestamp : float) -> int:
+        """
+        Returns the offset of the first byte that arrived at or after the given
+        timestamp, or None if no indexed byte did.
+        """
+        with self._lock:
+            i = bisect_left(self._timestamps, timestamp, lo=self._start)
+            if i == len(self._timestamps):
+                return None
+            return self._offsets[i]
+
+    def timestampAt(self, offset : int) -> float:
+        """
+        Returns the arrival timestamp of the byte at the given offset, or None
+        if it was never indexed or has been evicted.
+        """
+        with self._lock:
+            i = bisect_right(self._offsets, offset, lo=self._start) - 1
+            if i < self._start:
+                return None
+            return self._timestamps[i]
+
+    def samplesBetween(self, start : int, end : int) -> List[Tuple[int, float]]:
+        """
+        Returns the (offset, timestamp) samples covering the bytes from start
+        up to end, with the first one moved up to start itself. Its timestamp
+        is None if those bytes were never indexed or have been evicted.
+        """
+        with self._lock:
+            i = bisect_right(self._offsets, start, lo=self._start) - 1
+            samples = [(start, self._timestamps[i] if i >= self._start 
+                                    else None)]
+
+            for j in range(i + 1, len(self._offsets)):
+                if self._offsets[j] >= end:
+                    break
+                samples.append((self._offsets[j], self._timestamps[j]))
+            return samples
+
+    def lastTimestamp(self) -> float:
+        """
+        Returns the timestamp of the newest sample, or None if there isn't one.
+        """
+        with self._lock:
+            if len(self) == 0:
+                return None
+            return self._timestamps[-1]
+
+    def byteRate(self) -> float:
+        """
+        Returns the average number of bytes that arrived per second across the
+        indexed samples, or None if there isn't enough to go on yet.
+        """
+        with self._lock:
+            if len(self) < 2:
+                return None
+
+            elapsed = self._timestamps[-1] - self._timestamps[self._start]
+            if elapsed <= 0:
+                return None
+
+            return (self._offsets[-1] - self._offsets[self._start]) / elapsed
@@ -0,0 +1,150 @@
+import os, tempfile
+from threading import Condition, Thread
+from typing import Callable, Dict
+import time
+
+from app.byte_buffer import ByteBuffer, PersistentByteBuffer
+from timing import best_time
+
+BUFFER_LEN = 307200
+SYNC_LEN = 10000
+
+def bench_append(quick : bool = False) -> Dict[str, float]:
+    results = {}
+    total = 4 * BUFFER_LEN if quick else 32 * BUFFER_LEN
+
+    for chunk_len in (512, 8192, 65536):
+        bb = ByteBuffer(BUFFER_LEN)
+        chunk = os.urandom(chunk_len)
+        count = total // chunk_len
+
+        sec = best_time(lambda: bb.append(chunk), number=count)
+        results[f"append_{chunk_len}_mb_per_sec"] = \
+            count * chunk_len / sec / 1e6
+
+    return results
+
+def bench_write_view(quick : bool = False) -> Dict[str, float]:
+    bb = ByteBuffer(BUFFER_LEN)
+    chunk = os.urandom(8192)
+    count = (4 if quick else 32) * BUFFER_LEN // len(chunk)
+
+    def write() -> None:
+        view = bb.writeView(len(chunk))
+        view[:] = chunk[:len(view)]
+        bb.publish(len(view))
+
+    sec = best_time(write, number=count)
+    return {'write_view_8192_mb_per_sec': count * len(chunk) / sec / 1e6}
+
+def bench_read(quick : bool = False) -> Dict[str, float]:
+    results = {}
+    number = 20 if quick else 200
+
+    for wrapped in (False, True):
+        bb = ByteBuffer(BUFFER_LEN)
+        if wrapped:
+            bb.append(os.urandom(BUFFER_LEN // 2))
+        bb.append(os.urandom(BUFFER_LEN))
+        name = 'wrapped' if wrapped else 'contiguous'
+
+        results[f"read_{name}_sec"] = best_time(
+            lambda: bb.read(consume=False), number=number) / number
+        results[f"read_from_end_{name}_sec"] = best_time(
+            lambda: bb.readFromEnd(SYNC_LEN, consume=False), 
+            number=number) / number
+        results[f"read_views_{name}_sec"] = best_time(
+            lambda: bb.readViews(), number=number) / number
+
+    return results
+
+def bench_find_sequence(quick : bool = False) -> Dict[str, float]:
+    results = {}
+    number = 10 if quick else 100
+
+    for wrapped in (False, True):
+        bb = ByteBuffer(BUFFER_LEN)
+        if wrapped:
+            bb.append(os.urandom(BUFFER_LEN // 2))
+        bb.append(os.urandom(BUFFER_LEN))
+        name = 'wrapped' if wrapped else 'contiguous'
+
+        seq = bytes(bb.readFromEnd(SYNC_LEN, consume=False))
+        results[f"find_sequence_{name}_sec"] = best_time(
+            lambda: bb._findSequence(seq), number=number) / number
+
+    return results
+
+def bench_persistent_append(quick : bool = False) -> Dict[str, float]:
+    results = {}
+    total = (4 if quick else 32) * BUFFER_LEN
+    chunk = os.urandom(8192)
+    count = total // len(chunk)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        filepath = os.path.join(tmp, 'bench.aac')
+        pbb = PersistentByteBuffer(filepath, overwrite=True)
+
+        start = time.perf_counter()
+        for i in range(0, count):
+            pbb.append(chunk)
+        pbb.writeAll()
+        sec = time.perf_counter() - start
+
+        results['persistent_append_8192_mb_per_sec'] = \
+            count * len(chunk) / sec / 1e6
+
+    return results
+
+def bench_contention(quick : bool = False) -> Dict[str, float]:
+    # One thread appends while another drains, the way a RadioStream and a
+    # RedundantRadioStream share a buffer. The producer waits for room
+    # rather than overwriting what hasn't been read, like a stream that
+    # can't outrun its reader, so the reader has to keep up.
+    total = (16 if quick else 128) * BUFFER_LEN
+    chunk = os.urandom(8192)
+    bb = ByteBuffer(BUFFER_LEN)
+    room = Condition()
+    consumed = [0]
+
+    def produce() -> None:
+        for i in range(0, total // len(chunk)):
+            with room:
+                room.wait_for(
+                    lambda: bb.readable_length + len(chunk) <= bb.length)
+            bb.append(chunk)
+
+    def consume() -> None:
+        while producer.is_alive() or bb.readable_length > 0:
+            if bb.waitForReadable(1, timeout=0.01):
+                with bb.byte_array_lock:
+                    for view in bb.readViews():
+                        consumed[0] += len(view)
+                        bb.commit(len(view))
+                with room:
+                    room.notify()
+
+    producer = Thread(target=produce)
+    consumer = Thread(target=consume)
+
+    start = time.perf_counter()
+    producer.start()
+    consumer.start()
+    producer.join()
+    consumer.join()
+    sec = time.perf_counter() - start
+
+    # Throughput counts what made it through to the reader
+    return {
+        'contention_mb_per_sec': consumed[0] / sec / 1e6,
+        'contention_consumed_ratio': consumed[0] / total
+    }
+
+BENCHMARKS : Dict[str, Callable[[bool], Dict[str, float]]] = {
+    'append': bench_append,
+    'write_view': bench_write_view,
+    'read': bench_read,
+    'find_sequence': bench_find_sequence,
+    'persistent_append': bench_persistent_append,
+    'contention': bench_contention,
+}
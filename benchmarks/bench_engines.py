@@ -0,0 +1,124 @@
+import argparse, json, multiprocessing, os, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict
+from unittest import mock
+
+# Radio servers send a burst up front, then keep pace with the audio
+BURST_LEN = 131072
+CHUNK_INTERVAL_SEC = 0.25
+
+ENGINES = ('thread', 'selectors', 'asyncio')
+
+def _serve(port_queue : multiprocessing.Queue, byte_rate : int) -> None:
+    chunk = os.urandom(int(byte_rate * CHUNK_INTERVAL_SEC))
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            self.send_response(200)
+            self.send_header('Content-Type', 'audio/aac')
+            self.end_headers()
+            try:
+                self.wfile.write(os.urandom(BURST_LEN))
+                while True:
+                    self.wfile.write(chunk)
+                    time.sleep(CHUNK_INTERVAL_SEC)
+            except OSError:
+                pass
+
+        def log_message(self, format : str, *args) -> None:
+            pass
+
+    ThreadingHTTPServer.daemon_threads = True
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    port_queue.put(server.server_port)
+    server.serve_forever()
+
+def _measure(result_queue : multiprocessing.Queue, engine_name : str,
+        url : str, stations : int, redundancy : int,
+        duration_sec : float) -> None:
+    from app.async_stream import AsyncEngine
+    from app.radio_stream import RedundantRadioStream
+    from app.stream_reactor import StreamReactor
+
+    engine = AsyncEngine() if engine_name == 'asyncio' else None
+    reactor = StreamReactor() if engine_name == 'selectors' else None
+
+    with mock.patch('app.radio_stream.get_stream_url', return_value=url), \
+            mock.patch('app.async_stream.get_stream_url', return_value=url):
+        streams = [RedundantRadioStream(f"station-{i}", redundancy=redundancy,
+                        redundant_max_age_sec=7200, engine=engine,
+                        reactor=reactor) 
+                    for i in range(stations)]
+        for rrs in streams:
+            rrs.start()
+
+        # Let every station get through its preroll before measuring
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline and \
+                any(rrs.byte_buffer.readable_length == 0 for rrs in streams):
+            time.sleep(0.1)
+
+        startBytes = sum(rrs.byte_buffer.write_offset for rrs in streams)
+        startCpu = time.process_time()
+        startWall = time.perf_counter()
+        time.sleep(duration_sec)
+        cpuSec = time.process_time() - startCpu
+        wallSec = time.perf_counter() - startWall
+        endBytes = sum(rrs.byte_buffer.write_offset for rrs in streams)
+
+    result_queue.put({
+        'threads': threading.active_count(),
+        'cpu_percent_per_station': cpuSec / wallSec / stations * 100,
+        'cpu_percent_total': cpuSec / wallSec * 100,
+        'recorded_kb_per_sec': (endBytes - startBytes) / wallSec / 1e3,
+    })
+
+def bench_engine(engine_name : str, url : str, stations : int,
+        redundancy : int, duration_sec : float) -> Dict[str, float]:
+    # Each engine gets a fresh process, so nothing left running by one
+    # counts against the other
+    queue = multiprocessing.Queue()
+    p = multiprocessing.Process(target=_measure, args=(queue, engine_name,
+            url, stations, redundancy, duration_sec))
+    p.start()
+    result = queue.get()
+    p.kill()
+    p.join()
+    return result
+
+def _parseArgs() -> argparse.Namespace:
+    ap = argparse.ArgumentParser(
+        description="Compares the CPU used per station by the stream " +
+            "engines, against a local stream server")
+
+    ap.add_argument('--stations', type=int, default=40)
+    ap.add_argument('--redundancy', type=int, default=2)
+    ap.add_argument('--duration', type=float, default=10,
+        help="Seconds to measure each engine for")
+    ap.add_argument('--bitrate', type=int, default=128,
+        help="Stream bitrate, in kbps")
+    ap.add_argument('--engine', action='append', default=None,
+        choices=ENGINES,
+        help="Only measure this engine. May be given more than once.")
+
+    return ap.parse_args()
+
+def main() -> None:
+    args = _parseArgs()
+
+    portQueue = multiprocessing.Queue()
+    server = multiprocessing.Process(target=_serve,
+                args=(portQueue, args.bitrate * 1000 // 8), daemon=True)
+    server.start()
+    url = f"http://127.0.0.1:{portQueue.get()}/stream"
+
+    results = {}
+    for engine in args.engine or ENGINES:
+        results[engine] = bench_engine(engine, url, args.stations,
+                            args.redundancy, args.duration)
+
+    server.kill()
+    print(json.dumps(results, indent=4))
+
+if __name__ == '__main__':
+    main()
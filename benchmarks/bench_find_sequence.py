@@ -0,0 +1,102 @@
+import argparse, os
+from typing import Dict
+
+from app.byte_buffer import ByteBuffer
+from timing import best_time
+
+def legacy_find_sequence(bb : ByteBuffer, seq : bytes,
+        match_len_step : int = 1000) -> int:
+    # The candidate-by-candidate search ByteBuffer._findSequence used to do,
+    # kept here so the two can be compared
+    seq_len = len(seq)
+    seq = bytearray(seq)
+
+    with bb._byte_array_lock:
+        firstReadi, lastReadi = bb._getReadBounds()
+
+        if firstReadi < lastReadi:
+            possibleIndexes = range(firstReadi, lastReadi + 1)
+        else:
+            possibleIndexes = list(range(firstReadi, bb.length))
+            possibleIndexes += list(range(0, lastReadi + 1))
+
+        for i in possibleIndexes:
+            isMatch = True
+            bestMatchLen = 0
+            while isMatch and bestMatchLen < seq_len:
+                matchLen = bestMatchLen + match_len_step
+                if matchLen > seq_len:
+                    matchLen = seq_len
+
+                if not bb._isWithinReadBounds(i, matchLen):
+                    isMatch = False
+                    break
+
+                readBytes = bb._read(i, matchLen, consume=False)
+                isMatch = seq[:matchLen] == readBytes
+
+                bestMatchLen = matchLen
+
+                if not isMatch:
+                    break
+
+            if isMatch:
+                return i
+
+        raise ValueError('Failed to find given byte sequence')
+
+def _make_buffer(buffer_len : int, wrapped : bool) -> ByteBuffer:
+    bb = ByteBuffer(buffer_len)
+    if wrapped:
+        bb.append(os.urandom(buffer_len // 2))
+    bb.append(os.urandom(buffer_len))
+    return bb
+
+def run(buffer_len : int = 307200, sync_len : int = 10000,
+        repeat : int = 3, legacy : bool = True) -> Dict[str, Dict[str, float]]:
+    results = {}
+
+    for wrapped in (False, True):
+        bb = _make_buffer(buffer_len, wrapped)
+
+        # Put the sequence three quarters of the way into the readable data,
+        # which is about where a freshly-promoted standby stream has it
+        seq = bytes(bb.read(consume=False)[buffer_len * 3 // 4:][:sync_len])
+
+        expected = bb._findSequence(seq)
+        name = 'wrapped' if wrapped else 'contiguous'
+        results[name] = {
+            'find_sequence_sec': best_time(lambda: bb._findSequence(seq), repeat)
+        }
+
+        if legacy:
+            if legacy_find_sequence(bb, seq) != expected:
+                raise RuntimeError('Legacy and current searches disagree')
+            results[name]['legacy_find_sequence_sec'] = \
+                best_time(lambda: legacy_find_sequence(bb, seq), 1)
+
+    return results
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--buffer-len', type=int, default=307200)
+    ap.add_argument('--sync-len', type=int, default=10000)
+    ap.add_argument('--repeat', type=int, default=3)
+    ap.add_argument('--no-legacy', action='store_true',
+        help="Skip the (slow) legacy implementation")
+    args = ap.parse_args()
+
+    results = run(buffer_len=args.buffer_len, sync_len=args.sync_len,
+                repeat=args.repeat, legacy=not args.no_legacy)
+
+    for name, timings in results.items():
+        for timing, sec in timings.items():
+            print(f"{name:>10} {timing:<26} {sec * 1000:10.3f} ms")
+
+        if 'legacy_find_sequence_sec' in timings:
+            speedup = timings['legacy_find_sequence_sec'] / \
+                        timings['find_sequence_sec']
+            print(f"{name:>10} {'speedup':<26} {speedup:10.1f}x")
+
+if __name__ == '__main__':
+    main()
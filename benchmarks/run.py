@@ -0,0 +1,54 @@
+import argparse, json, platform, subprocess, sys
+from datetime import datetime
+
+import bench_byte_buffer
+
+def _gitRevision() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], 
+                capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+def _parseArgs() -> argparse.Namespace:
+    ap = argparse.ArgumentParser(
+        description="Runs the ByteBuffer benchmarks and prints the results as JSON")
+
+    ap.add_argument('-o', '--output', default=None,
+        help="Write the results to this file instead of stdout")
+    ap.add_argument('-b', '--benchmark', action='append', default=None,
+        choices=sorted(bench_byte_buffer.BENCHMARKS),
+        help="Only run this benchmark. May be given more than once.")
+    ap.add_argument('--quick', action='store_true',
+        help="Use fewer iterations, for a quick sanity check")
+
+    return ap.parse_args()
+
+def main() -> None:
+    args = _parseArgs()
+
+    names = args.benchmark or list(bench_byte_buffer.BENCHMARKS)
+
+    results = {}
+    for name in names:
+        print(f"Running {name}...", file=sys.stderr)
+        results[name] = bench_byte_buffer.BENCHMARKS[name](args.quick)
+
+    report = {
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'git_revision': _gitRevision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'quick': args.quick,
+        'results': results,
+    }
+
+    output = json.dumps(report, indent=4)
+    if args.output is None:
+        print(output)
+    else:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+
+if __name__ == '__main__':
+    main()
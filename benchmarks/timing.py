@@ -0,0 +1,18 @@
+import time
+from typing import Callable
+
+def best_time(fn : Callable[[], object], repeat : int = 3, 
+        number : int = 1) -> float:
+    """
+    Returns the fastest time, in seconds, that it took to call fn number times
+    in a row, out of repeat tries.
+    """
+    best = None
+    for i in range(0, repeat):
+        start = time.perf_counter()
+        for j in range(0, number):
+            fn()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
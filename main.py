@@ -1,15 +1,16 @@
 import argparse, logging, os, sys
 from datetime import datetime, time, timedelta
-from threading import Event
+from typing import Any, Dict, List
 
+from app.get_stream_url import set_max_browsers
 from app.radio_stream import PersistentRedundantRadioStream
 from app.byte_buffer import ByteBuffer, PersistentByteBuffer
-
-DATETIME_PARSE_FORMAT : str = r'%Y-%m-%d %H:%M:%S'
-DATETIME_FILE_FORMAT : str = r'%Y-%m-%d_%H%M'
-DATETIME_CONSOLE_FORMAT : str = r'%A, %B %d at %I:%M:%S %p'
-
-ONE_HOUR : timedelta = timedelta(hours=1)
+from app.file_writer import FSYNC_NONE, FSYNC_POLICIES
+from app.station import DATETIME_CONSOLE_FORMAT, DATETIME_FILE_FORMAT, \
+    DATETIME_PARSE_FORMAT, ENGINES, ONE_HOUR, StationConfig, \
+    StationRecorder, engine_options, load_station_configs, record_hour, \
+    record_schedule, record_until, wait_until
+from app.supervisor import StationSupervisor
 
 log = logging.getLogger('RadioRec')
 
@@ -59,8 +60,12 @@ def _prepLogger(filepath : str = None) -> logging.Logger:
 def _parseArgs() -> argparse.Namespace:
     ap = argparse.ArgumentParser()
 
-    ap.add_argument('-u', '--url', required=True,
+    ap.add_argument('-u', '--url', default=None,
         help="Stream URL to record")
+    ap.add_argument('-c', '--config', default=None,
+        help="Record every station in this JSON config file instead of " +
+            "just --url. Each station is recorded to a directory named " +
+            "after it in --output-dir, unless it sets its own output_dir.")
     ap.add_argument('-o', '--output-dir', default='./output',
         help="Directory where recorded files should be placed")
     
@@ -81,49 +86,142 @@ def _parseArgs() -> argparse.Namespace:
             "overwriting existing audio files in the output directory")
     ap.add_argument('--refresh-streams-after', type=int, default=7200,
         help="How often the redundant radio streams should be refreshed, " +
-            "in seconds.")
-    
-    return ap.parse_args()
-
-
-def wait_until(date : datetime) -> None:
-    e = Event()
+            "in seconds. The streams are refreshed one at a time, spread " +
+            "out over this period. 0 never refreshes them.")
+    ap.add_argument('--min-bitrate', type=float, default=0,
+        help="Drop any radio stream that gets less than this many kbps " +
+            "for --stall-grace seconds, failing over if it's the primary. " +
+            "0 only drops streams that get nothing at all.")
+    ap.add_argument('--stall-grace', type=float, default=10,
+        help="How many seconds a radio stream may go below --min-bitrate " +
+            "before it's dropped. 0 turns the check off.")
+    ap.add_argument('--file-buffer-size', type=int, default=65536,
+        help="How many bytes to buffer in memory before writing them to " +
+            "the output file. Bigger writes skip the buffer. 0 writes every " +
+            "chunk straight through.")
+    ap.add_argument('--fsync', choices=FSYNC_POLICIES, default=FSYNC_NONE,
+        help="When to force recorded data onto the disk: never, whenever " +
+            "an output file is closed, or every --fsync-interval seconds")
+    ap.add_argument('--fsync-interval', type=float, default=10,
+        help="Seconds between fsyncs when --fsync is \"interval\"")
+    ap.add_argument('--preallocate', action='store_true',
+        help="Reserve disk space for each hourly file up front, based on " +
+            "the stream's bitrate, to keep recordings from fragmenting")
+    ap.add_argument('--write-behind-max-bytes', type=int, default=16777216,
+        help="How many recorded bytes may wait in memory for a slow disk " +
+            "before recording has to wait for it. 0 writes to disk inline.")
+    ap.add_argument('--engine', choices=ENGINES, 
+        default=None,
+        help="Read each radio stream on a thread of its own, read them all " +
+            "from one selectors-based thread, or run them all on one " +
+            "asyncio event loop. Defaults to thread, or to selectors " + 
+            "with --config.")
+    ap.add_argument('--max-browsers', type=int, default=4,
+        help="How many browsers may be open at once to look up stream " +
+            "URLs. 0 for no limit.")
+    ap.add_argument('--hls-dir', default=None,
+        help="Also write the stream out as HLS segments and a playlist in " +
+            "this directory, so it can be listened to live")
+    ap.add_argument('--hls-segment-duration', type=float, default=6,
+        help="Length of each HLS segment, in seconds")
+    ap.add_argument('--hls-playlist-length', type=int, default=6,
+        help="How many segments the HLS playlist lists at a time")
+    ap.add_argument('--workers', type=int, default=None,
+        help="With --config, how many processes to spread the stations " +
+            "across. Defaults to the number of CPUs. 0 records every " +
+            "station in this process.")
+    ap.add_argument('--status-file', default=None,
+        help="With --config and worker processes, keep the status of " +
+            "every station written to this JSON file")
+
+    args = ap.parse_args()
+
+    if (args.url is None) == (args.config is None):
+        ap.error("Exactly one of --url and --config must be given")
+
+    if args.workers is not None and args.workers < 0:
+        ap.error("--workers can't be negative")
+
+    if args.min_bitrate < 0:
+        ap.error("--min-bitrate can't be negative")
+
+    if args.engine is None:
+        args.engine = 'selectors' if args.config else 'thread'
+
+    return args
+
+def _prrsOptions(args : argparse.Namespace) -> Dict[str, Any]:
+    # PersistentRedundantRadioStream settings that come from the command line
+    return {
+        'overwrite': args.overwrite,
+        'file_buffer_size': args.file_buffer_size,
+        'fsync_policy': args.fsync,
+        'fsync_interval_sec': args.fsync_interval,
+        'write_behind_high_water_mark': args.write_behind_max_bytes,
+        'preallocate_sec': ONE_HOUR.total_seconds() if args.preallocate else 0,
+        'min_bitrate_kbps': args.min_bitrate,
+        'stall_grace_sec': args.stall_grace
+    }
+
+def record_stations(args : argparse.Namespace) -> None:
+    try:
+        configs = load_station_configs(args.config, output_dir=args.output_dir)
+    except (OSError, ValueError) as e:
+        log.error(f"Failed to load the station config: {e}")
+        exit(1)
 
-    now = datetime.now()
-    if date < now:
+    if args.workers != 0:
+        supervise_stations(args, configs)
         return
-    
-    longTimedelta = timedelta(seconds=15)
-    # Check the current date less often when we're
-    # very far out from the target date
-    while date - datetime.now() > longTimedelta:
-        e.wait(10)
-    
-    shortTimedelta = timedelta(seconds=1)
-    while date - datetime.now() > shortTimedelta:
-        e.wait(0.1)
-    
-    while date > datetime.now():
-        e.wait(0.01)
 
-def record_until(prrs : PersistentRedundantRadioStream,
-        output_dir : str, endDate : datetime) -> str:
-    now = datetime.now()
-    fileName = f"{now.strftime(DATETIME_FILE_FORMAT)}.aac"
-    filePath = os.path.join(output_dir, fileName)
+    prrsOptions = {**_prrsOptions(args), **engine_options(args.engine)}
+    recorders = [StationRecorder(config, prrsOptions) for config in configs]
 
-    prrs.filepath = filePath
-    prrs.should_write = True
+    log.info(f"Recording {len(recorders)} stations")
+    for recorder in recorders:
+        recorder.start()
 
-    log.debug(f"Will record until {endDate.strftime(DATETIME_CONSOLE_FORMAT)}")
-    wait_until(endDate)
+    try:
+        while any(recorder.is_alive() for recorder in recorders):
+            for recorder in recorders:
+                recorder.join(timeout=1)
+    except KeyboardInterrupt:
+        log.info("Stopping...")
+        for recorder in recorders:
+            recorder.stop()
+        for recorder in recorders:
+            recorder.join()
+
+    failed = [recorder.config.station_id for recorder in recorders 
+                if recorder.error is not None]
+    if failed:
+        log.warning(f"These stations failed: {', '.join(failed)}")
+    log.info("All stations finished")
+
+def supervise_stations(args : argparse.Namespace,
+        configs : List[StationConfig]) -> None:
+    supervisor = StationSupervisor(configs, workers=args.workers,
+                    prrs_options=_prrsOptions(args), engine=args.engine,
+                    max_browsers=args.max_browsers,
+                    status_filepath=args.status_file)
+
+    log.info(f"Recording {len(configs)} stations across " +
+        f"{supervisor.worker_count} worker processes")
+    supervisor.start()
 
-def record_hour(prrs : PersistentRedundantRadioStream, 
-        output_dir : str) -> str:
-    endDate = datetime.now() + timedelta(hours=1)
-    endDate = endDate.replace(minute=0, second=0, microsecond=0)
+    try:
+        supervisor.run()
+    except KeyboardInterrupt:
+        log.info("Stopping...")
+        supervisor.stop()
+        supervisor.run()
 
-    record_until(prrs, output_dir, endDate)
+    failed = [stationID for stationID, status
+                in supervisor.status()['stations'].items()
+                if status['error'] is not None]
+    if failed:
+        log.warning(f"These stations failed: {', '.join(failed)}")
+    log.info("All stations finished")
 
 def main() -> None:
     args = _parseArgs()
@@ -136,6 +234,12 @@ def main() -> None:
 
     log.debug(f"Output directory: {args.output_dir}")
 
+    set_max_browsers(args.max_browsers)
+
+    if args.config:
+        record_stations(args)
+        return
+
     if args.start_date:
         try:
             startDate = datetime.strptime(args.start_date, DATETIME_PARSE_FORMAT)
@@ -171,9 +275,9 @@ def main() -> None:
     outputFilePath = os.path.join(args.output_dir, 'output.aac')
     try:
         prrs = PersistentRedundantRadioStream(outputFilePath, args.url,
-                redundancy=args.redundancy, overwrite=args.overwrite,
-                should_write=False, 
-                redundant_max_age_sec=args.refresh_streams_after)
+                redundancy=args.redundancy, should_write=False, 
+                redundant_max_age_sec=args.refresh_streams_after,
+                **_prrsOptions(args), **engine_options(args.engine))
     except FileExistsError:
         pass
 
@@ -189,15 +293,16 @@ def main() -> None:
         wait_until(startDate)
         prrs.byte_buffer.seekToEnd()
 
+    if args.hls_dir:
+        log.info(f"Writing HLS segments to {args.hls_dir}")
+        prrs.addHlsSegmenter(args.hls_dir, 
+            segment_duration_sec=args.hls_segment_duration,
+            playlist_length=args.hls_playlist_length)
+
     try:
         log.info("Recording started")
-        while not args.end_date or endHour - datetime.now() > ONE_HOUR:
-            log.debug("Starting new hour interval")
-            record_hour(prrs, args.output_dir)
-        
-        if args.end_date and datetime.now() < endDate:
-            log.debug("Recording straight until the end date.")
-            record_until(prrs, args.output_dir, endDate)
+        record_schedule(prrs, args.output_dir, 
+            end_date=endDate if args.end_date else None)
     except KeyboardInterrupt:
         log.info("Stopping...")
     except:
@@ -205,6 +310,7 @@ def main() -> None:
     finally:
         prrs.writeAll()
         prrs.should_write = False
+        prrs.stop()
         log.info("Recording finished")
 
 if __name__ == '__main__':
@@ -0,0 +1,111 @@
+from app.adts import AdtsFrameIndex, parse_header
+from app.byte_buffer import ByteBuffer
+import os, unittest
+
+def make_frame(frame_length : int, sfi : int = 4, blocks : int = 1) -> bytes:
+    header = bytes([
+        0xFF,
+        0xF1,
+        (1 << 6) | (sfi << 2),
+        (2 << 6) | (frame_length >> 11),
+        (frame_length >> 3) & 0xFF,
+        ((frame_length & 0x07) << 5) | 0x1F,
+        0xFC | (blocks - 1)
+    ])
+    return header + bytes(frame_length - len(header))
+
+class TestParseHeader(unittest.TestCase):
+    def test_parse_header(self) -> None:
+        header = parse_header(make_frame(371))
+
+        self.assertEqual(header.frame_length, 371)
+        self.assertEqual(header.sample_rate, 44100)
+        self.assertAlmostEqual(header.duration, 1024 / 44100)
+
+    def test_parse_header_multiple_blocks(self) -> None:
+        header = parse_header(make_frame(371, sfi=3, blocks=2))
+
+        self.assertEqual(header.sample_rate, 48000)
+        self.assertAlmostEqual(header.duration, 2048 / 48000)
+
+    def test_parse_header_bad_syncword(self) -> None:
+        self.assertIsNone(parse_header(b'\xff\x01' + make_frame(371)[2:]))
+
+    def test_parse_header_too_short(self) -> None:
+        self.assertIsNone(parse_header(make_frame(371)[:6]))
+
+class TestAdtsFrameIndex(unittest.TestCase):
+    _bb : ByteBuffer = None
+
+    def setUp(self) -> None:
+        self._bb = ByteBuffer(2000, index_frames=True)
+
+    def test_index_frames(self) -> None:
+        self._bb.append(make_frame(300) + make_frame(310) + make_frame(320))
+
+        fi = self._bb.frame_index
+        self.assertIsInstance(fi, AdtsFrameIndex)
+        self.assertTrue(fi.synced)
+        self.assertEqual(len(fi), 3)
+        self.assertEqual(fi.frameOffsetAtOrAfter(1), 300)
+        self.assertEqual(fi.frameOffsetAtOrBefore(609), 300)
+        self.assertEqual(fi.sample_rate, 44100)
+
+    def test_no_index_by_default(self) -> None:
+        self.assertIsNone(ByteBuffer(10).frame_index)
+
+    def test_nearest_frame_offset(self) -> None:
+        self._bb.append(make_frame(300) + make_frame(310) + make_frame(320))
+
+        fi = self._bb.frame_index
+        self.assertEqual(fi.nearestFrameOffset(140), 0)
+        self.assertEqual(fi.nearestFrameOffset(160), 300)
+        self.assertEqual(fi.nearestFrameOffset(5000), 610)
+
+    def test_frame_split_across_appends(self) -> None:
+        data = make_frame(300) + make_frame(310) + make_frame(320)
+
+        for i in range(0, len(data), 5):
+            self._bb.append(data[i:i + 5])
+
+        self.assertEqual(list(self._bb.frame_index._offsets), [0, 300, 610])
+
+    def test_resync_after_garbage(self) -> None:
+        self._bb.append(b'garbage\xff\xf1' + make_frame(300) + make_frame(310))
+
+        self.assertEqual(list(self._bb.frame_index._offsets), [9, 309])
+
+    def test_resync_after_corrupt_frame(self) -> None:
+        self._bb.append(make_frame(300) + make_frame(300) + b'oops' + 
+            make_frame(310) + make_frame(320))
+
+        fi = self._bb.frame_index
+        self.assertEqual(list(fi._offsets), [0, 300, 604, 914])
+        self.assertEqual(fi.lost_sync_count, 1)
+
+    def test_random_data(self) -> None:
+        self._bb.append(os.urandom(1500))
+
+        self.assertEqual(len(self._bb.frame_index), 0)
+
+    def test_eviction(self) -> None:
+        for i in range(0, 10):
+            self._bb.append(make_frame(300))
+
+        fi = self._bb.frame_index
+        self.assertEqual(len(fi), 6)
+        self.assertEqual(fi.frameOffsetAtOrBefore(self._bb.stored_offset), 
+            None)
+        self.assertEqual(fi.frameOffsetAtOrAfter(0), 1200)
+
+    def test_frame_duration_at(self) -> None:
+        self._bb.append(make_frame(300) + make_frame(310, blocks=2))
+
+        fi = self._bb.frame_index
+        self.assertAlmostEqual(fi.frameDurationAt(300), 2048 / 44100)
+
+        with self.assertRaises(ValueError):
+            fi.frameDurationAt(301)
+
+if __name__ == '__main__':
+    unittest.main()
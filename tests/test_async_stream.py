@@ -0,0 +1,347 @@
+from app.async_stream import AsyncEngine, AsyncRadioStream, \
+    AsyncRadioStreamManager, _ChunkedDecoder
+from app.circuit_breaker import OPEN, CircuitBreaker
+from app.radio_stream import PersistentRedundantRadioStream, \
+    RedundantRadioStream
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Event, Thread
+from unittest import mock
+import asyncio, os, time, unittest
+
+BODY = bytes(range(256)) * 64
+
+class _StreamHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        if self.path == '/redirect':
+            self.send_response(302)
+            self.send_header('Location', '/stream')
+            self.end_headers()
+        elif self.path == '/chunked':
+            self.send_response(200)
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for i in range(0, len(BODY), 1000):
+                chunk = BODY[i:i + 1000]
+                self.wfile.write(f"{len(chunk):x}\r\n".encode() + chunk + 
+                    b'\r\n')
+            self.wfile.write(b'0\r\n\r\n')
+        elif self.path == '/live':
+            self.send_response(200)
+            self.end_headers()
+            try:
+                while True:
+                    self.wfile.write(BODY)
+                    time.sleep(0.01)
+            except OSError:
+                pass
+        elif self.path == '/stall':
+            # A little data, then nothing, with the connection left open
+            self.send_response(200)
+            self.end_headers()
+            self.wfile.write(BODY * 5)
+            time.sleep(30)
+        elif self.path == '/stream':
+            self.send_response(200)
+            self.send_header('Content-Type', 'audio/aac')
+            self.end_headers()
+            self.wfile.write(BODY)
+        else:
+            self.send_response(404)
+            self.end_headers()
+
+    def log_message(self, format : str, *args) -> None:
+        pass
+
+class TestChunkedDecoder(unittest.TestCase):
+    def test_decode(self) -> None:
+        decoder = _ChunkedDecoder()
+        encoded = b'5\r\nRuby \r\n5;ext=1\r\nRose!\r\n0\r\n\r\n'
+
+        # Feed it a byte at a time, the worst case
+        result = b''
+        for i in range(len(encoded)):
+            for piece in decoder.feed(memoryview(encoded)[i:i + 1]):
+                result += piece
+
+        self.assertEqual(result, b'Ruby Rose!')
+        self.assertTrue(decoder.done)
+
+class TestAsyncEngine(unittest.TestCase):
+    def test_stop_cancels_tasks(self) -> None:
+        engine = AsyncEngine()
+        cancelled = []
+
+        async def sleeper() -> None:
+            try:
+                await asyncio.sleep(60)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+
+        future = engine.submit(sleeper())
+        time.sleep(0.1)
+        engine.stop()
+        engine.join(5)
+
+        self.assertFalse(engine.is_alive())
+        self.assertTrue(future.cancelled())
+        self.assertEqual(cancelled, [True])
+
+class _LocalServerTestCase(unittest.TestCase):
+    _server : ThreadingHTTPServer = None
+    _engine : AsyncEngine = None
+
+    def setUp(self) -> None:
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), _StreamHandler)
+        Thread(target=self._server.serve_forever, daemon=True).start()
+        self._engine = AsyncEngine()
+
+    def tearDown(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+        self._engine.stop()
+
+    def _url(self, path : str) -> str:
+        return f"http://127.0.0.1:{self._server.server_port}{path}"
+
+    def _waitFor(self, predicate, timeout : float = 5) -> bool:
+        end = time.monotonic() + timeout
+        while not predicate() and time.monotonic() < end:
+            time.sleep(0.01)
+        return predicate()
+
+class TestAsyncRadioStream(_LocalServerTestCase):
+    def _readStream(self, path : str) -> bytes:
+        stream = AsyncRadioStream(self._engine, self._url(path), 
+                    buffer_size=len(BODY), preroll_len=100)
+        stream.start()
+        self.assertTrue(self._waitFor(lambda: not stream.is_alive()))
+        return bytes(stream.byte_buffer.read())
+
+    def test_read(self) -> None:
+        self.assertEqual(self._readStream('/stream'), BODY[100:])
+
+    def test_redirect(self) -> None:
+        self.assertEqual(self._readStream('/redirect'), BODY[100:])
+
+    def test_chunked(self) -> None:
+        self.assertEqual(self._readStream('/chunked'), BODY[100:])
+
+    def test_not_found(self) -> None:
+        self.assertEqual(self._readStream('/missing'), b'')
+
+    def test_data_and_exit_callbacks(self) -> None:
+        received = []
+        exited = Event()
+
+        stream = AsyncRadioStream(self._engine, self._url('/stream'), 
+                    preroll_len=0, on_data=received.append,
+                    on_exit=lambda s: exited.set())
+        stream.start()
+
+        self.assertTrue(exited.wait(5))
+        self.assertGreater(len(received), 0)
+        self.assertIs(received[0], stream)
+
+class TestAsyncRadioStreamManager(_LocalServerTestCase):
+    def test_primary_and_redundancy(self) -> None:
+        with mock.patch.object(AsyncRadioStreamManager, '_findStreamURL', 
+                return_value=self._url('/live')):
+            rsm = AsyncRadioStreamManager(self._engine, 'page', redundancy=2)
+            rsm.start()
+
+            self.assertTrue(self._waitFor(
+                lambda: rsm.primary_radio_stream is not None and 
+                    len(rsm.radio_streams) == 3))
+            rsm.stop()
+
+            self.assertTrue(self._waitFor(lambda: not rsm.is_alive()))
+
+    def test_refresh(self) -> None:
+        with mock.patch.object(AsyncRadioStreamManager, '_findStreamURL', 
+                return_value=self._url('/live')):
+            rsm = AsyncRadioStreamManager(self._engine, 'page', redundancy=2,
+                    redundant_max_age_sec=1)
+            rsm.start()
+            self.assertTrue(self._waitFor(
+                lambda: len(rsm.radio_streams) == 3))
+            oldStreams = rsm.radio_streams[1:]
+
+            # Old streams are only let go of once their replacements are up
+            counts = []
+            end = time.monotonic() + 3
+            while time.monotonic() < end:
+                counts.append(len(rsm.radio_streams))
+                time.sleep(0.01)
+            rsm.stop()
+
+            self.assertFalse(any(stream in oldStreams 
+                for stream in rsm.radio_streams))
+            self.assertGreaterEqual(min(counts), 3)
+
+    def test_stalled_primary(self) -> None:
+        urls = [self._url('/stall')] * 2
+        with mock.patch.object(AsyncRadioStreamManager, '_findStreamURL', 
+                side_effect=lambda: urls.pop() if urls else self._url('/live')):
+            rsm = AsyncRadioStreamManager(self._engine, 'page', redundancy=1,
+                    stall_grace_sec=1)
+            rsm.start()
+            self.assertTrue(self._waitFor(lambda: rsm.failover_count > 0 and
+                rsm.primary_radio_stream.stream_url.endswith('/live')))
+            rsm.stop()
+
+            self.assertGreaterEqual(rsm.stall_count, 1)
+
+    def test_failover_during_lookup(self) -> None:
+        # The first streams come up straight away, but any after that take
+        # a while to look up
+        lookups = []
+        def findStreamURL() -> str:
+            lookups.append(1)
+            if len(lookups) > 3:
+                time.sleep(3)
+            return self._url('/live')
+
+        with mock.patch.object(AsyncRadioStreamManager, '_findStreamURL', 
+                side_effect=findStreamURL), \
+                mock.patch('app.async_stream.log') as log:
+            rsm = AsyncRadioStreamManager(self._engine, 'page', redundancy=2)
+            rsm.start()
+            self.assertTrue(self._waitFor(lambda: len(rsm.radio_streams) == 3))
+            # There was no primary to fail yet
+            self.assertNotIn(mock.call("All radio streams have failed."),
+                log.warning.call_args_list)
+
+            # Losing a standby sets off a slow lookup, which losing the
+            # primary mustn't have to wait for
+            rsm.radio_streams[1].stop()
+            self.assertTrue(self._waitFor(lambda: len(lookups) == 4))
+            oldPRS = rsm.primary_radio_stream
+            oldPRS.stop()
+
+            self.assertTrue(self._waitFor(lambda: rsm.failover_count == 1, 
+                timeout=1))
+            self.assertIsNot(rsm.primary_radio_stream, oldPRS)
+            rsm.stop()
+
+    def test_backoff(self) -> None:
+        breaker = CircuitBreaker(failure_threshold=3, base_delay_sec=0.2,
+                    open_sec=60)
+        with mock.patch.object(AsyncRadioStreamManager, '_findStreamURL', 
+                side_effect=RuntimeError("Failed to get a stream URL")) \
+                    as lookups:
+            rsm = AsyncRadioStreamManager(self._engine, 'page', redundancy=1,
+                    circuit_breaker=breaker)
+            rsm.start()
+            self.assertTrue(self._waitFor(lambda: breaker.state == OPEN))
+
+            calls = lookups.call_count
+            time.sleep(1)
+            rsm.stop()
+
+            self.assertEqual(lookups.call_count, calls)
+            self.assertLessEqual(calls, 4)
+
+    def test_failover_while_open(self) -> None:
+        breaker = CircuitBreaker(failure_threshold=1, open_sec=60)
+        with mock.patch.object(AsyncRadioStreamManager, '_findStreamURL', 
+                return_value=self._url('/live')):
+            rsm = AsyncRadioStreamManager(self._engine, 'page', redundancy=2,
+                    circuit_breaker=breaker)
+            rsm.start()
+            self.assertTrue(self._waitFor(lambda: len(rsm.radio_streams) == 3
+                and all(stream.ready for stream in rsm.radio_streams)))
+
+            # Losing a standby while the breaker is open means a replacement
+            # waiting out the breaker, which mustn't hold up failing over
+            breaker.record_failure()
+            oldPRS = rsm.primary_radio_stream
+            rsm.radio_streams[-1].stop()
+            self.assertTrue(self._waitFor(lambda: len(rsm.radio_streams) == 2))
+            oldPRS.stop()
+
+            self.assertTrue(self._waitFor(lambda: rsm.failover_count == 1, 
+                timeout=1))
+            self.assertIsNot(rsm.primary_radio_stream, oldPRS)
+            self.assertEqual(breaker.state, OPEN)
+            rsm.stop()
+
+    def test_redundant_radio_stream(self) -> None:
+        with mock.patch.object(AsyncRadioStreamManager, '_findStreamURL', 
+                return_value=self._url('/live')):
+            rrs = RedundantRadioStream('page', redundancy=1, 
+                    redundant_buffer_size=len(BODY), 
+                    cache_buffer_size=len(BODY), sync_len=1000, 
+                    engine=self._engine)
+            rrs.start()
+
+            self.assertTrue(self._waitFor(
+                lambda: rrs.byte_buffer.readable_length >= 1000))
+            self.assertTrue(rrs.is_alive())
+            rrs.stop()
+
+            self.assertGreaterEqual(
+                (BODY * 2).find(bytes(rrs.byte_buffer.read(1000))), 0)
+            self.assertTrue(self._waitFor(lambda: not rrs.is_alive()))
+
+    def test_stop_lets_threads_go(self) -> None:
+        filepath = './tests/output/async_prrs_test'
+        self.addCleanup(lambda: os.path.isfile(filepath) and 
+            os.remove(filepath))
+
+        with mock.patch.object(AsyncRadioStreamManager, '_findStreamURL', 
+                return_value=self._url('/live')):
+            prrs = PersistentRedundantRadioStream(filepath, 'page', 
+                    redundancy=1, persistent_buffer_size=len(BODY), 
+                    cache_buffer_size=len(BODY), sync_len=1000, 
+                    overwrite=True, write_behind_high_water_mark=len(BODY),
+                    engine=self._engine)
+            prrs.start()
+            self.assertTrue(self._waitFor(
+                lambda: prrs.byte_buffer.readable_length >= 1000))
+
+            prrs.writeAll()
+            prrs.stop()
+
+        writer = prrs.byte_buffer.file_writer
+        writer.join(5)
+        self.assertFalse(prrs.is_alive())
+        self.assertFalse(writer.is_alive())
+        self.assertGreater(os.path.getsize(filepath), 0)
+
+    def test_slow_disk_holds_up_only_its_station(self) -> None:
+        stuck = Event()
+        diskReady = Event()
+        self.addCleanup(diskReady.set)
+
+        def station() -> RedundantRadioStream:
+            return RedundantRadioStream('page', redundancy=1, 
+                    redundant_buffer_size=len(BODY), 
+                    cache_buffer_size=len(BODY), sync_len=1000, 
+                    engine=self._engine)
+
+        with mock.patch.object(AsyncRadioStreamManager, '_findStreamURL', 
+                return_value=self._url('/live')):
+            slow = station()
+            # Where a persistent buffer would write to disk
+            def slowMakeRoom(length : int) -> None:
+                stuck.set()
+                diskReady.wait()
+            slow.byte_buffer.makeRoom = slowMakeRoom
+
+            slow.start()
+            self.assertTrue(stuck.wait(5))
+
+            fast = station()
+            fast.start()
+            self.assertTrue(self._waitFor(
+                lambda: fast.byte_buffer.readable_length >= 1000))
+
+            diskReady.set()
+            self.assertTrue(self._waitFor(
+                lambda: slow.byte_buffer.readable_length >= 1000))
+            slow.stop()
+            fast.stop()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,10 @@
-from app.byte_buffer import ByteBuffer, PersistentByteBuffer
+from app.byte_buffer import ByteBuffer, ByteBufferCursor, PersistentByteBuffer
+from datetime import datetime, timedelta
 from pathlib import Path
-import os, unittest
+from test_adts import make_frame
+from threading import Timer
+from unittest import mock
+import os, time, unittest
 
 class TestByteBufferCreation(unittest.TestCase):
     def test_creation(self):
@@ -189,6 +193,128 @@ class TestByteBufferAppendNonBytesData(unittest.TestCase):
         self.assertEqual(cm.exception.args[0], 
             'Value given for \"bytes\" is not a bytes-like object.')
 
+class TestByteBufferWriteView(unittest.TestCase):
+    bb = None
+
+    def setUp(self) -> None:
+        self.bb = ByteBuffer(10)
+        self.bb.append(b'Ruby')
+    
+    def test_write_view(self):
+        expected = b'RubyRose'
+
+        view = self.bb.writeView(8)
+        self.assertEqual(len(view), 6)
+
+        view[:4] = b'Rose'
+        self.assertEqual(self.bb.readable_length, 4)
+
+        self.bb.publish(4)
+
+        self.assertEqual(self.bb.readable_length, 8)
+        self.assertSequenceEqual(self.bb.read(), expected)
+
+class TestByteBufferWriteViewWraparound(unittest.TestCase):
+    bb = None
+
+    def setUp(self) -> None:
+        self.bb = ByteBuffer(10)
+        self.bb.append(b'Ruby Rose!')
+    
+    def test_write_view_wraparound(self):
+        expected = b'Rose!Yang'
+
+        view = self.bb.writeView(4)
+        self.assertEqual(self.bb.readable_length, 6)
+
+        view[:] = b'Yang'
+        self.bb.publish(4)
+
+        self.bb.seek(1)
+        self.assertSequenceEqual(self.bb.read(), expected)
+
+class TestByteBufferWriteViewZeroLength(unittest.TestCase):
+    bb = None
+
+    def setUp(self) -> None:
+        self.bb = ByteBuffer(10)
+    
+    def test_write_view_zero_length(self):
+        with self.assertRaises(ValueError) as cm:
+            self.bb.writeView(0)
+
+        self.assertEqual(cm.exception.args[0], 
+            'Length cannot be zero')
+
+class TestByteBufferPublishOverWriteViewLength(unittest.TestCase):
+    bb = None
+
+    def setUp(self) -> None:
+        self.bb = ByteBuffer(10)
+    
+    def test_publish_over_write_view_length(self):
+        self.bb.writeView(4)
+
+        with self.assertRaises(ValueError) as cm:
+            self.bb.publish(5)
+
+        self.assertEqual(cm.exception.args[0], 
+            'Cannot publish more than the length of the write view')
+
+class TestByteBufferWaitForReadable(unittest.TestCase):
+    bb = None
+
+    def setUp(self) -> None:
+        self.bb = ByteBuffer(10)
+        self.bb.append(b'Ruby')
+    
+    def test_wait_for_readable(self):
+        self.assertTrue(self.bb.waitForReadable(4, timeout=0))
+
+    def test_wait_for_readable_timeout(self):
+        self.assertFalse(self.bb.waitForReadable(5, timeout=0.01))
+
+    def test_wait_for_readable_append(self):
+        t = Timer(0.05, self.bb.append, args=(b' Rose',))
+        t.start()
+
+        try:
+            self.assertTrue(self.bb.waitForReadable(9, timeout=5))
+        finally:
+            t.cancel()
+
+    def test_wait_for_readable_publish(self):
+        def write() -> None:
+            view = self.bb.writeView(5)
+            view[:] = b' Rose'
+            self.bb.publish(5)
+
+        t = Timer(0.05, write)
+        t.start()
+
+        try:
+            self.assertTrue(self.bb.waitForReadable(9, timeout=5))
+        finally:
+            t.cancel()
+
+    def test_wake_waiters(self):
+        t = Timer(0.05, self.bb.wakeWaiters)
+        t.start()
+
+        try:
+            start = time.monotonic()
+            self.assertFalse(self.bb.waitForReadable(9, timeout=5))
+            self.assertLess(time.monotonic() - start, 1)
+        finally:
+            t.cancel()
+
+    def test_wait_for_readable_over_buffer_len_length(self):
+        with self.assertRaises(ValueError) as cm:
+            self.bb.waitForReadable(11)
+
+        self.assertEqual(cm.exception.args[0], 
+            'Requested length is longer than the buffer length')
+
 class TestByteBufferGetFirstReadIndex(unittest.TestCase):
     bb = None
 
@@ -1049,6 +1175,91 @@ class TestByteBufferReadUpToRemainingLengthOverBufferLenLength(unittest.TestCase
         self.assertEqual(cm.exception.args[0], 
             'Requested length is longer than the buffer length')
 
+class TestByteBufferReadViews(unittest.TestCase):
+    bb = None
+
+    def setUp(self) -> None:
+        self.bb = ByteBuffer(10)
+        self.bb.append(b'Ruby Rose')
+    
+    def test_read_views(self):
+        expected = b'Ruby'
+
+        result = self.bb.readViews(4)
+
+        self.assertEqual(len(result), 1)
+        self.assertIsInstance(result[0], memoryview)
+        self.assertSequenceEqual(result[0], expected)
+        self.assertEqual(self.bb.readable_length, 9)
+
+class TestByteBufferReadViewsWraparound(unittest.TestCase):
+    bb = None
+
+    def setUp(self) -> None:
+        self.bb = ByteBuffer(10)
+        self.bb.append(b'Ruby Rose!')
+        self.bb.append(b'Yang')
+    
+    def test_read_views_wraparound(self):
+        result = self.bb.readViews()
+
+        self.assertEqual(len(result), 2)
+        self.assertSequenceEqual(result[0], b' Rose!')
+        self.assertSequenceEqual(result[1], b'Yang')
+
+class TestByteBufferReadViewsNoData(unittest.TestCase):
+    bb = None
+
+    def setUp(self) -> None:
+        self.bb = ByteBuffer(10)
+    
+    def test_read_views_no_data(self):
+        self.assertEqual(self.bb.readViews(), ())
+
+class TestByteBufferReadViewsOverReadableLenLength(unittest.TestCase):
+    bb = None
+
+    def setUp(self) -> None:
+        self.bb = ByteBuffer(10)
+        self.bb.append(b'RUBY')
+    
+    def test_read_views_over_readable_len_length(self):
+        with self.assertRaises(ValueError) as cm:
+            self.bb.readViews(5)
+
+        self.assertEqual(cm.exception.args[0], 
+            'Requested length is longer than what exists in the buffer')
+
+class TestByteBufferReadViewsUpToRemainingLength(unittest.TestCase):
+    bb = None
+
+    def setUp(self) -> None:
+        self.bb = ByteBuffer(10)
+        self.bb.append(b'Ruby Rose!')
+        self.bb.append(b'Yang')
+    
+    def test_read_views_up_to_remaining_length(self):
+        result = self.bb.readViewsUpToRemainingLength(5)
+
+        self.assertEqual(len(result), 1)
+        self.assertSequenceEqual(result[0], b' Rose')
+
+class TestByteBufferCommit(unittest.TestCase):
+    bb = None
+
+    def setUp(self) -> None:
+        self.bb = ByteBuffer(10)
+        self.bb.append(b'Ruby Rose!')
+        self.bb.append(b'Yang')
+    
+    def test_commit(self):
+        expected = b'Yang'
+
+        views = self.bb.readViews(6)
+        self.bb.commit(sum(len(view) for view in views))
+
+        self.assertSequenceEqual(self.bb.read(), expected)
+
 class TestByteBufferSeek(unittest.TestCase):
     bb = None
 
@@ -1324,6 +1535,35 @@ class TestByteBufferFindNonexistentSequence(unittest.TestCase):
         self.assertEqual(cm.exception.args[0], 
             'Failed to find given byte sequence')
 
+class TestByteBufferFindSequenceAcrossSeam(unittest.TestCase):
+    bb = None
+
+    def setUp(self) -> None:
+        self.bb = ByteBuffer(30)
+        self.bb.append(b'Great, the gang\'s all here!')
+        self.bb.append(b'Now we can die together!')
+    
+    def test_find_sequence_across_seam(self):
+        expected = 28
+
+        result = self.bb._findSequence(b'ow we')
+        self.assertEqual(result, expected)
+
+class TestByteBufferFindSequenceNotPastReadBounds(unittest.TestCase):
+    bb = None
+
+    def setUp(self) -> None:
+        self.bb = ByteBuffer(16)
+        self.bb.append(b'acaccbcbccbbcaca')
+        self.bb.seek(11)
+    
+    def test_find_sequence_not_past_read_bounds(self):
+        with self.assertRaises(ValueError) as cm:
+            self.bb._findSequence(b'aa')
+
+        self.assertEqual(cm.exception.args[0], 
+            'Failed to find given byte sequence')
+
 class TestByteBufferSeekToSequence(unittest.TestCase):
     bb = None
 
@@ -1386,6 +1626,196 @@ class TestByteBufferSeekPastSequenceWraparound(unittest.TestCase):
 
         self.assertSequenceEqual(result, expected)
 
+class TestByteBufferOffsets(unittest.TestCase):
+    bb = None
+
+    def setUp(self) -> None:
+        self.bb = ByteBuffer(10)
+        self.bb.append(b'Ruby Rose!')
+        self.bb.append(b'Yang')
+    
+    def test_offsets(self) -> None:
+        self.assertEqual(self.bb.write_offset, 14)
+        self.assertEqual(self.bb.stored_offset, 4)
+        self.assertEqual(self.bb.read_offset, 4)
+
+        self.bb.read(3)
+
+        self.assertEqual(self.bb.read_offset, 7)
+        self.assertEqual(self.bb.stored_offset, 4)
+
+    def test_oversized_append_offsets(self) -> None:
+        self.bb.append(b'Weiss Schnee')
+
+        self.assertEqual(self.bb.write_offset, 26)
+        self.assertEqual(self.bb.stored_offset, 16)
+
+    def test_read_at_offset(self) -> None:
+        self.assertSequenceEqual(self.bb.readAtOffset(5, 7), b'Rose!Ya')
+        self.assertEqual(self.bb.readable_length, 10)
+
+    def test_read_views_at_offset(self) -> None:
+        views = self.bb.readViewsAtOffset(8, 4)
+
+        self.assertEqual(len(views), 2)
+        self.assertSequenceEqual(views[0], b'e!')
+        self.assertSequenceEqual(views[1], b'Ya')
+
+    def test_read_at_overwritten_offset(self) -> None:
+        with self.assertRaises(ValueError) as cm:
+            self.bb.readAtOffset(3, 2)
+
+        self.assertEqual(cm.exception.args[0], 
+            'Requested offset has already been overwritten')
+
+    def test_read_at_unwritten_offset(self) -> None:
+        with self.assertRaises(ValueError) as cm:
+            self.bb.readAtOffset(12, 3)
+
+        self.assertEqual(cm.exception.args[0], 
+            'Requested offset has not been written yet')
+
+    def test_seek_to_offset(self) -> None:
+        self.bb.seekToOffset(10)
+
+        self.assertSequenceEqual(self.bb.read(), b'Yang')
+
+    def test_find_sequence_offset(self) -> None:
+        self.assertEqual(self.bb.findSequenceOffset(b'!Y'), 9)
+
+    def test_cursor_offset(self) -> None:
+        cursor = self.bb.addCursor('disk')
+
+        self.assertEqual(cursor.offset, 4)
+
+        cursor.seekToOffset(11)
+
+        self.assertEqual(cursor.offset, 11)
+        self.assertSequenceEqual(cursor.read(), b'ang')
+
+class TestByteBufferTimeIndex(unittest.TestCase):
+    bb = None
+
+    def setUp(self) -> None:
+        self.bb = ByteBuffer(10)
+        self.bb.append(b'Ruby')
+        self.bb.time_index._timestamps[-1] -= 10
+        self.bb.append(b' Rose!')
+        self.bb.time_index._timestamps[-1] -= 5
+    
+    def test_offset_at(self) -> None:
+        now = datetime.now()
+
+        self.assertEqual(self.bb.offsetAt(now - timedelta(seconds=20)), 0)
+        self.assertEqual(self.bb.offsetAt(now - timedelta(seconds=7)), 4)
+        self.assertEqual(self.bb.offsetAt(now), 10)
+
+    def test_time_at(self) -> None:
+        now = datetime.now()
+
+        self.assertLess(self.bb.timeAt(3), now - timedelta(seconds=9))
+        self.assertGreater(self.bb.timeAt(4), now - timedelta(seconds=9))
+
+    def test_read_since(self) -> None:
+        result = self.bb.readSince(datetime.now() - timedelta(seconds=7))
+
+        self.assertSequenceEqual(result, b' Rose!')
+        self.assertEqual(self.bb.readable_length, 10)
+
+    def test_eviction(self) -> None:
+        self.bb.append(b'Yang Xiao')
+
+        self.assertEqual(len(self.bb.time_index), 2)
+
+class TestByteBufferCursors(unittest.TestCase):
+    bb = None
+
+    def setUp(self) -> None:
+        self.bb = ByteBuffer(10)
+        self.bb.append(b'Ruby')
+    
+    def test_add_cursor(self) -> None:
+        cursor = self.bb.addCursor('disk')
+
+        self.assertIsInstance(cursor, ByteBufferCursor)
+        self.assertEqual(cursor.name, 'disk')
+        self.assertEqual(cursor.readable_length, 4)
+        self.assertEqual(self.bb.getCursor('disk'), cursor)
+
+    def test_add_cursor_from_end(self) -> None:
+        cursor = self.bb.addCursor('relay', from_end=True)
+
+        self.assertEqual(cursor.readable_length, 0)
+
+    def test_add_cursor_consumed_data(self) -> None:
+        self.bb.read()
+
+        cursor = self.bb.addCursor('disk')
+
+        self.assertSequenceEqual(cursor.read(), b'Ruby')
+
+    def test_add_duplicate_cursor(self) -> None:
+        self.bb.addCursor('disk')
+
+        with self.assertRaises(ValueError) as cm:
+            self.bb.addCursor('disk')
+
+        self.assertEqual(cm.exception.args[0], 
+            'A cursor named disk already exists')
+
+    def test_remove_cursor(self) -> None:
+        self.bb.addCursor('disk')
+        self.bb.removeCursor('disk')
+
+        with self.assertRaises(KeyError):
+            self.bb.getCursor('disk')
+
+    def test_independent_cursors(self) -> None:
+        disk = self.bb.addCursor('disk')
+        relay = self.bb.addCursor('relay')
+
+        self.bb.append(b' Rose')
+
+        self.assertSequenceEqual(disk.read(6), b'Ruby R')
+        self.assertSequenceEqual(relay.read(), b'Ruby Rose')
+        self.assertSequenceEqual(disk.read(), b'ose')
+
+        self.assertEqual(relay.readable_length, 0)
+        self.assertEqual(self.bb.readable_length, 9)
+
+    def test_cursor_wraparound(self) -> None:
+        cursor = self.bb.addCursor('disk')
+
+        self.bb.append(b' Rose!')
+        cursor.read(5)
+        self.bb.append(b'Yang')
+
+        views = cursor.readViews()
+        self.assertEqual(len(views), 2)
+        self.assertSequenceEqual(cursor.read(), b'Rose!Yang')
+
+    def test_cursor_overrun(self) -> None:
+        disk = self.bb.addCursor('disk')
+        relay = self.bb.addCursor('relay', from_end=True)
+
+        self.bb.append(b' Rose! Yang')
+
+        self.assertEqual(disk.overrun_length, 5)
+        self.assertEqual(relay.overrun_length, 1)
+        self.assertSequenceEqual(disk.read(), b'Rose! Yang')
+
+    def test_cursor_overrun_write_view(self) -> None:
+        disk = self.bb.addCursor('disk')
+        self.bb.append(b' Rose!')
+
+        view = self.bb.writeView(3)
+        self.assertEqual(disk.overrun_length, 3)
+
+        view[:] = b'Yan'
+        self.bb.publish(3)
+
+        self.assertSequenceEqual(disk.read(), b'y Rose!Yan')
+
 class TestPersistentByteBufferCreation(unittest.TestCase):
 
     def test_init(self) -> None:
@@ -1436,6 +1866,8 @@ class TestPersistentByteBufferFunctions(unittest.TestCase):
         self._pbb = PersistentByteBuffer(self._filepath, 10)
     
     def tearDown(self) -> None:
+        self._pbb.close()
+
         if os.path.isfile(self._filepath):
             os.remove(self._filepath)
 
@@ -1463,6 +1895,233 @@ class TestPersistentByteBufferFunctions(unittest.TestCase):
         with open(self._pbb.filepath, 'rb') as f:
             self.assertSequenceEqual(f.read(), b'Ruby Rose!Yang')
 
+    def test_make_room(self) -> None:
+        self._pbb.append(b'Ruby Rose!')
+        self._pbb.makeRoom(4)
+
+        with open(self._pbb.filepath, 'rb') as f:
+            self.assertSequenceEqual(f.read(), b'Ruby')
+
+        # The append that follows has nothing left to write out
+        with mock.patch.object(self._pbb, '_writeToFile') as writeToFile:
+            self._pbb.append(b'Yang')
+            writeToFile.assert_not_called()
+
+    def test_overflow_write_view(self) -> None:
+        self._pbb.append(b'Ruby Rose!')
+
+        view = self._pbb.writeView(4)
+        view[:] = b'Yang'
+        self._pbb.publish(4)
+
+        with open(self._pbb.filepath, 'rb') as f:
+            self.assertSequenceEqual(f.read(), b'Ruby')
+
+    def test_change_filepath(self) -> None:
+        otherFilepath = self._filepath + '_other'
+
+        try:
+            self._pbb.append(b'Ruby Rose!')
+            self._pbb.append(b'Yang')
+
+            self._pbb.filepath = otherFilepath
+            self._pbb.append(b'Weiss')
+
+            with open(self._filepath, 'rb') as f:
+                self.assertSequenceEqual(f.read(), b'Ruby')
+            with open(otherFilepath, 'rb') as f:
+                self.assertSequenceEqual(f.read(), b' Rose')
+        finally:
+            self._pbb.close()
+            if os.path.isfile(otherFilepath):
+                os.remove(otherFilepath)
+
+    def test_wrapped_write_all_single_writev(self) -> None:
+        self._pbb.append(b'Ruby Rose!')
+        self._pbb.append(b'Yang')
+
+        calls = []
+        realWritev = os.writev
+
+        def writev(fd : int, buffers) -> int:
+            calls.append(len(buffers))
+            return realWritev(fd, buffers)
+
+        with mock.patch('os.writev', side_effect=writev):
+            self._pbb.writeAll()
+
+        self.assertEqual(calls, [2])
+        with open(self._pbb.filepath, 'rb') as f:
+            self.assertSequenceEqual(f.read(), b'Ruby Rose!Yang')
+
+    def test_write_all(self) -> None:
+        self._pbb.append(b'Ruby Rose!')
+        self._pbb.append(b'Yang')
+
+        self._pbb.writeAll()
+
+        self.assertEqual(self._pbb.readable_length, 0)
+        with open(self._pbb.filepath, 'rb') as f:
+            self.assertSequenceEqual(f.read(), b'Ruby Rose!Yang')
+
+class TestPersistentByteBufferPreallocate(unittest.TestCase):
+    _pbb : PersistentByteBuffer = None
+    _filepath : str = './tests/output/pbb_test_preallocate'
+    _other_filepath : str = './tests/output/pbb_test_preallocate_other'
+
+    def setUp(self) -> None:
+        self.tearDown()
+
+        self._pbb = PersistentByteBuffer(self._filepath, 10, 
+                        preallocate_sec=100)
+    
+    def tearDown(self) -> None:
+        if self._pbb is not None:
+            self._pbb.close()
+
+        for filepath in (self._filepath, self._other_filepath):
+            if os.path.isfile(filepath):
+                os.remove(filepath)
+
+    def test_preallocate(self) -> None:
+        with mock.patch.object(PersistentByteBuffer, 'byte_rate', 
+                new_callable=mock.PropertyMock, return_value=10):
+            self._pbb.filepath = self._other_filepath
+        self._pbb.append(b'Ruby Rose!Yang')
+
+        self.assertEqual(os.path.getsize(self._other_filepath), 1000)
+
+        self._pbb.writeAll()
+        self._pbb.filepath = self._filepath
+
+        with open(self._other_filepath, 'rb') as f:
+            self.assertSequenceEqual(f.read(), b'Ruby Rose!Yang')
+
+    def test_no_byte_rate(self) -> None:
+        self._pbb.filepath = self._other_filepath
+        self._pbb.append(b'Ruby Rose!Yang')
+
+        self.assertFalse(self._pbb.file_writer.preallocated)
+
+class TestPersistentByteBufferWriteBehind(unittest.TestCase):
+    _pbb : PersistentByteBuffer = None
+    _filepath : str = './tests/output/pbb_test_write_behind'
+
+    def setUp(self) -> None:
+        if os.path.isfile(self._filepath):
+            os.remove(self._filepath)
+
+        self._pbb = PersistentByteBuffer(self._filepath, 10, 
+                        write_behind_high_water_mark=1024)
+    
+    def tearDown(self) -> None:
+        self._pbb.file_writer.stop()
+
+        if os.path.isfile(self._filepath):
+            os.remove(self._filepath)
+
+    def test_write_behind(self) -> None:
+        self._pbb.append(b'Ruby Rose!')
+        self._pbb.append(b'Yang Xiao Long')
+        self._pbb.writeAll()
+
+        with open(self._pbb.filepath, 'rb') as f:
+            self.assertSequenceEqual(f.read(), b'Ruby Rose!Yang Xiao Long')
+
+    def test_close_stops_thread(self) -> None:
+        self._pbb.append(b'Ruby Rose!')
+        self._pbb.writeAll()
+        self._pbb.close()
+        self._pbb.file_writer.join(5)
+
+        self.assertFalse(self._pbb.file_writer.is_alive())
+        with open(self._pbb.filepath, 'rb') as f:
+            self.assertSequenceEqual(f.read(), b'Ruby Rose!')
+
+class TestPersistentByteBufferRotation(unittest.TestCase):
+    _pbb : PersistentByteBuffer = None
+    _filepath : str = './tests/output/pbb_test_rotation'
+    _other_filepath : str = './tests/output/pbb_test_rotation_other'
+
+    def setUp(self) -> None:
+        self.tearDown()
+
+        self._pbb = PersistentByteBuffer(self._filepath, 10)
+    
+    def tearDown(self) -> None:
+        if self._pbb is not None:
+            self._pbb.close()
+
+        for filepath in (self._filepath, self._other_filepath):
+            if os.path.isfile(filepath):
+                os.remove(filepath)
+
+    def _assertFiles(self, expected : bytes, expected_other : bytes) -> None:
+        self._pbb.writeAll()
+        self._pbb.close()
+
+        with open(self._filepath, 'rb') as f:
+            self.assertSequenceEqual(f.read(), expected)
+        with open(self._other_filepath, 'rb') as f:
+            self.assertSequenceEqual(f.read(), expected_other)
+
+    def test_rotate_at_offset(self) -> None:
+        self._pbb.append(b'Ruby Rose!')
+        self._pbb.rotateAtOffset(5, self._other_filepath)
+        self._pbb.append(b'Yang Xiao Long')
+
+        self.assertEqual(self._pbb.filepath, self._other_filepath)
+        self._assertFiles(b'Ruby ', b'Rose!Yang Xiao Long')
+
+    def test_rotate_at_offset_on_write_all(self) -> None:
+        self._pbb.append(b'Ruby Rose!')
+        self._pbb.rotateAtOffset(4, self._other_filepath)
+
+        self._assertFiles(b'Ruby', b' Rose!')
+
+    def test_rotate_at_passed_offset(self) -> None:
+        self._pbb.append(b'Ruby Rose!Yang')
+        self._pbb.rotateAtOffset(2, self._other_filepath)
+
+        self._assertFiles(b'Ruby', b' Rose!Yang')
+
+    def test_rotate_at_time(self) -> None:
+        self._pbb.append(b'Ruby ', 100)
+        self._pbb.append(b'Rose!', 200)
+        self._pbb.rotateAt(datetime.fromtimestamp(150), self._other_filepath)
+
+        self.assertEqual(self._pbb.pending_rotations, 1)
+        self._assertFiles(b'Ruby ', b'Rose!')
+        self.assertEqual(self._pbb.pending_rotations, 0)
+
+    def test_rotate_at_future_time(self) -> None:
+        self._pbb.append(b'Ruby ', 100)
+        self._pbb.rotateAt(datetime.fromtimestamp(150), self._other_filepath)
+        self._pbb.writeAll()
+
+        self.assertEqual(self._pbb.filepath, os.path.realpath(self._filepath))
+        self.assertEqual(self._pbb.pending_rotations, 1)
+
+        self._pbb.append(b'Rose!', 200)
+        self._assertFiles(b'Ruby ', b'Rose!')
+
+    def test_rotate_at_frame_boundary(self) -> None:
+        self._pbb.close()
+        self._pbb = PersistentByteBuffer(self._filepath, 1000, 
+                        index_frames=True)
+        frames = [make_frame(100) for _ in range(4)]
+
+        self._pbb.append(frames[0], 100)
+        self._pbb.append(frames[1][:30], 200)
+        self._pbb.append(frames[1][30:], 201)
+        self._pbb.append(frames[2] + frames[3], 300)
+
+        # The cut lands 30 bytes into the second frame, so it moves back to
+        # the start of it
+        self._pbb.rotateAt(datetime.fromtimestamp(200.5), self._other_filepath)
+
+        self._assertFiles(frames[0], b''.join(frames[1:]))
+
  
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,94 @@
+from app.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, \
+    get_circuit_breaker
+from unittest import mock
+import unittest
+
+class TestCircuitBreaker(unittest.TestCase):
+    _now : float = 1000.0
+
+    def setUp(self) -> None:
+        self._now = 1000.0
+        patcher = mock.patch('app.circuit_breaker.time.monotonic',
+                    side_effect=lambda: self._now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_closed(self) -> None:
+        breaker = CircuitBreaker()
+
+        self.assertEqual(breaker.reserve(), 0)
+        self.assertEqual(breaker.state, CLOSED)
+
+    def test_backoff(self) -> None:
+        breaker = CircuitBreaker(failure_threshold=10, base_delay_sec=1,
+                    max_delay_sec=6)
+
+        # Each failure doubles the wait, give or take the jitter, up to the
+        # max
+        for full in (1, 2, 4, 6, 6):
+            breaker.record_failure()
+            delay = breaker.reserve()
+            self.assertGreaterEqual(delay, full / 2)
+            self.assertLessEqual(delay, full)
+
+        self._now += 6
+        self.assertEqual(breaker.reserve(), 0)
+
+    def test_opens(self) -> None:
+        breaker = CircuitBreaker(failure_threshold=3, open_sec=60)
+        for i in range(0, 3):
+            breaker.record_failure('Weiss')
+
+        self.assertEqual(breaker.state, OPEN)
+        self.assertEqual(breaker.reserve(), 60)
+
+        status = breaker.status()
+        self.assertEqual(status['state'], OPEN)
+        self.assertEqual(status['failures'], 3)
+        self.assertEqual(status['last_error'], 'Weiss')
+
+    def test_half_open(self) -> None:
+        breaker = CircuitBreaker(failure_threshold=1, open_sec=60)
+        breaker.record_failure()
+        self._now += 60
+
+        # Only one attempt gets through
+        self.assertEqual(breaker.reserve(), 0)
+        self.assertEqual(breaker.state, HALF_OPEN)
+        self.assertGreater(breaker.reserve(), 0)
+
+        # It failing opens the breaker again
+        breaker.record_failure()
+        self.assertEqual(breaker.state, OPEN)
+        self.assertEqual(breaker.status()['total_failures'], 2)
+
+    def test_success_closes(self) -> None:
+        breaker = CircuitBreaker(failure_threshold=1, open_sec=60)
+        breaker.record_failure()
+        self._now += 60
+        breaker.reserve()
+
+        breaker.record_success()
+        self.assertEqual(breaker.state, CLOSED)
+        self.assertEqual(breaker.reserve(), 0)
+        self.assertEqual(breaker.status()['failures'], 0)
+
+    def test_bad_settings(self) -> None:
+        with self.assertRaises(ValueError):
+            CircuitBreaker(failure_threshold=0)
+        with self.assertRaises(ValueError):
+            CircuitBreaker(base_delay_sec=10, max_delay_sec=1)
+
+class TestGetCircuitBreaker(unittest.TestCase):
+    def test_one_per_page(self) -> None:
+        with mock.patch.dict('app.circuit_breaker._circuit_breakers',
+                clear=True):
+            ruby = get_circuit_breaker('https://example.com/ruby')
+
+            self.assertIs(get_circuit_breaker('https://example.com/ruby'),
+                ruby)
+            self.assertIsNot(get_circuit_breaker('https://example.com/weiss'),
+                ruby)
+
+if __name__ == '__main__':
+    unittest.main()
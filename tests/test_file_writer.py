@@ -0,0 +1,334 @@
+from app.file_writer import FileWriter, WriteBehindFileWriter
+from threading import Event, Thread
+from unittest import mock
+import os, unittest
+
+class TestFileWriter(unittest.TestCase):
+    _filepath : str = './tests/output/fw_test'
+    _other_filepath : str = './tests/output/fw_test_other'
+    _fw : FileWriter = None
+
+    def setUp(self) -> None:
+        self.tearDown()
+
+        self._fw = FileWriter(self._filepath)
+
+    def tearDown(self) -> None:
+        if self._fw is not None:
+            self._fw.close()
+
+        for filepath in (self._filepath, self._other_filepath):
+            if os.path.isfile(filepath):
+                os.remove(filepath)
+
+    def test_write(self) -> None:
+        self._fw.write(b'Ruby ')
+        self._fw.write(b'Rose')
+
+        with open(self._filepath, 'rb') as f:
+            self.assertSequenceEqual(f.read(), b'Ruby Rose')
+
+    def test_keeps_file_open(self) -> None:
+        self.assertFalse(self._fw.is_open)
+
+        with mock.patch('builtins.open', wraps=open) as mockOpen:
+            self._fw.write(b'Ruby ')
+            self._fw.write(b'Rose')
+
+        self.assertTrue(self._fw.is_open)
+        self.assertEqual(mockOpen.call_count, 1)
+
+    def test_writev(self) -> None:
+        with mock.patch('os.writev', wraps=os.writev) as mockWritev:
+            self._fw.writev((b'Ruby ', memoryview(b'Rose'), b'', b'!'))
+
+        self.assertEqual(mockWritev.call_count, 1)
+        with open(self._filepath, 'rb') as f:
+            self.assertSequenceEqual(f.read(), b'Ruby Rose!')
+
+    def test_writev_partial(self) -> None:
+        realWritev = os.writev
+
+        def shortWritev(fd : int, buffers) -> int:
+            # Only ever write the first 3 bytes of what we're given
+            return realWritev(fd, [bytes(b''.join(buffers)[:3])])
+
+        with mock.patch('os.writev', side_effect=shortWritev):
+            self._fw.writev((b'Ruby ', b'Rose'))
+
+        with open(self._filepath, 'rb') as f:
+            self.assertSequenceEqual(f.read(), b'Ruby Rose')
+
+    def test_buffered_writev(self) -> None:
+        fw = FileWriter(self._filepath, buffer_size=1024)
+
+        try:
+            with mock.patch('os.writev') as mockWritev:
+                fw.writev((b'Ruby ', b'Rose'))
+                fw.flush()
+
+            self.assertEqual(mockWritev.call_count, 0)
+            with open(self._filepath, 'rb') as f:
+                self.assertSequenceEqual(f.read(), b'Ruby Rose')
+        finally:
+            fw.close()
+
+    def test_buffered_large_writev(self) -> None:
+        fw = FileWriter(self._other_filepath, buffer_size=8)
+        fw.rotate(self._filepath, preallocate_len=4096)
+
+        try:
+            with mock.patch('os.writev', wraps=os.writev) as mockWritev:
+                fw.write(b'Ruby ')
+                # Fills the buffer, so skips it
+                fw.writev((b'Rose ', b'and ', b'Yang'))
+                fw.write(b'!')
+
+            self.assertEqual(mockWritev.call_count, 1)
+            fw.close()
+            with open(self._filepath, 'rb') as f:
+                self.assertSequenceEqual(f.read(), b'Ruby Rose and Yang!')
+        finally:
+            fw.close()
+
+    def test_rotate(self) -> None:
+        self._fw.write(b'Ruby')
+        self._fw.filepath = self._other_filepath
+        self._fw.write(b'Rose')
+
+        with open(self._filepath, 'rb') as f:
+            self.assertSequenceEqual(f.read(), b'Ruby')
+        with open(self._other_filepath, 'rb') as f:
+            self.assertSequenceEqual(f.read(), b'Rose')
+
+    def test_preallocate(self) -> None:
+        self._fw.rotate(self._other_filepath, preallocate_len=4096)
+        self._fw.write(b'Ruby')
+
+        self.assertTrue(self._fw.preallocated)
+        self.assertEqual(os.path.getsize(self._other_filepath), 4096)
+
+        self._fw.write(b'Rose')
+        self._fw.close()
+
+        with open(self._other_filepath, 'rb') as f:
+            self.assertSequenceEqual(f.read(), b'RubyRose')
+
+    def test_preallocate_grow(self) -> None:
+        self._fw.rotate(self._other_filepath, preallocate_len=4)
+        self._fw.write(b'Ruby')
+        self._fw.write(b'Rose')
+
+        self.assertGreaterEqual(os.path.getsize(self._other_filepath), 8)
+
+        self._fw.filepath = self._filepath
+
+        with open(self._other_filepath, 'rb') as f:
+            self.assertSequenceEqual(f.read(), b'RubyRose')
+
+    def test_preallocate_existing_file(self) -> None:
+        with open(self._other_filepath, 'wb') as f:
+            f.write(b'Ruby')
+
+        self._fw.rotate(self._other_filepath, preallocate_len=4096)
+        self._fw.write(b'Rose')
+        self._fw.close()
+
+        with open(self._other_filepath, 'rb') as f:
+            self.assertSequenceEqual(f.read(), b'RubyRose')
+
+    def test_preallocate_write_error(self) -> None:
+        realWritev = os.writev
+
+        def failingWritev(fd : int, buffers) -> int:
+            # Get part of the way, then fail
+            realWritev(fd, [bytes(b''.join(buffers)[:2])])
+            raise OSError('Disk on fire')
+
+        self._fw.rotate(self._other_filepath, preallocate_len=4096)
+        self._fw.write(b'Ruby')
+        with mock.patch('os.writev', side_effect=failingWritev):
+            with self.assertRaises(OSError):
+                self._fw.write(b'Weiss')
+        self._fw.write(b'Rose')
+        self._fw.close()
+
+        with open(self._other_filepath, 'rb') as f:
+            self.assertSequenceEqual(f.read(), b'RubyRose')
+
+    def test_buffered_write(self) -> None:
+        fw = FileWriter(self._filepath, buffer_size=1024)
+
+        try:
+            fw.write(b'Ruby')
+
+            self.assertEqual(os.path.getsize(self._filepath), 0)
+
+            fw.flush()
+
+            self.assertEqual(os.path.getsize(self._filepath), 4)
+        finally:
+            fw.close()
+
+    def test_fsync_on_rotate(self) -> None:
+        fw = FileWriter(self._filepath, fsync_policy='on-rotate')
+
+        try:
+            with mock.patch('os.fsync') as mockFsync:
+                fw.write(b'Ruby')
+                self.assertEqual(mockFsync.call_count, 0)
+
+                fw.filepath = self._other_filepath
+                self.assertEqual(mockFsync.call_count, 1)
+        finally:
+            fw.close()
+
+    def test_fsync_interval(self) -> None:
+        fw = FileWriter(self._filepath, fsync_policy='interval', 
+                fsync_interval_sec=60)
+
+        try:
+            with mock.patch('os.fsync') as mockFsync:
+                fw.write(b'Ruby')
+                self.assertEqual(mockFsync.call_count, 0)
+
+                fw._last_fsync -= 60
+                fw.write(b'Rose')
+                self.assertEqual(mockFsync.call_count, 1)
+        finally:
+            fw.close()
+
+    def test_unknown_fsync_policy(self) -> None:
+        with self.assertRaises(ValueError) as cm:
+            FileWriter(self._filepath, fsync_policy='sometimes')
+
+        self.assertEqual(cm.exception.args[0], 
+            'Unknown fsync policy: sometimes')
+
+    def test_interval_fsync_policy_without_interval(self) -> None:
+        with self.assertRaises(ValueError) as cm:
+            FileWriter(self._filepath, fsync_policy='interval')
+
+        self.assertEqual(cm.exception.args[0], 
+            'The interval fsync policy needs a positive interval')
+
+class TestWriteBehindFileWriter(unittest.TestCase):
+    _filepath : str = './tests/output/wbfw_test'
+    _other_filepath : str = './tests/output/wbfw_test_other'
+    _wbfw : WriteBehindFileWriter = None
+
+    def setUp(self) -> None:
+        self._removeFiles()
+
+        self._wbfw = WriteBehindFileWriter(FileWriter(self._filepath), 
+                        high_water_mark=8)
+
+    def tearDown(self) -> None:
+        self._wbfw.stop()
+        self._removeFiles()
+
+    def _removeFiles(self) -> None:
+        for filepath in (self._filepath, self._other_filepath):
+            if os.path.isfile(filepath):
+                os.remove(filepath)
+
+    def test_write(self) -> None:
+        self._wbfw.write(b'Ruby ')
+        self._wbfw.write(b'Rose')
+        self._wbfw.flush()
+
+        self.assertEqual(self._wbfw.queued_bytes, 0)
+        self.assertEqual(self._wbfw.written_bytes, 9)
+        with open(self._filepath, 'rb') as f:
+            self.assertSequenceEqual(f.read(), b'Ruby Rose')
+
+    def test_writev(self) -> None:
+        self._wbfw.writev((b'Ruby ', b'Rose'))
+        self._wbfw.flush()
+
+        with open(self._filepath, 'rb') as f:
+            self.assertSequenceEqual(f.read(), b'Ruby Rose')
+
+    def test_writev_in_one_go(self) -> None:
+        with mock.patch('os.writev', wraps=os.writev) as mockWritev:
+            self._wbfw.writev((b'Ruby ', memoryview(b'Rose'), b'', b'!'))
+            self._wbfw.flush()
+
+        self.assertEqual(mockWritev.call_count, 1)
+        self.assertEqual(self._wbfw.written_bytes, 10)
+        with open(self._filepath, 'rb') as f:
+            self.assertSequenceEqual(f.read(), b'Ruby Rose!')
+
+    def test_write_copies(self) -> None:
+        b = bytearray(b'Ruby')
+
+        self._wbfw.write(memoryview(b))
+        b[:] = b'Yang'
+        self._wbfw.flush()
+
+        with open(self._filepath, 'rb') as f:
+            self.assertSequenceEqual(f.read(), b'Ruby')
+
+    def test_rotate(self) -> None:
+        self._wbfw.write(b'Ruby')
+        self._wbfw.filepath = self._other_filepath
+        self._wbfw.write(b'Rose')
+        self._wbfw.flush()
+
+        self.assertEqual(self._wbfw.filepath, self._other_filepath)
+        with open(self._filepath, 'rb') as f:
+            self.assertSequenceEqual(f.read(), b'Ruby')
+        with open(self._other_filepath, 'rb') as f:
+            self.assertSequenceEqual(f.read(), b'Rose')
+
+    def test_high_water_mark(self) -> None:
+        diskReady = Event()
+        realWritev = self._wbfw._file_writer.writev
+
+        def slowWritev(buffers) -> None:
+            diskReady.wait()
+            realWritev(buffers)
+
+        self._wbfw._file_writer.writev = slowWritev
+
+        self._wbfw.write(b'Ruby')
+        self._wbfw.write(b'Rose')
+        self.assertEqual(self._wbfw.blocked_count, 0)
+
+        writer = Thread(target=self._wbfw.write, args=(b'Yang',))
+        writer.start()
+        writer.join(0.1)
+
+        # Over the high-water mark, so the third write has to wait
+        self.assertTrue(writer.is_alive())
+        self.assertEqual(self._wbfw.peak_queued_bytes, 8)
+
+        diskReady.set()
+        writer.join(5)
+        self._wbfw.flush()
+
+        self.assertEqual(self._wbfw.blocked_count, 1)
+        self.assertGreater(self._wbfw.blocked_sec, 0)
+        with open(self._filepath, 'rb') as f:
+            self.assertSequenceEqual(f.read(), b'RubyRoseYang')
+
+    def test_oversized_write(self) -> None:
+        self._wbfw.write(b'Ruby Rose and Yang')
+        self._wbfw.flush()
+
+        self.assertEqual(self._wbfw.blocked_count, 0)
+        with open(self._filepath, 'rb') as f:
+            self.assertSequenceEqual(f.read(), b'Ruby Rose and Yang')
+
+    def test_flush_after_stop(self) -> None:
+        self._wbfw.write(b'Ruby')
+        self._wbfw.stop()
+        self._wbfw.join(5)
+
+        self._wbfw.flush()
+
+        with open(self._filepath, 'rb') as f:
+            self.assertSequenceEqual(f.read(), b'Ruby')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,136 @@
+from app.byte_buffer import ByteBuffer
+from app.hls import HlsSegmenter
+from test_adts import make_frame
+from unittest import mock
+import os, shutil, time, unittest
+
+class TestHlsSegmenter(unittest.TestCase):
+    _output_dir : str = './tests/output/hls'
+    _bb : ByteBuffer = None
+    _segmenter : HlsSegmenter = None
+
+    def setUp(self) -> None:
+        shutil.rmtree(self._output_dir, ignore_errors=True)
+
+        self._bb = ByteBuffer(1000, index_frames=True)
+        # Three 1024 sample frames at 44.1kHz make it past 0.05 seconds
+        self._segmenter = HlsSegmenter(self._bb, self._output_dir, 
+                            segment_duration_sec=0.05, playlist_length=2)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self._output_dir, ignore_errors=True)
+
+    def _appendFrames(self, count : int, start : int = 0) -> bytes:
+        # Fill each frame's payload so segments can be told apart
+        frames = b''
+        for i in range(start, start + count):
+            frame = bytearray(make_frame(100))
+            frame[7:] = bytes([i]) * 93
+            self._bb.append(frame)
+            frames += frame
+        return frames
+
+    def _readSegment(self, sequence : int) -> bytes:
+        with open(os.path.join(self._output_dir, 
+                f"segment_{sequence:06d}.aac"), 'rb') as f:
+            return f.read()
+
+    def _readPlaylist(self) -> str:
+        with open(self._segmenter.playlist_path) as f:
+            return f.read()
+
+    def test_segments(self) -> None:
+        frames = self._appendFrames(8)
+        self._segmenter.update()
+
+        self.assertEqual(len(self._segmenter.segments), 2)
+        self.assertSequenceEqual(self._readSegment(0), frames[:300])
+        self.assertSequenceEqual(self._readSegment(1), frames[300:600])
+
+        playlist = self._readPlaylist()
+        self.assertIn('#EXT-X-TARGETDURATION:1\n', playlist)
+        self.assertIn('#EXT-X-MEDIA-SEQUENCE:0\n', playlist)
+        self.assertIn(f"#EXTINF:{3 * 1024 / 44100:.3f},\nsegment_000000.aac\n",
+            playlist)
+        self.assertNotIn('#EXT-X-ENDLIST', playlist)
+
+    def test_starts_on_frame_boundary(self) -> None:
+        self._bb.append(b'Ruby Rose!')
+        frames = self._appendFrames(5)
+        self._segmenter.update()
+
+        self.assertSequenceEqual(self._readSegment(0), frames[:300])
+
+    def test_rolling_playlist(self) -> None:
+        self._appendFrames(8)
+        self._segmenter.update()
+        self._appendFrames(8, start=8)
+        self._segmenter.update()
+
+        self.assertEqual([segment.sequence 
+            for segment in self._segmenter.segments], [2, 3])
+        self.assertIn('#EXT-X-MEDIA-SEQUENCE:2\n', self._readPlaylist())
+
+    def test_old_segments_removed(self) -> None:
+        for i in range(4):
+            self._appendFrames(8, start=i * 8)
+            self._segmenter.update()
+
+        self.assertFalse(os.path.isfile(os.path.join(self._output_dir, 
+            'segment_000000.aac')))
+        self.assertTrue(os.path.isfile(os.path.join(self._output_dir, 
+            'segment_000006.aac')))
+
+    def test_discontinuity_after_overrun(self) -> None:
+        self._appendFrames(8)
+        self._segmenter.update()
+        # More than the whole buffer goes by before the next update
+        self._appendFrames(15, start=8)
+        self._segmenter.update()
+
+        # The segment that was open gets cut short, and the next one doesn't
+        # follow on from it
+        segments = self._segmenter.segments
+        self.assertEqual(segments[0].sequence, 3)
+        self.assertTrue(segments[0].discontinuity)
+        self.assertFalse(segments[1].discontinuity)
+        self.assertIn('#EXT-X-DISCONTINUITY\n', self._readPlaylist())
+
+    def test_skips_non_adts(self) -> None:
+        self._appendFrames(5)
+        self._segmenter.update()
+        # Sync is lost for more than a whole buffer
+        self._bb.append(b'Weiss' * 250)
+        self._segmenter.update()
+
+        self.assertEqual(self._segmenter._cursor.readable_length, 0)
+
+        # Whatever frames come after that start a new segment
+        frames = self._appendFrames(5, start=5)
+        self._segmenter.update()
+        self.assertSequenceEqual(self._readSegment(2), frames[:300])
+        self.assertTrue(self._segmenter.segments[-1].discontinuity)
+
+    def test_no_spin_without_frames(self) -> None:
+        self._bb.append(b'Weiss' * 250)
+        with mock.patch.object(self._segmenter, 'update', 
+                wraps=self._segmenter.update) as update:
+            self._segmenter.start()
+            time.sleep(0.5)
+            self._segmenter.stop(timeout=5)
+
+            self.assertLessEqual(update.call_count, 2)
+
+    def test_stop(self) -> None:
+        frames = self._appendFrames(5)
+        self._segmenter.start()
+        self._segmenter.stop(timeout=5)
+
+        self.assertFalse(self._segmenter.is_alive())
+        self.assertSequenceEqual(self._readSegment(1), frames[300:400])
+        self.assertTrue(self._readPlaylist().endswith('#EXT-X-ENDLIST\n'))
+        with self.assertRaises(KeyError):
+            self._bb.getCursor(f"hls:{self._output_dir}")
+
+if __name__ == '__main__':
+    unittest.main()
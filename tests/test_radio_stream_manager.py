@@ -0,0 +1,408 @@
+from app.byte_buffer import ByteBuffer, PersistentByteBuffer
+from app.circuit_breaker import OPEN, CircuitBreaker
+from app.radio_stream import RadioStream, RadioStreamManager, \
+    RedundantRadioStream
+from http.server import ThreadingHTTPServer
+from test_async_stream import _StreamHandler
+from threading import Lock, Thread
+from typing import List
+from unittest import mock
+import os, time, unittest
+
+class _ManagerTestCase(unittest.TestCase):
+    _server : ThreadingHTTPServer = None
+    _managers : List[RadioStreamManager] = None
+    _lookup_delay_sec : float = 0.5
+    _lookup_lock : Lock = None
+    _lookups_running : int = 0
+    _max_lookups_running : int = 0
+    _stream_path : str = '/live'
+
+    def setUp(self) -> None:
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), _StreamHandler)
+        Thread(target=self._server.serve_forever, daemon=True).start()
+
+        self._managers = []
+        self._lookup_lock = Lock()
+        self._lookups_running = 0
+        self._max_lookups_running = 0
+
+        # Stands in for the browser session that finds the stream URL
+        patcher = mock.patch('app.radio_stream.get_stream_url',
+                    side_effect=self._getStreamURL)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        # Keep one test's failures from holding up the next one's streams
+        patcher = mock.patch.dict('app.circuit_breaker._circuit_breakers',
+                    clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self) -> None:
+        for rsm in self._managers:
+            rsm.stop()
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _getStreamURL(self, page_url : str) -> str:
+        with self._lookup_lock:
+            self._lookups_running += 1
+            self._max_lookups_running = max(self._max_lookups_running,
+                                            self._lookups_running)
+        time.sleep(self._lookup_delay_sec)
+        with self._lookup_lock:
+            self._lookups_running -= 1
+        return self._url(self._stream_path)
+
+    def _url(self, path : str) -> str:
+        return f"http://127.0.0.1:{self._server.server_port}{path}"
+
+    def _waitFor(self, predicate, timeout : float = 5) -> bool:
+        end = time.monotonic() + timeout
+        while not predicate() and time.monotonic() < end:
+            time.sleep(0.01)
+        return predicate()
+
+    def _manager(self, **kwargs) -> RadioStreamManager:
+        kwargs.setdefault('redundant_max_age_sec', 3600)
+        rsm = RadioStreamManager('page', **kwargs)
+        self._managers.append(rsm)
+        return rsm
+
+    def _streamCount(self, rsm : RadioStreamManager) -> int:
+        with rsm._radio_stream_lock:
+            return len(rsm._redundant_radio_streams)
+
+    def _startedManager(self, **kwargs) -> RadioStreamManager:
+        rsm = self._manager(**kwargs)
+        rsm.start()
+        self.assertTrue(self._waitFor(lambda: 
+            rsm.primary_radio_stream is not None and 
+                self._streamCount(rsm) == kwargs.get('redundancy', 2)))
+        return rsm
+
+class TestRadioStreamManagerStartup(_ManagerTestCase):
+    def test_parallel_start(self) -> None:
+        rsm = self._manager(redundancy=3)
+        start = time.monotonic()
+        rsm.start()
+
+        self.assertTrue(self._waitFor(lambda:
+            rsm.primary_radio_stream is not None and
+                self._streamCount(rsm) == 3))
+
+        # One after another, the four lookups would take 2 seconds
+        self.assertLess(time.monotonic() - start, 1.5)
+        self.assertEqual(self._max_lookups_running, 4)
+        self.assertIsInstance(rsm.primary_radio_stream, RadioStream)
+
+    def test_lock_not_held_while_starting(self) -> None:
+        rsm = self._manager(redundancy=2)
+        rsm.start()
+        self.assertTrue(self._waitFor(lambda: self._lookups_running > 0))
+
+        start = time.monotonic()
+        rsm.primary_radio_stream
+        self.assertLess(time.monotonic() - start, 0.1)
+
+    def test_max_concurrent_starts(self) -> None:
+        self._lookup_delay_sec = 0.1
+        rsm = self._manager(redundancy=2, max_concurrent_starts=1)
+        rsm.start()
+
+        self.assertTrue(self._waitFor(lambda: self._streamCount(rsm) == 2))
+        self.assertEqual(self._max_lookups_running, 1)
+
+    def test_bad_max_concurrent_starts(self) -> None:
+        with self.assertRaises(ValueError):
+            RadioStreamManager('page', max_concurrent_starts=0)
+
+    def test_replace_dead_standby(self) -> None:
+        self._lookup_delay_sec = 0.1
+        rsm = self._manager(redundancy=2)
+        rsm.start()
+        self.assertTrue(self._waitFor(lambda: self._streamCount(rsm) == 2))
+
+        with rsm._radio_stream_lock:
+            oldStream = rsm._redundant_radio_streams[0]
+        oldStream.stop()
+
+        self.assertTrue(self._waitFor(lambda: self._streamCount(rsm) == 2
+            and oldStream not in rsm._redundant_radio_streams))
+
+class TestRadioStreamExit(_ManagerTestCase):
+    def test_on_exit(self) -> None:
+        exited = []
+        stream = RadioStream(stream_url=self._url('/stream'), preroll_len=100,
+                    on_exit=exited.append)
+        stream.start()
+        stream.join(5)
+
+        self.assertEqual(exited, [stream])
+        self.assertIsNotNone(stream.ended_at)
+
+class TestRadioStreamManagerSupervision(_ManagerTestCase):
+    _lookup_delay_sec : float = 0.05
+
+    def test_failover_on_exit(self) -> None:
+        rsm = self._startedManager(redundancy=2)
+        oldPRS = rsm.primary_radio_stream
+
+        oldPRS.stop()
+
+        self.assertTrue(self._waitFor(lambda: rsm.failover_count == 1))
+        self.assertIsNot(rsm.primary_radio_stream, oldPRS)
+        self.assertEqual(len(rsm.failover_latencies), 1)
+        # Well under the old 250 ms polling interval
+        self.assertLess(rsm.failover_latencies[0], 0.1)
+
+    def test_no_idle_wakeups(self) -> None:
+        rsm = self._startedManager(redundancy=2, stall_grace_sec=0)
+        time.sleep(0.1)
+
+        with mock.patch.object(rsm, '_restore_redundancy', 
+                wraps=rsm._restore_redundancy) as restore:
+            time.sleep(1)
+            self.assertEqual(restore.call_count, 0)
+
+            with rsm._radio_stream_lock:
+                rsm._redundant_radio_streams[0].stop()
+            self.assertTrue(self._waitFor(lambda: restore.call_count > 0))
+
+class TestRadioStreamManagerWatchdog(_ManagerTestCase):
+    _lookup_delay_sec : float = 0.05
+
+    def test_stalled_primary(self) -> None:
+        self._stream_path = '/stall'
+        rsm = self._manager(redundancy=1, stall_grace_sec=1)
+        rsm.start()
+        self.assertTrue(self._waitFor(
+            lambda: rsm.primary_radio_stream is not None))
+        oldPRS = rsm.primary_radio_stream
+
+        # The stalled streams still look alive, but get dropped anyway
+        self._stream_path = '/live'
+        self.assertTrue(self._waitFor(lambda: rsm.failover_count == 1 and 
+            rsm.primary_radio_stream.stream_url.endswith('/live')))
+        self.assertIsNot(rsm.primary_radio_stream, oldPRS)
+        self.assertGreaterEqual(rsm.stall_count, 2)
+
+    def test_min_bitrate(self) -> None:
+        # The local stream runs at about 13 Mbps
+        slow = self._startedManager(redundancy=1, stall_grace_sec=1,
+                    min_bitrate_kbps=1000)
+        fast = self._startedManager(redundancy=1, stall_grace_sec=1,
+                    min_bitrate_kbps=100000)
+
+        self.assertTrue(self._waitFor(lambda: fast.stall_count > 0))
+        self.assertEqual(slow.stall_count, 0)
+
+    def test_negative_min_bitrate(self) -> None:
+        with self.assertRaises(ValueError):
+            self._manager(min_bitrate_kbps=-1)
+
+class TestRadioStreamManagerBackoff(_ManagerTestCase):
+    _lookup_delay_sec : float = 0
+
+    def _failingLookup(self, page_url : str) -> str:
+        self._getStreamURL(page_url)
+        raise RuntimeError("Failed to get a stream URL")
+
+    def test_backoff(self) -> None:
+        lookups = mock.Mock(side_effect=self._failingLookup)
+        breaker = CircuitBreaker(failure_threshold=3, base_delay_sec=0.2,
+                    open_sec=60)
+        with mock.patch('app.radio_stream.get_stream_url', lookups):
+            rsm = self._manager(redundancy=1, circuit_breaker=breaker)
+            rsm.start()
+            self.assertTrue(self._waitFor(lambda: breaker.state == OPEN))
+
+            # Once it's open, nothing else is tried for a good while
+            calls = lookups.call_count
+            time.sleep(1)
+            self.assertEqual(lookups.call_count, calls)
+            self.assertLessEqual(calls, 4)
+            self.assertIs(rsm.circuit_breaker, breaker)
+
+    def test_recovers(self) -> None:
+        breaker = CircuitBreaker(failure_threshold=1, open_sec=0.5)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, OPEN)
+
+        rsm = self._manager(redundancy=1, circuit_breaker=breaker)
+        rsm.start()
+        self.assertTrue(self._waitFor(
+            lambda: rsm.primary_radio_stream is not None))
+        self.assertTrue(self._waitFor(
+            lambda: breaker.status()['failures'] == 0))
+
+    def test_failover_while_open(self) -> None:
+        breaker = CircuitBreaker(failure_threshold=1, open_sec=60)
+        rsm = self._startedManager(redundancy=3, circuit_breaker=breaker)
+        self.assertTrue(self._waitFor(lambda: 
+            all(stream.ready for stream in rsm.radio_streams)))
+
+        # Losing a standby while the breaker is open means a replacement
+        # waiting out the breaker, which mustn't hold up failing over
+        breaker.record_failure()
+        oldPRS = rsm.primary_radio_stream
+        rsm.radio_streams[-1].stop()
+        self.assertTrue(self._waitFor(lambda: self._streamCount(rsm) == 2))
+        oldPRS.stop()
+
+        self.assertTrue(self._waitFor(lambda: rsm.failover_count == 1,
+            timeout=1))
+        self.assertIsNot(rsm.primary_radio_stream, oldPRS)
+        self.assertEqual(breaker.state, OPEN)
+
+    def test_stream_that_never_gets_going(self) -> None:
+        self._stream_path = '/missing'
+        breaker = CircuitBreaker(failure_threshold=2, base_delay_sec=0.1,
+                    open_sec=60)
+        rsm = self._manager(redundancy=1, circuit_breaker=breaker)
+        rsm.start()
+
+        # The URL lookups work, but the streams end straight away
+        self.assertTrue(self._waitFor(lambda: breaker.state == OPEN))
+
+class TestRadioStreamManagerRefresh(_ManagerTestCase):
+    _lookup_delay_sec : float = 0.05
+
+    def _sampleWhile(self, rsm : RadioStreamManager, 
+            duration_sec : float) -> List[int]:
+        counts = []
+        end = time.monotonic() + duration_sec
+        while time.monotonic() < end:
+            counts.append(self._streamCount(rsm))
+            time.sleep(0.01)
+        return counts
+
+    def test_make_before_break(self) -> None:
+        rsm = self._startedManager(redundancy=2, redundant_max_age_sec=1)
+        oldStreams = rsm.radio_streams[1:]
+
+        self._max_lookups_running = 0
+        counts = self._sampleWhile(rsm, 3)
+
+        # Every old stream was replaced without ever going without it
+        self.assertFalse(any(stream in oldStreams 
+            for stream in rsm.radio_streams))
+        self.assertGreaterEqual(min(counts), 2)
+        self.assertEqual(self._max_lookups_running, 1)
+
+    def test_staggered_ages(self) -> None:
+        rsm = self._startedManager(redundancy=2, redundant_max_age_sec=4)
+        oldStreams = rsm.radio_streams[1:]
+
+        # Both started together, but only one is refreshed at first
+        self.assertTrue(self._waitFor(lambda: any(stream not in oldStreams 
+            for stream in rsm.radio_streams[1:]), timeout=5))
+        self.assertEqual(sum(1 for stream in rsm.radio_streams[1:] 
+            if stream in oldStreams), 1)
+
+    def test_no_refresh(self) -> None:
+        rsm = self._startedManager(redundancy=2, redundant_max_age_sec=0)
+        oldStreams = rsm.radio_streams[1:]
+
+        time.sleep(1.5)
+        self.assertEqual(rsm.radio_streams[1:], oldStreams)
+        self.assertIsNone(rsm._next_refresh_sec())
+
+class TestRedundantRadioStreamFailover(_ManagerTestCase):
+    _lookup_delay_sec : float = 0.05
+
+    def test_resume_after_failover(self) -> None:
+        rrs = RedundantRadioStream('page', redundancy=1, 
+                redundant_max_age_sec=3600)
+        self._managers.append(rrs)
+        rrs.start()
+        self.assertTrue(self._waitFor(
+            lambda: rrs.byte_buffer.write_offset > 0))
+
+        rrs._radio_stream_manager.primary_radio_stream.stop()
+        self.assertTrue(self._waitFor(lambda: rrs.failover_count == 1))
+
+        # The transfer loop moves on to the new primary straight away,
+        # rather than once its wait on the old one times out
+        offset = rrs.byte_buffer.write_offset
+        self.assertTrue(self._waitFor(
+            lambda: rrs.byte_buffer.write_offset > offset, timeout=0.5))
+
+class TestRedundantRadioStreamTransfer(unittest.TestCase):
+    _filepath : str = './tests/output/rrs_transfer'
+
+    def setUp(self) -> None:
+        if os.path.isfile(self._filepath):
+            os.remove(self._filepath)
+
+    tearDown = setUp
+
+    def test_source_unlocked_during_disk_writes(self) -> None:
+        pbb = PersistentByteBuffer(self._filepath, 10)
+        rrs = RedundantRadioStream('page', byte_buffer=pbb, 
+                cache_buffer_size=20, sync_len=2)
+        source = ByteBuffer(20)
+        source.append(b'Ruby Rose!Yang Xiao')
+        pbb.append(b'Weiss')
+
+        # Try the source's lock from another thread, like its ingest would
+        locked = []
+        def writeToFile(*buffers) -> None:
+            def tryLock() -> None:
+                acquired = source.byte_array_lock.acquire(blocking=False)
+                locked.append(not acquired)
+                if acquired:
+                    source.byte_array_lock.release()
+            t = Thread(target=tryLock)
+            t.start()
+            t.join()
+
+        with mock.patch.object(pbb, '_writeToFile', 
+                side_effect=writeToFile):
+            self.assertEqual(rrs._transferUpToSyncLength(source), 17)
+
+        self.assertTrue(locked)
+        self.assertFalse(any(locked))
+        self.assertEqual(pbb.read(), b'se!Yang Xi')
+
+    def test_source_shrinks_during_disk_writes(self) -> None:
+        pbb = PersistentByteBuffer(self._filepath, 10)
+        rrs = RedundantRadioStream('page', byte_buffer=pbb, 
+                cache_buffer_size=20, sync_len=2)
+        source = ByteBuffer(20)
+        source.append(b'Ruby Rose!Yang Xiao')
+
+        realMakeRoom = pbb.makeRoom
+        def makeRoom(length : int) -> None:
+            realMakeRoom(length)
+            # Like the source taking back unread space for its next read
+            if source.readable_length > 4:
+                source.commit(source.readable_length - 4)
+
+        with mock.patch.object(pbb, 'makeRoom', side_effect=makeRoom):
+            self.assertEqual(rrs._transferUpToSyncLength(source), 2)
+
+        self.assertEqual(pbb.read(), b'Xi')
+
+    def test_keeps_timestamps(self) -> None:
+        dest = ByteBuffer(20)
+        rrs = RedundantRadioStream('page', byte_buffer=dest, 
+                cache_buffer_size=20, sync_len=2)
+        source = ByteBuffer(20)
+
+        # Start partway through the source's ring, so that it wraps
+        source.append(b'Weiss Schnee', 99.0)
+        source.read(12)
+        for i, b in enumerate((b'Ruby ', b'Rose!', b'Yang ', b'Xiao')):
+            source.append(b, 100.0 + i)
+
+        self.assertEqual(rrs._transferUpToSyncLength(source), 17)
+
+        self.assertEqual(dest.read(), b'Ruby Rose!Yang Xi')
+        for offset, timestamp in ((0, 100.0), (4, 100.0), (5, 101.0), 
+                (10, 102.0), (16, 103.0)):
+            self.assertEqual(dest.time_index.timestampAt(offset), timestamp)
+
+if __name__ == '__main__':
+    unittest.main()
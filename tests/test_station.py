@@ -0,0 +1,127 @@
+from app.station import StationConfig, StationRecorder, \
+    parse_station_configs, record_schedule, wait_until
+from datetime import datetime, timedelta
+from threading import Event, Timer
+from unittest import mock
+import os, time, unittest
+
+class TestParseStationConfigs(unittest.TestCase):
+    def test_parse(self) -> None:
+        configs = parse_station_configs({
+            'defaults': {'redundancy': 3},
+            'stations': [
+                {'id': 'rwby', 'page_url': 'https://example.com/rwby',
+                    'start_date': '2021-11-01 06:00:00',
+                    'end_date': '2021-11-01 10:00:00'},
+                {'id': 'jnpr', 'page_url': 'https://example.com/jnpr',
+                    'redundancy': 1, 'output_dir': '/tmp/jnpr'}
+            ]
+        }, output_dir='./output')
+
+        self.assertEqual(configs[0], StationConfig('rwby', 
+            'https://example.com/rwby', os.path.join('./output', 'rwby'), 
+            redundancy=3, start_date=datetime(2021, 11, 1, 6), 
+            end_date=datetime(2021, 11, 1, 10)))
+        self.assertEqual(configs[1].redundancy, 1)
+        self.assertEqual(configs[1].output_dir, '/tmp/jnpr')
+
+    def test_no_stations(self) -> None:
+        with self.assertRaises(ValueError):
+            parse_station_configs({'stations': []})
+
+    def test_missing_page_url(self) -> None:
+        with self.assertRaises(ValueError):
+            parse_station_configs({'stations': [{'id': 'rwby'}]})
+
+    def test_duplicate_id(self) -> None:
+        station = {'id': 'rwby', 'page_url': 'https://example.com/rwby'}
+        with self.assertRaises(ValueError):
+            parse_station_configs({'stations': [station, station]})
+
+    def test_unknown_setting(self) -> None:
+        with self.assertRaises(ValueError):
+            parse_station_configs({'stations': [{'id': 'rwby', 
+                'page_url': 'https://example.com/rwby', 'redundncy': 2}]})
+
+    def test_bad_date(self) -> None:
+        with self.assertRaises(ValueError):
+            parse_station_configs({'stations': [{'id': 'rwby', 
+                'page_url': 'https://example.com/rwby', 
+                'end_date': 'tomorrow'}]})
+
+    def test_ends_before_start(self) -> None:
+        with self.assertRaises(ValueError):
+            parse_station_configs({'stations': [{'id': 'rwby', 
+                'page_url': 'https://example.com/rwby', 
+                'start_date': '2021-11-01 10:00:00',
+                'end_date': '2021-11-01 06:00:00'}]})
+
+class TestWaitUntil(unittest.TestCase):
+    def test_stop_event(self) -> None:
+        stopEvent = Event()
+        Timer(0.1, stopEvent.set).start()
+
+        start = time.monotonic()
+        wait_until(datetime.now() + timedelta(minutes=1), stopEvent)
+
+        self.assertLess(time.monotonic() - start, 5)
+
+    def test_record_schedule_stopped(self) -> None:
+        stopEvent = Event()
+        stopEvent.set()
+        prrs = mock.MagicMock()
+
+        record_schedule(prrs, './output', stop_event=stopEvent)
+
+        prrs.rotateAt.assert_not_called()
+
+class TestStationRecorder(unittest.TestCase):
+    _output_dir : str = './tests/output'
+
+    def _config(self, station_id : str) -> StationConfig:
+        return StationConfig(station_id, f"https://example.com/{station_id}", 
+                    self._output_dir)
+
+    def test_failure_is_isolated(self) -> None:
+        good = mock.MagicMock()
+        good.should_write = False
+
+        def createPRRS(filepath, page_url, **kwargs):
+            if page_url.endswith('bad'):
+                raise RuntimeError('Failed to get a stream URL')
+            return good
+
+        with mock.patch('app.station.PersistentRedundantRadioStream', 
+                side_effect=createPRRS):
+            bad = StationRecorder(self._config('bad'))
+            ok = StationRecorder(self._config('ok'))
+            bad.start()
+            ok.start()
+
+            bad.join(timeout=5)
+            self.assertFalse(bad.is_alive())
+            self.assertIsInstance(bad.error, RuntimeError)
+            self.assertTrue(ok.is_alive())
+
+            ok.stop()
+            ok.join(timeout=5)
+
+        self.assertFalse(ok.is_alive())
+        self.assertIsNone(ok.error)
+        good.start.assert_called_once()
+        good.writeAll.assert_called_once()
+        good.stop.assert_called_once()
+
+    def test_options_passed_on(self) -> None:
+        with mock.patch('app.station.PersistentRedundantRadioStream') as prrs:
+            recorder = StationRecorder(self._config('ok'), 
+                            {'file_buffer_size': 1024})
+            recorder.start()
+            recorder.stop()
+            recorder.join(timeout=5)
+
+        self.assertEqual(prrs.call_args.kwargs['file_buffer_size'], 1024)
+        self.assertEqual(prrs.call_args.kwargs['redundancy'], 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,146 @@
+from app.byte_buffer import ByteBuffer
+from app.stream_health import estimate_bytes_lost, is_starved, \
+    measure_health, pick_failover_stream, received_since, sync_reference
+import time, unittest
+
+class _Stream:
+    byte_buffer : ByteBuffer = None
+    alive : bool = True
+
+    def __init__(self, alive : bool = True) -> None:
+        self.byte_buffer = ByteBuffer(100)
+        self.alive = alive
+
+    def is_alive(self) -> bool:
+        return self.alive
+
+class TestMeasureHealth(unittest.TestCase):
+    def test_no_data(self) -> None:
+        health = measure_health(ByteBuffer(100))
+
+        self.assertIsNone(health.byte_rate)
+        self.assertIsNone(health.idle_sec)
+        self.assertIsNone(health.has_sync)
+        self.assertTrue(health.stalled)
+
+    def test_rate_and_idle(self) -> None:
+        now = time.time()
+        bb = ByteBuffer(100)
+        bb.append(b'Ruby', now - 3)
+        bb.append(b'Rose', now - 1)
+
+        health = measure_health(bb)
+        self.assertAlmostEqual(health.byte_rate, 2)
+        self.assertAlmostEqual(health.idle_sec, 1, places=1)
+        self.assertEqual(health.readable_length, 8)
+        self.assertFalse(health.stalled)
+
+    def test_sync_and_lag(self) -> None:
+        now = time.time()
+        bb = ByteBuffer(100)
+        bb.append(b'Ruby', now - 2)
+        bb.append(b'Rose', now - 1)
+
+        health = measure_health(bb, b'byRo', now - 1.5)
+        self.assertTrue(health.has_sync)
+        self.assertAlmostEqual(health.lag_sec, 0.5)
+
+        self.assertFalse(measure_health(bb, b'Weiss').has_sync)
+
+    def test_sync_reference(self) -> None:
+        bb = ByteBuffer(100)
+        bb.append(b'Ruby', 100.0)
+        bb.append(b'Rose', 101.0)
+
+        self.assertEqual(sync_reference(bb, 3), (b'ose', 101.0))
+        self.assertEqual(sync_reference(bb, 9), (None, None))
+
+class TestThroughput(unittest.TestCase):
+    def test_received_since(self) -> None:
+        bb = ByteBuffer(100)
+        bb.append(b'Ruby', 100.0)
+        bb.append(b'Rose', 101.0)
+
+        self.assertEqual(received_since(bb, 100.5), 4)
+        self.assertEqual(received_since(bb, 99.0), 8)
+        self.assertEqual(received_since(bb, 102.0), 0)
+
+    def test_is_starved(self) -> None:
+        now = time.time()
+        bb = ByteBuffer(100)
+        bb.append(b'Ruby', now - 5)
+        bb.append(b'Rose', now - 0.5)
+
+        self.assertFalse(is_starved(bb, now - 10, 0, 2))
+        self.assertTrue(is_starved(bb, now - 10, 3, 2))
+        self.assertTrue(is_starved(bb, now - 10, 0, 0.25))
+
+    def test_young_stream_not_starved(self) -> None:
+        self.assertFalse(is_starved(ByteBuffer(100), time.time() - 1, 0, 2))
+        self.assertFalse(is_starved(ByteBuffer(100), time.time() - 10, 0, 0))
+
+    def test_estimate_bytes_lost(self) -> None:
+        old = ByteBuffer(100)
+        old.append(b'Ruby', 100.0)
+        old.append(b'Rose', 102.0)
+        new = ByteBuffer(100)
+        new.append(b'Weiss', 105.0)
+
+        # A 3 second gap at 2 bytes per second
+        self.assertEqual(estimate_bytes_lost(old, new), 6)
+
+        overlapping = ByteBuffer(100)
+        overlapping.append(b'Weiss', 101.0)
+        self.assertEqual(estimate_bytes_lost(old, overlapping), 0)
+        self.assertEqual(estimate_bytes_lost(ByteBuffer(100), new), 0)
+
+class TestPickFailoverStream(unittest.TestCase):
+    _primary : _Stream = None
+    _now : float = 0
+
+    def setUp(self) -> None:
+        self._now = time.time()
+        self._primary = _Stream()
+        self._primary.byte_buffer.append(b'Ruby Rose', self._now - 0.5)
+
+    def _stream(self, *chunks, alive : bool = True) -> _Stream:
+        # Each chunk is (bytes, seconds ago)
+        stream = _Stream(alive)
+        for b, ago in chunks:
+            stream.byte_buffer.append(b, self._now - ago)
+        return stream
+
+    def test_prefers_sync(self) -> None:
+        unsynced = self._stream((b'Weiss Schnee', 0.1))
+        synced = self._stream((b'Ruby Rose', 0.4))
+
+        self.assertIs(pick_failover_stream([unsynced, synced],
+            self._primary, 4), synced)
+
+    def test_prefers_least_lag(self) -> None:
+        behind = self._stream((b'Ruby Rose', 0.1))
+        ahead = self._stream((b'Ruby Rose', 1), (b'!', 0.1))
+
+        self.assertIs(pick_failover_stream([behind, ahead],
+            self._primary, 4), ahead)
+
+    def test_skips_stalled(self) -> None:
+        stalled = self._stream((b'Ruby Rose', 10))
+        live = self._stream((b'Weiss', 0.1))
+
+        self.assertIs(pick_failover_stream([stalled, live],
+            self._primary, 4), live)
+
+    def test_skips_dead(self) -> None:
+        dead = self._stream((b'Ruby Rose', 0.1), alive=False)
+
+        self.assertIsNone(pick_failover_stream([dead], self._primary, 4))
+
+    def test_no_primary(self) -> None:
+        short = self._stream((b'Ruby', 0.1))
+        long = self._stream((b'Ruby Rose', 0.1))
+
+        self.assertIs(pick_failover_stream([short, long]), long)
+
+if __name__ == '__main__':
+    unittest.main()
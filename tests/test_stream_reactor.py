@@ -0,0 +1,160 @@
+from app.radio_stream import RadioStreamManager, ReactorRadioStream
+from app.stream_reactor import StreamReactor
+from http.server import ThreadingHTTPServer
+from test_async_stream import BODY, _StreamHandler
+from threading import Event, Thread
+from unittest import mock
+import socket, ssl, time, unittest
+
+class _ReactorTestCase(unittest.TestCase):
+    _reactor : StreamReactor = None
+
+    def setUp(self) -> None:
+        self._reactor = StreamReactor()
+
+    def tearDown(self) -> None:
+        self._reactor.stop()
+
+    def _waitFor(self, predicate, timeout : float = 5) -> bool:
+        end = time.monotonic() + timeout
+        while not predicate() and time.monotonic() < end:
+            time.sleep(0.01)
+        return predicate()
+
+class TestStreamReactor(_ReactorTestCase):
+
+    def test_callback(self) -> None:
+        a, b = socket.socketpair()
+        readable = Event()
+        received = []
+
+        def onReadable() -> None:
+            try:
+                received.append(a.recv(4096))
+                readable.set()
+            except BlockingIOError:
+                pass
+
+        self._reactor.register(a, onReadable)
+        b.send(b'Ruby Rose!')
+
+        self.assertTrue(readable.wait(5))
+        self.assertEqual(received, [b'Ruby Rose!'])
+
+        self._reactor.unregister(a)
+        a.close()
+        b.close()
+
+    def test_call_doesnt_starve_sockets(self) -> None:
+        a, b = socket.socketpair()
+        readable = Event()
+        calls = []
+
+        # Keeps asking to be called again, like a busy SSL stream would
+        def again() -> None:
+            calls.append(True)
+            if not readable.is_set():
+                self._reactor.call(again)
+
+        self._reactor.register(a, readable.set)
+        self._reactor.call(again)
+        b.send(b'Ruby Rose!')
+
+        self.assertTrue(readable.wait(5))
+        self.assertGreater(len(calls), 0)
+
+        self._reactor.unregister(a)
+        a.close()
+        b.close()
+
+    def test_unregister_closed(self) -> None:
+        a, b = socket.socketpair()
+        self._reactor.register(a, lambda: None)
+        a.close()
+        b.close()
+        self._reactor.unregister(a)
+
+        self.assertTrue(self._waitFor(
+            lambda: self._reactor.socket_count == 0))
+        self.assertTrue(self._reactor.is_alive())
+
+class TestReactorRadioStream(_ReactorTestCase):
+    _server : ThreadingHTTPServer = None
+
+    def setUp(self) -> None:
+        super().setUp()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), _StreamHandler)
+        Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def tearDown(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+        super().tearDown()
+
+    def _url(self, path : str) -> str:
+        return f"http://127.0.0.1:{self._server.server_port}{path}"
+
+    def _readStream(self, path : str) -> ReactorRadioStream:
+        stream = ReactorRadioStream(stream_url=self._url(path), 
+                    buffer_size=len(BODY), preroll_len=100, 
+                    reactor=self._reactor)
+        stream.start()
+        self.assertTrue(self._waitFor(lambda: not stream.is_alive()))
+        return stream
+
+    def test_read(self) -> None:
+        stream = self._readStream('/stream')
+
+        self.assertEqual(bytes(stream.byte_buffer.read()), BODY[100:])
+        self.assertFalse(stream.ident)
+
+    def test_chunked_falls_back_to_thread(self) -> None:
+        stream = self._readStream('/chunked')
+
+        self.assertEqual(bytes(stream.byte_buffer.read()), BODY[100:])
+        self.assertTrue(stream.ident)
+
+    def test_stop(self) -> None:
+        stream = ReactorRadioStream(stream_url=self._url('/live'), 
+                    preroll_len=0, reactor=self._reactor)
+        stream.start()
+        self.assertTrue(stream.is_alive())
+        self.assertTrue(self._waitFor(
+            lambda: stream.byte_buffer.readable_length > 0))
+
+        stream.stop()
+
+        self.assertFalse(stream.is_alive())
+        self.assertTrue(self._waitFor(
+            lambda: self._reactor.socket_count == 0))
+
+    def test_drain_comes_back_for_ssl_pending(self) -> None:
+        reactor = mock.Mock()
+        stream = ReactorRadioStream(stream_url=self._url('/live'), 
+                    reactor=reactor)
+        stream._sock = mock.Mock(spec=ssl.SSLSocket)
+        stream._sock.recv_into.side_effect = lambda view: len(view)
+        stream._alive = True
+
+        stream._sock.pending.return_value = 0
+        stream._drain()
+        reactor.call.assert_not_called()
+
+        # More is already decrypted, but the socket won't look readable
+        stream._sock.pending.return_value = 100
+        stream._drain()
+        reactor.call.assert_called_once_with(stream._drain)
+
+    def test_manager(self) -> None:
+        with mock.patch('app.radio_stream.get_stream_url', 
+                return_value=self._url('/live')):
+            rsm = RadioStreamManager('page', redundancy=2, 
+                    redundant_max_age_sec=3600, reactor=self._reactor)
+            rsm.start()
+
+            self.assertTrue(self._waitFor(
+                lambda: self._reactor.socket_count == 3))
+            self.assertIsInstance(rsm.primary_radio_stream, ReactorRadioStream)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+from app.station import StationConfig
+from app.supervisor import StationSupervisor, shard_stations
+from datetime import datetime
+import json, os, time, unittest
+
+_OUTPUT_DIR = './tests/output'
+_CRASH_MARKER = os.path.join(_OUTPUT_DIR, 'supervisor_crashed')
+
+def _config(station_id : str, end_date : datetime = None) -> StationConfig:
+    return StationConfig(station_id, f"https://example.com/{station_id}",
+                os.path.join(_OUTPUT_DIR, station_id), end_date=end_date)
+
+def _crash_once_worker(worker_id, configs, prrs_options, engine,
+        max_browsers, status_queue, log_queue, log_level, stop_event) -> None:
+    # Spawned workers can't share mocks, so remember the crash on disk
+    if not os.path.exists(_CRASH_MARKER):
+        open(_CRASH_MARKER, 'w').close()
+        os._exit(3)
+
+    status_queue.put({'worker': worker_id, 'pid': os.getpid(),
+        'time': time.time(), 'stations': {config.station_id: {
+            'alive': False, 'error': None, 'recording': False,
+            'filepath': None, 'recorded_bytes': 10, 'byte_rate': None,
+            'failovers': 0, 'last_failover_latency_sec': None,
+            'stalls': 0, 'bytes_lost': 0, 'circuit_breaker': None}
+            for config in configs}})
+
+def _idle_worker(worker_id, configs, prrs_options, engine,
+        max_browsers, status_queue, log_queue, log_level, stop_event) -> None:
+    stop_event.wait(60)
+
+class TestShardStations(unittest.TestCase):
+    def test_even(self) -> None:
+        configs = [_config(str(i)) for i in range(0, 5)]
+        shards = shard_stations(configs, 2)
+
+        self.assertEqual([[c.station_id for c in shard] for shard in shards],
+            [['0', '2', '4'], ['1', '3']])
+
+    def test_more_workers_than_stations(self) -> None:
+        shards = shard_stations([_config('rwby')], 4)
+        self.assertEqual(len(shards), 1)
+
+    def test_no_workers(self) -> None:
+        with self.assertRaises(ValueError):
+            shard_stations([_config('rwby')], 0)
+
+class TestStationSupervisor(unittest.TestCase):
+    _status_filepath : str = os.path.join(_OUTPUT_DIR, 'status.json')
+
+    def setUp(self) -> None:
+        for path in (_CRASH_MARKER, self._status_filepath):
+            if os.path.exists(path):
+                os.remove(path)
+
+    tearDown = setUp
+
+    def test_finished_stations(self) -> None:
+        # Both stations are already over, so the workers should finish
+        # without ever opening a stream
+        past = datetime(2021, 11, 1)
+        supervisor = StationSupervisor([_config('rwby', past),
+                        _config('jnpr', past)], workers=2,
+                        status_filepath=self._status_filepath)
+        supervisor.start()
+        supervisor.run(poll_interval_sec=0.1)
+
+        self.assertTrue(supervisor.is_finished())
+        status = supervisor.status()
+        self.assertEqual(set(status['stations']), {'rwby', 'jnpr'})
+        self.assertEqual(status['totals']['worker_restarts'], 0)
+        self.assertEqual(status['totals']['stations_recording'], 0)
+
+        with open(self._status_filepath) as f:
+            self.assertEqual(json.load(f)['totals']['stations'], 2)
+
+    def test_restart_crashed_worker(self) -> None:
+        supervisor = StationSupervisor([_config('rwby')], workers=1,
+                        restart_delay_sec=0.1,
+                        worker_target=_crash_once_worker)
+        supervisor.start()
+        supervisor.run(poll_interval_sec=0.1)
+
+        status = supervisor.status()
+        self.assertEqual(status['workers'][0]['restarts'], 1)
+        self.assertEqual(status['totals']['recorded_bytes'], 10)
+
+    def test_stop(self) -> None:
+        supervisor = StationSupervisor([_config('rwby')], workers=1,
+                        worker_target=_idle_worker)
+        supervisor.start()
+
+        start = time.monotonic()
+        supervisor.stop(timeout=10)
+        supervisor.run(poll_interval_sec=0.1)
+
+        self.assertLess(time.monotonic() - start, 10)
+        self.assertTrue(supervisor.is_finished())
+        self.assertFalse(supervisor.status()['workers'][0]['alive'])
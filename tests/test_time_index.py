@@ -0,0 +1,93 @@
+from app.time_index import TimeIndex
+import unittest
+
+class TestTimeIndex(unittest.TestCase):
+    _ti : TimeIndex = None
+
+    def setUp(self) -> None:
+        self._ti = TimeIndex()
+        self._ti.add(100.0, 0)
+        self._ti.add(101.0, 8192)
+        self._ti.add(102.0, 16384)
+
+    def test_len(self) -> None:
+        self.assertEqual(len(self._ti), 3)
+
+    def test_offset_at(self) -> None:
+        self.assertEqual(self._ti.offsetAt(100.5), 8192)
+
+    def test_offset_at_exact(self) -> None:
+        self.assertEqual(self._ti.offsetAt(101.0), 8192)
+
+    def test_offset_at_before_first(self) -> None:
+        self.assertEqual(self._ti.offsetAt(50.0), 0)
+
+    def test_offset_at_after_last(self) -> None:
+        self.assertIsNone(self._ti.offsetAt(102.5))
+
+    def test_timestamp_at(self) -> None:
+        self.assertEqual(self._ti.timestampAt(8191), 100.0)
+        self.assertEqual(self._ti.timestampAt(8192), 101.0)
+        self.assertEqual(self._ti.timestampAt(20000), 102.0)
+
+    def test_samples_between(self) -> None:
+        self.assertEqual(self._ti.samplesBetween(4096, 16385), 
+            [(4096, 100.0), (8192, 101.0), (16384, 102.0)])
+        self.assertEqual(self._ti.samplesBetween(8192, 16384), 
+            [(8192, 101.0)])
+
+    def test_samples_between_evicted(self) -> None:
+        self._ti.evict(10000)
+
+        self.assertEqual(self._ti.samplesBetween(100, 9000), 
+            [(100, None), (8192, 101.0)])
+
+    def test_add_same_timestamp(self) -> None:
+        self._ti.add(102.0, 20000)
+
+        self.assertEqual(len(self._ti), 3)
+        self.assertEqual(self._ti.timestampAt(20000), 102.0)
+
+    def test_add_backwards_timestamp(self) -> None:
+        self._ti.add(99.0, 20000)
+
+        self.assertEqual(len(self._ti), 3)
+
+    def test_add_backwards_offset(self) -> None:
+        with self.assertRaises(ValueError) as cm:
+            self._ti.add(103.0, 100)
+
+        self.assertEqual(cm.exception.args[0], 
+            'Offsets must not go backwards')
+
+    def test_byte_rate(self) -> None:
+        self.assertEqual(self._ti.byteRate(), 8192)
+
+    def test_byte_rate_one_sample(self) -> None:
+        ti = TimeIndex()
+        ti.add(100.0, 0)
+
+        self.assertIsNone(ti.byteRate())
+
+    def test_last_timestamp(self) -> None:
+        self.assertEqual(self._ti.lastTimestamp(), 102.0)
+        self.assertIsNone(TimeIndex().lastTimestamp())
+
+    def test_evict(self) -> None:
+        self._ti.evict(10000)
+
+        self.assertEqual(len(self._ti), 2)
+        self.assertEqual(self._ti.timestampAt(10000), 101.0)
+        self.assertIsNone(self._ti.timestampAt(100))
+
+    def test_evict_compaction(self) -> None:
+        for i in range(3, 200):
+            self._ti.add(100.0 + i, i * 8192)
+            self._ti.evict((i - 1) * 8192)
+
+        self.assertEqual(len(self._ti), 2)
+        self.assertLess(len(self._ti._offsets), 200)
+        self.assertEqual(self._ti.offsetAt(298.5), 199 * 8192)
+
+if __name__ == '__main__':
+    unittest.main()